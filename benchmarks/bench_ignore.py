@@ -0,0 +1,90 @@
+# benchmarks/bench_ignore.py
+"""
+Compare the compiled gitignore matcher with the original substring checks.
+
+Usage:
+    python benchmarks/bench_ignore.py [num_paths] [num_patterns]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gitignore import IgnoreRules, is_ignored  # noqa: E402
+
+# The original check is O(paths x patterns), so time it on a sample and scale up
+LEGACY_SAMPLE = 10000
+
+
+def check_ignore_patterns_substring(path, ignore_patterns):
+    for pattern in ignore_patterns:
+        if pattern.lower() in path.lower():
+            return True
+
+        if '*' in pattern:
+            pattern_parts = pattern.split('*')
+            if pattern_parts[0] and pattern_parts[1] and pattern_parts[0] in path and pattern_parts[-1] in path:
+                return True
+    return False
+
+
+def make_paths(num_paths, rng):
+    directories = [f"pkg{i}/module{j}" for i in range(50) for j in range(20)]
+    extensions = ['.py', '.txt', '.md', '.json', '.pyc', '.log', '.csv']
+    return [
+        f"{rng.choice(directories)}/file{i}{rng.choice(extensions)}"
+        for i in range(num_paths)
+    ]
+
+
+def make_patterns(num_patterns, rng):
+    patterns = []
+    for i in range(num_patterns):
+        kind = i % 5
+        if kind == 0:
+            patterns.append(f"generated{i}")
+        elif kind == 1:
+            patterns.append(f"*.ext{i}")
+        elif kind == 2:
+            patterns.append(f"/pkg{rng.randrange(50, 100)}/")
+        elif kind == 3:
+            patterns.append(f"pkg{rng.randrange(50)}/**/cache{i}")
+        else:
+            patterns.append(f"!keep{i}.py")
+    return patterns + ['*.pyc', '*.log']
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    num_paths = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    num_patterns = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    rng = random.Random(0)
+    paths = make_paths(num_paths, rng)
+    patterns = make_patterns(num_patterns, rng)
+
+    rules, compile_seconds = timed(IgnoreRules, patterns)
+    chain = [('', rules)]
+    ignored, seconds = timed(lambda: sum(is_ignored(path, chain) for path in paths))
+    # walk_tree() prunes ignored directories, so it only matches each entry itself
+    _, entry_seconds = timed(lambda: [rules.match(path) for path in paths])
+
+    sample = paths[:LEGACY_SAMPLE]
+    _, legacy_seconds = timed(lambda: sum(check_ignore_patterns_substring(path, patterns) for path in sample))
+    legacy_seconds *= len(paths) / len(sample)
+
+    print(f"{len(paths)} paths, {len(patterns)} patterns, {ignored} ignored")
+    print(f"compile:   {compile_seconds:.3f}s")
+    print(f"compiled:  {seconds:.3f}s (every parent directory checked too)")
+    print(f"compiled:  {entry_seconds:.3f}s (entries only, as when walking)")
+    print(f"substring: {legacy_seconds:.3f}s (estimated from {len(sample)} paths)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# benchmarks/bench_token_estimate.py
+"""
+Compare the speed and accuracy of approximate_tokens with the exact tiktoken count.
+
+Usage:
+    python benchmarks/bench_token_estimate.py [directory ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from openai_api import approximate_tokens, get_encoding  # noqa: E402
+
+# Token counts of tiny files are dominated by rounding
+MIN_FILE_BYTES = 200
+SKIPPED_DIRECTORIES = {'.git', '.venv', 'node_modules', '__pycache__'}
+
+
+def read_texts(directories):
+    texts = []
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if d not in SKIPPED_DIRECTORIES]
+            for file in files:
+                try:
+                    with open(os.path.join(root, file), encoding='utf-8') as f:
+                        text = f.read()
+                except (OSError, UnicodeDecodeError):
+                    continue
+                if len(text) >= MIN_FILE_BYTES:
+                    texts.append(text)
+    return texts
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    directories = sys.argv[1:] or [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')]
+    texts = read_texts(directories)
+    if not texts:
+        print("No text files found.")
+        return
+    num_bytes = sum(len(text.encode('utf-8')) for text in texts)
+    encoding = get_encoding('gpt2')
+
+    start = time.perf_counter()
+    exact = [len(encoding.encode_ordinary(text)) for text in texts]
+    exact_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    approximate = [approximate_tokens(text) for text in texts]
+    approximate_seconds = time.perf_counter() - start
+
+    ratios = sorted(e / max(a, 1) for e, a in zip(exact, approximate))
+    print(f"{len(texts)} files, {num_bytes / 1024 / 1024:.1f}MB, {sum(exact)} tokens")
+    print(f"exact:       {exact_seconds:.3f}s ({num_bytes / 1024 / 1024 / exact_seconds:.1f}MB/s)")
+    print(f"approximate: {approximate_seconds:.3f}s ({num_bytes / 1024 / 1024 / approximate_seconds:.1f}MB/s, "
+          f"{exact_seconds / approximate_seconds:.1f}x faster)")
+    print(f"total exact / approximate: {sum(exact) / sum(approximate):.3f}")
+    print("per file exact / approximate: "
+          + ", ".join(f"p{round(p * 100)} {percentile(ratios, p):.3f}" for p in (0.01, 0.05, 0.5, 0.95, 0.99)))
+
+
+if __name__ == '__main__':
+    main()
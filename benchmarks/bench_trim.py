@@ -0,0 +1,69 @@
+# benchmarks/bench_trim.py
+"""
+Compare trim_string_to_token_limit with the original line-at-a-time trimming.
+
+Usage:
+    python benchmarks/bench_trim.py [max_bytes]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from openai_api import estimate_tokens, trim_string_to_token_limit  # noqa: E402
+
+# The original implementation is quadratic, so stop timing it past this size
+LEGACY_MAX_BYTES = 128 * 1024
+
+
+def trim_one_line_at_a_time(string, max_tokens):
+    if estimate_tokens(string) <= max_tokens:
+        return string
+
+    split_string = string.split('\n')
+    if len(split_string) == 1:
+        split_string = string.split(' ')
+
+    while estimate_tokens(split_string) > max_tokens:
+        split_string.pop()
+
+    return ' '.join(split_string)
+
+
+def make_text(num_bytes):
+    line = "def function_{0}(argument, other_argument):  # return the sum of both arguments\n"
+    lines = []
+    size = 0
+    while size < num_bytes:
+        lines.append(line.format(len(lines)))
+        size += len(lines[-1])
+    return ''.join(lines)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    max_bytes = int(sys.argv[1]) if len(sys.argv) > 1 else 5 * 1024 * 1024
+    max_tokens = 2000
+
+    print(f"{'size':>10} {'trim (s)':>10} {'legacy (s)':>11}")
+    num_bytes = 16 * 1024
+    while num_bytes <= max_bytes:
+        text = make_text(num_bytes)
+        trimmed, seconds = timed(trim_string_to_token_limit, text, max_tokens)
+        legacy = '-'
+        if num_bytes <= LEGACY_MAX_BYTES:
+            expected, legacy_seconds = timed(trim_one_line_at_a_time, text, max_tokens)
+            assert trimmed == expected
+            legacy = f"{legacy_seconds:.3f}"
+        print(f"{num_bytes // 1024:>8}KB {seconds:>10.3f} {legacy:>11}")
+        num_bytes *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# benchmarks/bench_workers.py
+"""
+Time reading and parsing Python files with --workers 1, 2, 4 and 8.
+
+Usage:
+    python benchmarks/bench_workers.py [num_files]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from summary import _extract_python_chunk, extract_python_summaries  # noqa: E402
+
+FUNCTION = '''
+def function_{i}(alpha, beta, gamma=None, *args, **kwargs):
+    """Docstring {i}."""
+    values = [alpha * index + beta for index in range({i})]
+    return {{key: value for key, value in zip(values, args)}} or gamma
+'''
+
+CLASS = '''
+class Class{i}:
+    def __init__(self, name):
+        self.name = name
+
+    def method_{i}(self, value):
+        return [self.name, value, {i}]
+'''
+
+
+def make_files(dir_path, num_files):
+    file_paths = []
+    for n in range(num_files):
+        file_path = os.path.join(dir_path, f"module_{n}.py")
+        with open(file_path, 'w') as f:
+            f.write(''.join((FUNCTION if i % 3 else CLASS).format(i=i) for i in range(60)))
+        file_paths.append(file_path)
+    return file_paths
+
+
+def main():
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    with tempfile.TemporaryDirectory() as dir_path:
+        file_paths = make_files(dir_path, num_files)
+
+        start = time.perf_counter()
+        serial = _extract_python_chunk(file_paths)
+        serial_seconds = time.perf_counter() - start
+        print(f"{num_files} files, {os.cpu_count()} CPUs")
+        print(f"in process: {serial_seconds:.2f}s")
+
+        for workers in (1, 2, 4, 8):
+            start = time.perf_counter()
+            extracted = extract_python_summaries(file_paths, workers)
+            seconds = time.perf_counter() - start
+            assert list(extracted.values()) == serial
+            print(f"workers={workers}: {seconds:.2f}s, {serial_seconds / seconds:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
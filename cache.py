@@ -1,32 +1,446 @@
 # src/cache.py
-import pickle
-import os
+import atexit
 import hashlib
-
+import os
+import pickle
+import sqlite3
 import sys
+import threading
+import time
 
 # Determine the path to cache.py
 cache_dir = os.path.join(os.path.dirname(os.path.abspath(sys.modules[__name__].__file__)), '..', 'cache')
-os.makedirs(cache_dir, exist_ok=True)
-cache_file = os.path.join(cache_dir, "cache.pkl")
+cache_file = os.path.join(cache_dir, "cache.db")
+legacy_cache_file = os.path.join(cache_dir, "cache.pkl")
+
+# Size limits, overridable with CODESUMMA_CACHE_MAX_BYTES, CODESUMMA_CACHE_MAX_ENTRIES
+# and CODESUMMA_CACHE_TTL (seconds). A limit of 0 disables it.
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_TTL = 0
+
+# Digests of files modified this recently are not reused, since a second write
+# within the same mtime tick would go unnoticed
+DIGEST_MIN_AGE = 2
+
+# Seconds to wait for another process to release the database
+LOCK_TIMEOUT = 60
+
+# Compact the database once at least this share of its pages are free
+COMPACT_FREE_RATIO = 0.25
+COMPACT_MIN_FREE_PAGES = 256
 
 
 def hash_key(prompt_object):
     return hashlib.sha256(str(prompt_object).encode()).hexdigest()
 
 
-def load_cache():
-    if not os.path.exists(cache_file):
-        return {}
+def file_digest(file_path):
+    """
+    Get the SHA-256 digest of a file's content.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        str: The hex digest of the file's content.
+    """
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+class ResponseCache:
+    """
+    A persistent response cache backed by SQLite.
+
+    Every entry is stored as its own row, so saving a response costs a single
+    insert instead of re-pickling the whole cache. The database is only opened
+    on first access, and runs in write-ahead-log mode so several processes can
+    read and write it at once. Entries older than `ttl` seconds are dropped, and the least
+    recently used entries are evicted once the cache grows past `max_bytes` or
+    `max_entries`.
+    """
+
+    def __init__(self, path=None, max_bytes=None, max_entries=None, ttl=None):
+        self.path = path or cache_file
+        self.max_bytes = _env_int("CODESUMMA_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES) if max_bytes is None else max_bytes
+        self.max_entries = (_env_int("CODESUMMA_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+                            if max_entries is None else max_entries)
+        self.ttl = _env_int("CODESUMMA_CACHE_TTL", DEFAULT_TTL) if ttl is None else ttl
+        self.hits = 0
+        self.misses = 0
+        self._accessed = {}
+        self._digests = {}
+        self._connection = None
+        self._pid = None
+        self._lock = threading.RLock()
+        self._compaction = None
+
+    def _connect(self):
+        with self._lock:
+            if self._connection is not None and self._pid != os.getpid():
+                # Connections must not be shared with forked worker processes
+                self._connection = None
+                self._accessed.clear()
+                self._digests.clear()
+                self.hits = 0
+                self.misses = 0
+            if self._connection is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, check_same_thread=False)
+                # Write-ahead logging lets readers carry on while another process writes
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                # Take the write lock up front so concurrent processes set up the schema one at a time
+                connection.execute("BEGIN IMMEDIATE")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value BLOB NOT NULL)"
+                )
+                columns = [row[1] for row in connection.execute("PRAGMA table_info(responses)")]
+                if "size" not in columns:
+                    now = time.time()
+                    connection.execute("ALTER TABLE responses ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+                    connection.execute("ALTER TABLE responses ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+                    connection.execute("ALTER TABLE responses ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0")
+                    connection.execute(
+                        "UPDATE responses SET size = length(value), created_at = ?, accessed_at = ?", (now, now)
+                    )
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+                )
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS file_digests "
+                    "(path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, digest TEXT NOT NULL)"
+                )
+                self._import_legacy_cache(connection)
+                connection.commit()
+                self._connection = connection
+                self._pid = os.getpid()
+                atexit.register(self.close)
+                self.prune()
+                self._maybe_compact()
+            return self._connection
+
+    def _import_legacy_cache(self, connection):
+        """
+        Move the entries of an old whole-file pickle cache into the database.
+        """
+
+        legacy_path = os.path.join(os.path.dirname(self.path), "cache.pkl")
+        try:
+            with open(legacy_path, "rb") as f:
+                legacy_cache = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # Missing, or already imported by another process
+            return
+
+        now = time.time()
+        rows = []
+        for key, value in legacy_cache.items():
+            data = pickle.dumps(value)
+            rows.append((key, data, len(data), now, now))
+        connection.executemany(
+            "INSERT OR IGNORE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        os.remove(legacy_path)
+
+    def _maybe_compact(self):
+        """
+        Reclaim free pages in a background thread once enough have piled up.
+        """
+
+        page_count = self._connection.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = self._connection.execute("PRAGMA freelist_count").fetchone()[0]
+        if free_pages < COMPACT_MIN_FREE_PAGES or free_pages < page_count * COMPACT_FREE_RATIO:
+            return
+
+        self._compaction = threading.Thread(target=self.compact, daemon=True)
+        self._compaction.start()
+
+    def compact(self):
+        """
+        Rewrite the database file without its free pages.
+        """
+
+        connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+        try:
+            connection.execute("VACUUM")
+        except sqlite3.OperationalError:
+            # Another writer holds the database, try again on the next run
+            pass
+        finally:
+            connection.close()
+
+    def get(self, key, default=None):
+        connection = self._connect()
+        with self._lock:
+            row = connection.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            if row is None or (self.ttl and row[1] < now - self.ttl):
+                self.misses += 1
+                return default
+            self.hits += 1
+            # Access times are written in batches by flush()
+            self._accessed[key] = now
+        return pickle.loads(row[0])
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        connection = self._connect()
+        data = pickle.dumps(value)
+        now = time.time()
+        with self._lock:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+            connection.commit()
+            self._accessed.pop(key, None)
+
+    def __contains__(self, key):
+        connection = self._connect()
+        with self._lock:
+            row = connection.execute(
+                "SELECT 1 FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None
+
+    def __len__(self):
+        connection = self._connect()
+        with self._lock:
+            return connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def file_digest(self, file_path, size=None, mtime_ns=None):
+        """
+        Get the SHA-256 digest of a file's content. The digest recorded for the
+        file is reused without reading it while its size and mtime are unchanged.
+
+        Args:
+            file_path (str): The path to the file.
+            size (int, optional): The file's size, if already known.
+            mtime_ns (int, optional): The file's modification time in
+                nanoseconds, if already known.
+
+        Returns:
+            str: The hex digest of the file's content.
+        """
+
+        path = os.path.abspath(file_path)
+        if size is None or mtime_ns is None:
+            stat_result = os.stat(path)
+            size, mtime_ns = stat_result.st_size, stat_result.st_mtime_ns
+
+        connection = self._connect()
+        with self._lock:
+            recorded = self._digests.get(path)
+            if recorded is None:
+                recorded = connection.execute(
+                    "SELECT size, mtime_ns, digest FROM file_digests WHERE path = ?", (path,)
+                ).fetchone()
+        if recorded is not None and recorded[0] == size and recorded[1] == mtime_ns:
+            return recorded[2]
+
+        digest = file_digest(path)
+        if mtime_ns < (time.time() - DIGEST_MIN_AGE) * 1e9:
+            with self._lock:
+                # Written in batches by flush()
+                self._digests[path] = (size, mtime_ns, digest)
+        return digest
 
-    with open(cache_file, "rb") as f:
-        cache = pickle.load(f)
-    return cache
+    def prune(self, max_bytes=None, max_entries=None, ttl=None):
+        """
+        Drop expired entries, then evict the least recently used entries until
+        the cache fits within its size limits.
 
+        Args:
+            max_bytes (int, optional): Override the maximum total entry size.
+            max_entries (int, optional): Override the maximum number of entries.
+            ttl (int, optional): Override the maximum entry age in seconds.
 
-def save_cache(cache):
-    with open(cache_file, "wb") as f:
-        pickle.dump(cache, f)
+        Returns:
+            int: The number of entries removed.
+        """
+
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_entries = self.max_entries if max_entries is None else max_entries
+        ttl = self.ttl if ttl is None else ttl
+
+        connection = self._connect()
+        with self._lock:
+            # Hold the write lock so concurrent processes do not evict the same entries twice
+            connection.execute("BEGIN IMMEDIATE")
+            self._flush_accessed()
+            removed = 0
+            if ttl:
+                removed += connection.execute(
+                    "DELETE FROM responses WHERE created_at < ?", (time.time() - ttl,)
+                ).rowcount
+
+            count, total_size = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            excess_entries = count - max_entries if max_entries else 0
+            excess_bytes = total_size - max_bytes if max_bytes else 0
+
+            if excess_entries > 0 or excess_bytes > 0:
+                evict = []
+                for key, size in connection.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed_at"
+                ):
+                    if excess_entries <= 0 and excess_bytes <= 0:
+                        break
+                    evict.append((key,))
+                    excess_entries -= 1
+                    excess_bytes -= size
+                connection.executemany("DELETE FROM responses WHERE key = ?", evict)
+                removed += len(evict)
+
+            connection.commit()
+        return removed
+
+    def clear(self):
+        """
+        Remove every entry and reset the hit statistics.
+        """
+
+        connection = self._connect()
+        with self._lock:
+            self._accessed.clear()
+            self._digests.clear()
+            self.hits = 0
+            self.misses = 0
+            connection.execute("DELETE FROM responses")
+            connection.execute("DELETE FROM file_digests")
+            connection.execute("DELETE FROM stats")
+            connection.commit()
+        self.compact()
+
+    def stats(self):
+        """
+        Get the size and hit rate of the cache.
+
+        Returns:
+            dict: The number of entries, their total size, the size of the
+                database file and the lifetime hit and miss counts.
+        """
+
+        connection = self._connect()
+        with self._lock:
+            self.flush()
+            entries, total_size, oldest, newest = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), MIN(created_at), MAX(created_at) FROM responses"
+            ).fetchone()
+            counters = dict(connection.execute("SELECT name, value FROM stats"))
+
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        lookups = hits + misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "entry_bytes": total_size,
+            "file_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "oldest": oldest,
+            "newest": newest,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+    def _flush_accessed(self):
+        if self._accessed:
+            self._connection.executemany(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in self._accessed.items()],
+            )
+            self._accessed.clear()
+
+    def flush(self):
+        """
+        Write pending access times, file digests and hit/miss counts to the database.
+        """
+
+        with self._lock:
+            if self._connection is None:
+                return
+            self._flush_accessed()
+            if self._digests:
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO file_digests (path, size, mtime_ns, digest) VALUES (?, ?, ?, ?)",
+                    [(path,) + recorded for path, recorded in self._digests.items()],
+                )
+                self._digests.clear()
+            for name, value in (("hits", self.hits), ("misses", self.misses)):
+                if value:
+                    self._connection.execute(
+                        "INSERT INTO stats (name, value) VALUES (?, ?) "
+                        "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                        (name, value),
+                    )
+            self.hits = 0
+            self.misses = 0
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self.prune()
+                self.flush()
+                self._connection.close()
+                self._connection = None
+
+
+_default_cache = None
+
+
+def load_cache(path=None):
+    """
+    Get the response cache. Nothing is read until the first lookup.
+
+    Args:
+        path (str, optional): The path to the cache database.
+
+    Returns:
+        ResponseCache: The response cache.
+    """
+
+    return ResponseCache(path)
+
+
+def get_default_cache():
+    """
+    Get the response cache shared by the API calls and the file summaries.
+
+    Returns:
+        ResponseCache: The shared response cache.
+    """
+
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = load_cache()
+    return _default_cache
 
 
 def get_cache(prompt_object, cache):
@@ -37,4 +451,48 @@ def get_cache(prompt_object, cache):
 def set_cache(prompt_object, response, cache):
     key = hash_key(prompt_object)
     cache[key] = response
-    save_cache(cache)
+
+
+def format_bytes(num_bytes):
+    """
+    Format a byte count for display.
+
+    Args:
+        num_bytes (int): The number of bytes.
+
+    Returns:
+        str: The byte count with a binary unit.
+    """
+
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if num_bytes < 1024 or unit == "GiB":
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+
+def run_cache_command(args):
+    """
+    Run a `codesumma cache` subcommand.
+
+    Args:
+        args (argparse.Namespace): The arguments from parse_cache_arguments().
+    """
+
+    cache = load_cache(args.path)
+
+    if args.command == "stats":
+        stats = cache.stats()
+        print(f"Cache: {stats['path']}")
+        print(f"Entries: {stats['entries']}")
+        print(f"Entry size: {format_bytes(stats['entry_bytes'])}")
+        print(f"File size: {format_bytes(stats['file_bytes'])}")
+        print(f"Hits: {stats['hits']}, misses: {stats['misses']}, hit rate: {stats['hit_rate']:.1%}")
+    elif args.command == "prune":
+        removed = cache.prune(args.max_bytes, args.max_entries, args.ttl)
+        cache.compact()
+        print(f"Removed {removed} entries.")
+    elif args.command == "clear":
+        cache.clear()
+        print("Cleared the cache.")
+
+    cache.close()
@@ -1,10 +1,483 @@
 # src/file_processing.py
+import codecs
+import fnmatch
+import io
+import mmap
 import os
+import stat
 import tempfile
-import pandas as pd
+import threading
+from collections import namedtuple
+from cache import format_bytes
+from gitignore import compile_patterns, is_ignored, match_path, read_gitignore
+from pipeline import Pipeline, Stage
+from preview import is_preview_file, preview
+from sniff import BINARY_EXTENSIONS, SNIFF_BYTES, TEXT_EXTENSIONS, detect_encoding, file_extension
 
+# The mode of submodule entries in the git index
+GITLINK_MODE = 0o160000
 
-def get_file_hierarchy(path, prefix='', ignore_patterns=None):
+_blob_lock = threading.Lock()
+
+# Files are cut after this many bytes by --all and --print-full, unless
+# --max-file-bytes is given
+MAX_FILE_BYTES = 1024 * 1024
+# Files larger than this are memory-mapped instead of read
+MMAP_MIN_BYTES = 1024 * 1024
+TRUNCATION_MARKER = "\n... [truncated {num_bytes}]\n"
+
+
+class FileRecord(namedtuple('FileRecord', ['path', 'relative_path', 'kind', 'depth', 'size', 'mtime_ns', 'blob'],
+                            defaults=(None,))):
+    """
+    A file or directory in a FileIndex.
+
+    Attributes:
+        path (str): The path to the file, joined onto the indexed path.
+        relative_path (str): The '/' separated path relative to the indexed path.
+        kind (str): 'file' or 'directory'.
+        depth (int): The number of directories between the indexed path and
+            the entry, 0 for the indexed path itself.
+        size (int): The file's size in bytes, 0 for directories.
+        mtime_ns (int): The file's modification time in nanoseconds, 0 for directories.
+        blob (git.Blob): The file's content in the git object database, when
+            indexed from a git revision. None for files read from disk.
+    """
+
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return os.path.basename(self.relative_path) or os.path.basename(self.path)
+
+    @property
+    def mtime(self):
+        return self.mtime_ns / 1e9
+
+
+class FileIndex:
+    """
+    An in-memory index of the files and directories under a path, in sorted
+    pre-order, built in a single scan. The file hierarchy, the summaries and
+    the full code collectors all read from the same index, so they agree on
+    which files exist and are ignored.
+    """
+
+    def __init__(self, path, records, ignored_file_count=0):
+        """
+        Args:
+            path (str): The indexed file or directory.
+            records (list): The FileRecords, starting with the indexed path itself
+                unless it is ignored.
+            ignored_file_count (int, optional): The number of files skipped by
+                the ignore patterns. Directories below ignored directories are
+                not listed, so their files are not counted. Defaults to 0.
+        """
+
+        self.path = path
+        self.records = records
+        self.ignored_file_count = ignored_file_count
+
+    @classmethod
+    def scan(cls, path, ignore_patterns):
+        """
+        Index a file or directory.
+
+        Args:
+            path (str): The path to the file or directory.
+            ignore_patterns (list): A list of patterns to ignore.
+
+        Returns:
+            FileIndex: The index.
+        """
+
+        records = []
+        ignored_file_count = 0
+
+        if os.path.isfile(path):
+            if not check_ignore_patterns(os.path.basename(path), ignore_patterns, is_dir=False):
+                stat_result = os.stat(path)
+                records.append(FileRecord(path, os.path.basename(path), 'file', 0,
+                                          stat_result.st_size, stat_result.st_mtime_ns))
+        elif os.path.isdir(path):
+            # The indexed directory itself is never ignored, only what is below it
+            records.append(FileRecord(path, '', 'directory', 0, 0, 0))
+
+            def count_ignored(entry):
+                nonlocal ignored_file_count
+                if not entry.is_dir(follow_symlinks=False):
+                    ignored_file_count += 1
+
+            for entry, relative_path, depth in walk_tree(path, ignore_patterns, count_ignored):
+                if entry.is_dir(follow_symlinks=False):
+                    records.append(FileRecord(entry.path, relative_path, 'directory', depth, 0, 0))
+                    continue
+                try:
+                    stat_result = entry.stat()
+                except OSError:
+                    continue
+                records.append(FileRecord(entry.path, relative_path, 'file', depth,
+                                          stat_result.st_size, stat_result.st_mtime_ns))
+
+        return cls(path, records, ignored_file_count)
+
+    @classmethod
+    def from_git_index(cls, path, ignore_patterns):
+        """
+        Index the files tracked by git under a directory, reading the git index
+        instead of walking the worktree.
+
+        The sizes and mtimes are the ones recorded in the index. Files that
+        differ from the index in the worktree, as reported by `git diff`, are
+        stat'ed instead, and dropped if they were deleted. Untracked files,
+        submodules and empty directories are not listed. .gitignore files do
+        not apply to tracked files, but the ignore patterns do.
+
+        Args:
+            path (str): The path to a directory in a git worktree.
+            ignore_patterns (list): A list of patterns to ignore.
+
+        Returns:
+            FileIndex: The index.
+
+        Raises:
+            git.InvalidGitRepositoryError: If the path is not in a git worktree.
+        """
+
+        from git import Repo
+
+        repo = Repo(path, search_parent_directories=True)
+        prefix = os.path.relpath(os.path.abspath(path), repo.working_tree_dir).replace(os.sep, '/')
+        prefix = '' if prefix == '.' else f"{prefix}/"
+        changed_paths = {diff.a_path for diff in repo.index.diff(None)}
+
+        tracked = {}
+        for (entry_path, _), entry in repo.index.entries.items():
+            # Submodules are tracked as commits, not files
+            if entry_path.startswith(prefix) and stat.S_IFMT(entry.mode) != GITLINK_MODE:
+                tracked[entry_path[len(prefix):]] = entry
+        repo.close()
+
+        def file_details(relative_path, file_path):
+            entry = tracked[relative_path]
+            if prefix + relative_path in changed_paths:
+                try:
+                    stat_result = os.stat(file_path)
+                except OSError:
+                    return None
+                return stat_result.st_size, stat_result.st_mtime_ns, None
+            seconds, nanoseconds = entry.mtime
+            return entry.size, seconds * 1_000_000_000 + nanoseconds, None
+
+        return cls.from_paths(path, tracked, ignore_patterns, file_details)
+
+    @classmethod
+    def from_git_tree(cls, path, rev, ignore_patterns):
+        """
+        Index the files under a directory at a git revision, reading the tree
+        from the object database without checking it out.
+
+        The records carry their git Blob, which open_file() reads from the
+        object database. Their mtimes are 0. Submodules are not listed.
+
+        Args:
+            path (str): The path to a directory in a git repository. Only its
+                place in the repository is used, not its content.
+            rev (str): The branch, tag or commit to read, such as 'main' or 'HEAD~3'.
+            ignore_patterns (list): A list of patterns to ignore.
+
+        Returns:
+            FileIndex: The index.
+
+        Raises:
+            git.InvalidGitRepositoryError: If the path is not in a git repository.
+            git.BadName: If the revision does not exist.
+        """
+
+        from git import Blob, Repo
+
+        repo = Repo(path, search_parent_directories=True)
+        root = repo.working_tree_dir or repo.git_dir
+        prefix = os.path.relpath(os.path.abspath(path), root).replace(os.sep, '/')
+        prefix = '' if prefix == '.' else f"{prefix}/"
+        commit = repo.commit(rev)
+
+        # One `git ls-tree` call lists every blob with its size
+        tracked = {}
+        pathspec = [prefix] if prefix else []
+        for line in repo.git.ls_tree('-r', '-l', '-z', commit.hexsha, '--', *pathspec).split('\0'):
+            if not line:
+                continue
+            details, tree_path = line.split('\t', 1)
+            mode, object_type, hexsha, size = details.split()
+            if object_type == 'blob':
+                blob = Blob(repo, bytes.fromhex(hexsha), int(mode, 8), tree_path)
+                tracked[tree_path[len(prefix):]] = (int(size), 0, blob)
+
+        return cls.from_paths(path, tracked, ignore_patterns,
+                              lambda relative_path, file_path: tracked[relative_path])
+
+    @classmethod
+    def from_paths(cls, path, tracked, ignore_patterns, file_details):
+        """
+        Index a set of '/' separated relative paths, adding their directories,
+        without walking the directory. Empty directories are not listed.
+
+        Args:
+            path (str): The indexed directory.
+            tracked (iterable): The relative paths of the files.
+            ignore_patterns (list): A list of patterns to ignore.
+            file_details (callable): Called with a relative path and the file's
+                path, returns its size, mtime_ns and blob, or None to leave it out.
+
+        Returns:
+            FileIndex: The index.
+        """
+
+        rules = [('', compile_patterns(tuple(ignore_patterns)))]
+        records = [FileRecord(path, '', 'directory', 0, 0, 0)]
+        ignored_file_count = 0
+        # Whether each directory seen so far is ignored
+        directories = {}
+
+        for relative_path in sorted(tracked, key=lambda tracked_path: tracked_path.split('/')):
+            parts = relative_path.split('/')
+            ignored = False
+            for depth in range(1, len(parts)):
+                directory = '/'.join(parts[:depth])
+                if directory not in directories:
+                    directories[directory] = match_path(directory, rules, True)
+                    if not directories[directory]:
+                        records.append(FileRecord(os.path.join(path, *parts[:depth]), directory, 'directory',
+                                                  depth, 0, 0))
+                if directories[directory]:
+                    ignored = True
+                    break
+            if ignored or match_path(relative_path, rules, False):
+                ignored_file_count += 1
+                continue
+
+            file_path = os.path.join(path, *parts)
+            details = file_details(relative_path, file_path)
+            if details is not None:
+                size, mtime_ns, blob = details
+                records.append(FileRecord(file_path, relative_path, 'file', len(parts), size, mtime_ns, blob))
+
+        return cls(path, records, ignored_file_count)
+
+    def files(self):
+        """
+        Get the indexed files.
+
+        Returns:
+            list: The FileRecords of the files, in pre-order.
+        """
+
+        return [record for record in self.records if record.kind == 'file']
+
+
+def open_file(file_path, file_record=None, encoding=None):
+    """
+    Open a file for reading as text, from the git object database when its
+    record was indexed from a git revision.
+
+    Args:
+        file_path (str): The path to the file.
+        file_record (FileRecord, optional): The file's entry in a FileIndex.
+            Defaults to None.
+        encoding (str, optional): The file's encoding, as found by sniff_file().
+            Defaults to None, which uses the locale's encoding.
+
+    Returns:
+        file: The open file.
+    """
+
+    if file_record is None or file_record.blob is None:
+        return open(file_path, 'r', encoding=encoding)
+    return io.TextIOWrapper(open_binary(file_path, file_record), encoding=encoding)
+
+
+def open_binary(file_path, file_record=None):
+    """
+    Open a file for reading in binary mode, from the git object database when
+    its record was indexed from a git revision.
+
+    Args:
+        file_path (str): The path to the file.
+        file_record (FileRecord, optional): The file's entry in a FileIndex.
+            Defaults to None.
+
+    Returns:
+        file: The open file. It is seekable.
+    """
+
+    if file_record is None or file_record.blob is None:
+        return open(file_path, 'rb')
+
+    # GitPython reads objects through one `git cat-file` process per repository
+    with _blob_lock:
+        data = file_record.blob.data_stream.read()
+    return io.BytesIO(data)
+
+
+def read_bytes(file_path, file_record=None, max_bytes=None):
+    """
+    Read at most a number of bytes from the start of a file. Files larger than
+    MMAP_MIN_BYTES are memory-mapped, so the part that is read is copied once
+    from the page cache and the rest of the file is never loaded.
+
+    Args:
+        file_path (str): The path to the file.
+        file_record (FileRecord, optional): The file's entry in a FileIndex.
+            Defaults to None.
+        max_bytes (int, optional): The most bytes to read. Defaults to None,
+            which reads the whole file.
+
+    Returns:
+        bytes: The bytes read.
+        int: The file's size in bytes.
+    """
+
+    if file_record is not None and file_record.blob is not None:
+        with open_binary(file_path, file_record) as f:
+            data = f.getvalue()
+        return data[:max_bytes], len(data)
+
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < MMAP_MIN_BYTES:
+            return f.read(max_bytes if max_bytes is not None else -1), size
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped[:max_bytes], size
+
+
+class ByteBudget:
+    """
+    Per-file and total byte limits for reading files.
+    """
+
+    def __init__(self, max_file_bytes=0, max_total_bytes=0):
+        """
+        Args:
+            max_file_bytes (int, optional): The most bytes read from each file,
+                0 for no limit. Defaults to 0.
+            max_total_bytes (int, optional): The most bytes read in all, 0 for
+                no limit. Defaults to 0.
+        """
+
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.total_bytes = 0
+
+    @property
+    def exhausted(self):
+        return bool(self.max_total_bytes) and self.total_bytes >= self.max_total_bytes
+
+    def file_limit(self):
+        """
+        Get the most bytes the next file may use.
+
+        Returns:
+            int: The limit, or None for no limit.
+        """
+
+        limits = [limit for limit in (
+            self.max_file_bytes,
+            self.max_total_bytes and self.max_total_bytes - self.total_bytes,
+        ) if limit]
+        return min(limits) if limits else None
+
+    def spend(self, file_size):
+        """
+        Count a file that was read, up to its limit.
+
+        Args:
+            file_size (int): The file's size in bytes.
+        """
+
+        limit = self.file_limit()
+        self.total_bytes += file_size if limit is None else min(file_size, limit)
+
+
+def read_code(file_path, file_record=None, encoding=None, max_bytes=None):
+    """
+    Read a text file, stopping at a byte limit and marking where it stopped.
+
+    Args:
+        file_path (str): The path to the file.
+        file_record (FileRecord, optional): The file's entry in a FileIndex.
+            Defaults to None.
+        encoding (str, optional): The file's encoding, as found by sniff_file().
+            Defaults to None, which uses UTF-8.
+        max_bytes (int, optional): The most bytes to read. Defaults to None,
+            which reads the whole file.
+
+    Returns:
+        str: The file's content, with TRUNCATION_MARKER at the end if it was cut.
+
+    Raises:
+        UnicodeDecodeError: If the file cannot be decoded.
+    """
+
+    data, size = read_bytes(file_path, file_record, max_bytes or None)
+    # A character cut at the limit is left out rather than failing the decode
+    decoder = codecs.getincrementaldecoder(encoding or 'utf-8')()
+    code = decoder.decode(data, final=len(data) == size)
+    # Universal newlines, as when reading in text mode
+    code = code.replace('\r\n', '\n').replace('\r', '\n')
+    if len(data) < size:
+        code += TRUNCATION_MARKER.format(num_bytes=format_bytes(size - len(data)))
+    return code
+
+
+def sniff_file(file_path, file_record=None):
+    """
+    Tell text files from binary files before reading them. Known extensions
+    decide without opening the file, other files are classified by their first
+    bytes.
+
+    Args:
+        file_path (str): The path to the file.
+        file_record (FileRecord, optional): The file's entry in a FileIndex.
+            Defaults to None.
+
+    Returns:
+        str: The encoding to read the file with, or None if it is binary.
+    """
+
+    extension = file_extension(file_path)
+    if extension in BINARY_EXTENSIONS:
+        return None
+    if extension in TEXT_EXTENSIONS:
+        return 'utf-8'
+    try:
+        with open_binary(file_path, file_record) as f:
+            data = f.read(SNIFF_BYTES)
+    except OSError:
+        return None
+    return detect_encoding(data)
+
+
+def report_skipped_files(skipped_files, max_listed=20):
+    """
+    Print the binary files that were skipped, with their sizes.
+
+    Args:
+        skipped_files (list): The FileRecords of the skipped files.
+        max_listed (int, optional): The most files to list by name. Defaults to 20.
+    """
+
+    if not skipped_files:
+        return
+    total_size = sum(record.size for record in skipped_files)
+    print(f"Skipped {len(skipped_files)} binary files ({format_bytes(total_size)}):")
+    for record in skipped_files[:max_listed]:
+        print(f"  {record.path} ({format_bytes(record.size)})")
+    if len(skipped_files) > max_listed:
+        print(f"  ... and {len(skipped_files) - max_listed} more")
+
+
+def get_file_hierarchy(path, prefix='', ignore_patterns=None, file_index=None):
     """
     Get a list of files and directories in a directory, recursively.
 
@@ -12,6 +485,8 @@ def get_file_hierarchy(path, prefix='', ignore_patterns=None):
         path (str): The path to the directory.
         prefix (str): The prefix to add to each file and directory.
         ignore_patterns (list): A list of patterns to ignore.
+        file_index (FileIndex, optional): An index of the path to reuse instead
+            of scanning it again. Defaults to None.
 
     Returns:
         list: A list of files and directories in the directory.
@@ -19,48 +494,47 @@ def get_file_hierarchy(path, prefix='', ignore_patterns=None):
 
     if ignore_patterns is None:
         raise ValueError("ignore_patterns must be provided")
-    output = []
-
-    if os.path.isfile(path):
+    if file_index is None:
+        file_index = FileIndex.scan(path, ignore_patterns)
 
-        if not check_ignore_patterns(path, ignore_patterns):
-            output.append(f"{prefix}{os.path.basename(path)}")
-
-    elif os.path.isdir(path):
-        dirname = os.path.basename(path)
-
-        if not check_ignore_patterns(dirname, ignore_patterns):
-            output.append(f"{prefix}{dirname}/")
-            prefix += '    '
-
-            for entry in sorted(os.listdir(path)):
-                entry_path = os.path.join(path, entry)
-                output += get_file_hierarchy(entry_path, prefix, ignore_patterns)
+    output = []
+    for record in file_index.records:
+        indent = prefix + '    ' * record.depth
+        if record.kind == 'directory':
+            output.append(f"{indent}{record.name}/")
+        else:
+            output.append(f"{indent}{record.name}")
 
     return output
 
 
-def format_file_hierarchy(path, ignore_patterns):
+def format_file_hierarchy(path, ignore_patterns, file_index=None, root_name=None):
     """
     Format the output of get_file_hierarchy().
 
     Args:
         path (str): The path to the directory.
         ignore_patterns (list): A list of patterns to ignore.
+        file_index (FileIndex, optional): An index of the path to reuse instead
+            of scanning it again. Defaults to None.
+        root_name (str, optional): The name to show for the directory itself,
+            such as './' for a clone. Defaults to None, which shows its name.
 
     Returns:
         str: The formatted output.
     """
 
     prefix = ''
-    file_hierarchy = get_file_hierarchy(path, prefix, ignore_patterns)
+    file_hierarchy = get_file_hierarchy(path, prefix, ignore_patterns, file_index)
 
     # Replace the temporary directory with './'
     path_absolute = os.path.abspath(path)
-    if os.path.commonpath(
+    if file_hierarchy and os.path.commonpath(
                 [path_absolute, tempfile.gettempdir()]
             ) == tempfile.gettempdir():
         file_hierarchy[0] = './'
+    if file_hierarchy and root_name is not None:
+        file_hierarchy[0] = root_name
 
     return '\n'.join(file_hierarchy)
 
@@ -69,6 +543,11 @@ def get_ignore_patterns(input_path, ignore_patterns=None):
     """
     Get a list of patterns to ignore.
 
+    The patterns use .gitignore syntax. They are the defaults followed by the
+    given patterns, so a given "!pattern" can re-include a default. The
+    .gitignore files in the input directory and its subdirectories are read
+    while walking it, see walk_tree().
+
     Args:
         input_path (str): The path to the input file or directory.
         ignore_patterns (list): A list of patterns to ignore.
@@ -80,27 +559,22 @@ def get_ignore_patterns(input_path, ignore_patterns=None):
     default_ignore_patterns = [
         '__pycache__',
         '.DS_Store',
-        'egg-info',
+        '*.egg-info',
         '.env',
+        '.env.*',
         '.git',
+        '.gitignore',
         '.ipynb_checkpoints',
-        '.pkl',
-        '.pyc',
+        '*.pkl',
+        '*.pyc',
         '.pytest_cache',
+        '.venv',
         '.vscode',
         'dist',
-        'LICENSE',
+        'LICENSE*',
         'venv',
     ]
 
-    git_ignore_patterns = []
-    if os.path.isdir(input_path):
-        gitignore_path = os.path.join(input_path, '.gitignore')
-        if os.path.isfile(gitignore_path):
-            with open(gitignore_path, 'r') as f:
-                gitignore_contents = f.read()
-            git_ignore_patterns += gitignore_contents.splitlines()
-
     if ignore_patterns is None:
         ignore_patterns = []
     elif isinstance(ignore_patterns, str):
@@ -108,11 +582,10 @@ def get_ignore_patterns(input_path, ignore_patterns=None):
     elif len(ignore_patterns) == 1 and isinstance(ignore_patterns[0], str):
         ignore_patterns = ignore_patterns[0].split(',')
 
-    ignore_patterns += default_ignore_patterns
-    ignore_patterns += git_ignore_patterns
+    ignore_patterns = default_ignore_patterns + [pattern.strip() for pattern in ignore_patterns]
 
-    # Remove duplicates
-    ignore_patterns = list(set(ignore_patterns))
+    # Remove duplicates, keeping the order since later patterns take precedence
+    ignore_patterns = list(dict.fromkeys(ignore_patterns))
     # Remove empty strings
     ignore_patterns = [pattern for pattern in ignore_patterns if pattern]
     # Remove comments
@@ -122,13 +595,20 @@ def get_ignore_patterns(input_path, ignore_patterns=None):
     return ignore_patterns
 
 
-def check_ignore_patterns(path, ignore_patterns):
+def check_ignore_patterns(path, ignore_patterns, is_dir=None):
     """
-    Check if a path matches any of the ignore patterns.
+    Check if a path matches any of the ignore patterns, with .gitignore
+    semantics. A path is also ignored when one of its parent directories is.
+
+    The patterns are compiled once and reused for later calls with the same
+    patterns.
 
     Args:
-        path (str): The path to the file or directory.
+        path (str): The path to the file or directory, relative to the
+            directory the patterns apply to.
         ignore_patterns (list): A list of patterns to ignore.
+        is_dir (bool, optional): Whether the path is a directory. Defaults to
+            None, which checks the filesystem.
 
     Returns:
         bool: True if the path matches any of the ignore patterns, False otherwise.
@@ -136,18 +616,22 @@ def check_ignore_patterns(path, ignore_patterns):
     Examples:
         >>> check_ignore_patterns('.git', ['.git'])
         True
+        >>> check_ignore_patterns('distance.py', ['dist'])
+        False
     """
 
-    for pattern in ignore_patterns:
-        if pattern.lower() in path.lower():
-            return True
+    if is_dir is None:
+        is_dir = os.path.isdir(path)
+    path = path.replace(os.sep, '/')
+    if path.endswith('/'):
+        is_dir = True
+    while path.startswith('./'):
+        path = path[2:]
+    path = path.strip('/')
+    if not path:
+        return False
 
-        # If the pattern contains a wildcard, check if it matches the path
-        if '*' in pattern:
-            pattern_parts = pattern.split('*')
-            if pattern_parts[0] and pattern_parts[1] and pattern_parts[0] in path and pattern_parts[-1] in path:
-                return True
-    return False
+    return is_ignored(path, [('', compile_patterns(tuple(ignore_patterns)))], is_dir)
 
 
 def remove_matching_patterns_from_list(list, ignore_patterns):
@@ -165,59 +649,170 @@ def remove_matching_patterns_from_list(list, ignore_patterns):
     return [item for item in list if not check_ignore_patterns(item, ignore_patterns)]
 
 
-def get_all_code(dir_path, ignore_patterns):
+def walk_tree(dir_path, ignore_patterns, on_ignored=None):
     """
-    Get all code in a directory, recursively.
+    Walk a directory tree with os.scandir(), yielding its entries lazily.
+
+    Ignored directories are pruned before they are entered, so nothing below
+    them is listed. Paths are checked against the ignore patterns relative to
+    dir_path, and against the .gitignore file of every directory on the way,
+    where deeper .gitignore files take precedence. Entries are yielded in
+    sorted pre-order, each directory right before its contents. Symlinked
+    directories are not followed, and unreadable directories are skipped.
 
     Args:
         dir_path (str): The path to the directory.
         ignore_patterns (list): A list of patterns to ignore.
+        on_ignored (callable, optional): Called with each ignored os.DirEntry.
+            Defaults to None.
 
-    Returns:
-        dict: A dictionary of file paths and code.
+    Yields:
+        tuple: The os.DirEntry of each file and directory, its '/' separated
+            path relative to dir_path, and its depth, 1 for dir_path's entries.
     """
 
-    summary = {}
-    for root, dirs, files in os.walk(dir_path):
-
-        if check_ignore_patterns(root, ignore_patterns):
+    def list_directory(path, relative_path, depth, rules):
+        try:
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            return []
+
+        if any(entry.name == '.gitignore' for entry in entries):
+            gitignore_rules = read_gitignore(path)
+            if gitignore_rules is not None:
+                rules = rules + [(relative_path, gitignore_rules)]
+
+        listed = []
+        for entry in entries:
+            entry_relative_path = f"{relative_path}{entry.name}"
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if match_path(entry_relative_path, rules, is_dir):
+                if on_ignored is not None:
+                    on_ignored(entry)
+                continue
+            listed.append((entry, entry_relative_path, depth, rules))
+        return listed
+
+    # Entries still to yield, last one first
+    pending = list_directory(dir_path, '', 1, [('', compile_patterns(tuple(ignore_patterns)))])[::-1]
+    while pending:
+        entry, relative_path, depth, rules = pending.pop()
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                yield entry, relative_path, depth
+                pending.extend(list_directory(entry.path, f"{relative_path}/", depth + 1, rules)[::-1])
+            elif entry.is_file():
+                yield entry, relative_path, depth
+        except OSError:
             continue
 
-        dirs = remove_matching_patterns_from_list(dirs, ignore_patterns)
-        files = remove_matching_patterns_from_list(files, ignore_patterns)
-
-        for file in files:
-
-            file_path = os.path.join(root, file)
-            code = []
-
-            # check the file extension for csv, json, txt, or xml
-            if file_path.endswith(('.csv')):
-                # First 3 lines
-                number_of_lines = 3
-                # print(f"Reading {number_of_lines*2} lines from {file_path}")
-                with open(file_path, 'r') as f:
-                    first_lines = [next(f) for x in range(number_of_lines)]
-                with open(file_path, 'r') as f:
-                    last_lines = f.readlines()[-number_of_lines:]
-                code += first_lines
-                code += "\n...\n"
-                code += last_lines
-                summary[file_path] = code
-                continue
-            else:
 
-                try:
-                    with open(file_path, 'r') as f:
-                        code.append(f.read())
-                except UnicodeDecodeError:
-                    continue
-                summary[file_path] = code
+def get_all_code(dir_path, ignore_patterns, file_index=None, max_file_bytes=MAX_FILE_BYTES, max_total_bytes=0,
+                 formatter=None):
+    """
+    Get all code in a directory, recursively. Data files, such as csv, jsonl
+    and log files, are previewed by their first and last lines.
 
-    return summary
+    Args:
+        dir_path (str): The path to the directory.
+        ignore_patterns (list): A list of patterns to ignore.
+        file_index (FileIndex, optional): An index of the directory to reuse
+            instead of scanning it again. Defaults to None.
+        max_file_bytes (int, optional): Cut each file after this many bytes,
+            0 for no limit. Defaults to MAX_FILE_BYTES.
+        max_total_bytes (int, optional): Stop reading files after this many
+            bytes in all, 0 for no limit. Defaults to 0.
+        formatter (callable, optional): Called with each file's path and code
+            as soon as it is read, so only its result is kept. Defaults to None.
+
+    Returns:
+        dict: A dictionary of file paths and code, or of their formatted code.
+    """
+
+    return dict(iter_all_code(dir_path, ignore_patterns, file_index, max_file_bytes, max_total_bytes, formatter))
+
+
+def iter_all_code(dir_path, ignore_patterns, file_index=None, max_file_bytes=MAX_FILE_BYTES, max_total_bytes=0,
+                  formatter=None):
+    """
+    Read all code in a directory, recursively, yielding each file as soon as
+    it is read. Data files, such as csv, jsonl and log files, are previewed by
+    their first and last lines.
 
+    The files are classified and read in a Pipeline, which reports the
+    throughput of each stage. Closing the generator stops the pipeline.
 
-def get_code_for_matching_patterns(dir_path, patterns, ignore_patterns):
+    Args:
+        dir_path (str): The path to the directory.
+        ignore_patterns (list): A list of patterns to ignore.
+        file_index (FileIndex, optional): An index of the directory to reuse
+            instead of scanning it again. Defaults to None.
+        max_file_bytes (int, optional): Cut each file after this many bytes,
+            0 for no limit. Defaults to MAX_FILE_BYTES.
+        max_total_bytes (int, optional): Stop reading files after this many
+            bytes in all, 0 for no limit. Defaults to 0.
+        formatter (callable, optional): Called with each file's path and code
+            as soon as it is read, so only its result is kept. Defaults to None.
+
+    Yields:
+        tuple: Each file's path and code, or its formatted code, in walk order.
+    """
+
+    if file_index is None:
+        file_index = FileIndex.scan(dir_path, ignore_patterns)
+
+    files = file_index.files()
+    skipped_files = []
+    left_out_files = []
+    budget = ByteBudget(max_file_bytes, max_total_bytes)
+
+    def classify(record):
+        encoding = sniff_file(record.path, record)
+        if encoding is None:
+            skipped_files.append(record)
+            return None
+        return record, encoding
+
+    def read(item):
+        record, encoding = item
+        if budget.exhausted:
+            left_out_files.append(record)
+            return None
+
+        # Data files are previewed by their first and last lines
+        if is_preview_file(record.path, record.size):
+            with open_binary(record.path, record) as f:
+                code = preview(f)
+            budget.spend(len(code))
+        else:
+            try:
+                code = read_code(record.path, record, encoding, budget.file_limit())
+            except UnicodeDecodeError:
+                skipped_files.append(record)
+                return None
+            budget.spend(record.size)
+        return record.path, [code]
+
+    stages = [Stage('classify', classify), Stage('read', read)]
+    if formatter is not None:
+        stages.append(Stage('format', lambda item: (item[0], formatter(*item))))
+    pipeline = Pipeline(stages)
+    yield from pipeline.run(files)
+
+    if left_out_files:
+        print(f"Stopped after {format_bytes(budget.total_bytes)} (--max-total-bytes), "
+              f"leaving out {len(left_out_files)} files.")
+    # Both stages skip files, so list them in walk order
+    positions = {record.path: position for position, record in enumerate(files)}
+    report_skipped_files(sorted(skipped_files, key=lambda record: positions[record.path]))
+    print(pipeline.report())
+
+
+def get_code_for_matching_patterns(dir_path, patterns, ignore_patterns, file_index=None):
     """
     Get all code in a directory, recursively.
 
@@ -225,34 +820,39 @@ def get_code_for_matching_patterns(dir_path, patterns, ignore_patterns):
         dir_path (str): The path to the directory.
         patterns (list): A list of patterns to match.
         ignore_patterns (list): A list of patterns to ignore.
+        file_index (FileIndex, optional): An index of the directory to reuse
+            instead of scanning it again. Defaults to None.
 
     Returns:
         dict: A dictionary of file paths and code.
     """
 
-    summary = {}
-    for root, dirs, files in os.walk(dir_path):
-
-        if check_ignore_patterns(root, ignore_patterns):
-            continue
+    if file_index is None:
+        file_index = FileIndex.scan(dir_path, ignore_patterns)
 
-        dirs = remove_matching_patterns_from_list(dirs, ignore_patterns)
-        files = remove_matching_patterns_from_list(files, ignore_patterns)
+    summary = {}
+    skipped_files = []
+    for record in file_index.files():
 
-        for file in files:
+        file_path = record.path
 
-            file_path = os.path.join(root, file)
+        # Check if the file path contains any of the patterns
+        if not any(fnmatch.fnmatch(file_path.lower(), f"*{pattern.lower()}*") for pattern in patterns):
+            continue
 
-            # Check if the file matches any of the patterns
-            if not check_ignore_patterns(file_path, patterns):
-                continue
+        encoding = sniff_file(file_path, record)
+        if encoding is None:
+            skipped_files.append(record)
+            continue
 
-            code = []
-            try:
-                with open(file_path, 'r') as f:
-                    code.append(f.read())
-            except UnicodeDecodeError:
-                continue
-            summary[file_path] = code
+        code = []
+        try:
+            with open_file(file_path, record, encoding) as f:
+                code.append(f.read())
+        except UnicodeDecodeError:
+            skipped_files.append(record)
+            continue
+        summary[file_path] = code
 
+    report_skipped_files(skipped_files)
     return summary
@@ -0,0 +1,334 @@
+# src/gitignore.py
+import functools
+import os
+import re
+
+# Characters that make a pattern more than a plain name
+WILDCARDS = '*?[\\'
+
+
+def translate_pattern(pattern):
+    """
+    Translate the body of a gitignore pattern into a regular expression.
+
+    `*` and `?` do not match `/`, `**` matches across directories when it is a
+    whole path component, and `[...]` is a character class.
+
+    Args:
+        pattern (str): The pattern, without negation, anchoring or a trailing slash.
+
+    Returns:
+        str: The regular expression.
+    """
+
+    regex = []
+    i, n = 0, len(pattern)
+    while i < n:
+        char = pattern[i]
+        if char == '*':
+            if pattern.startswith('**', i) and (i == 0 or pattern[i - 1] == '/'):
+                if i + 2 == n:
+                    # Trailing "/**" matches everything inside, "**" alone matches everything
+                    regex.append('.+' if i else '.*')
+                    i += 2
+                    continue
+                if pattern[i + 2] == '/':
+                    # Leading "**/" and inner "/**/" match zero or more directories
+                    regex.append('(?:.*/)?')
+                    i += 3
+                    continue
+            start = i
+            while i + 1 < n and pattern[i + 1] == '*':
+                i += 1
+            # A whole path component after a slash matches at least one
+            # character, or "dir/*" would match "dir/" itself
+            if start and pattern[start - 1] == '/' and (i + 1 == n or pattern[i + 1] == '/'):
+                regex.append('[^/]+')
+            else:
+                regex.append('[^/]*')
+        elif char == '?':
+            regex.append('[^/]')
+        elif char == '[':
+            end = i + 1
+            if end < n and pattern[end] in '!^':
+                end += 1
+            if end < n and pattern[end] == ']':
+                end += 1
+            end = pattern.find(']', end)
+            if end == -1:
+                regex.append(re.escape(char))
+            else:
+                body = pattern[i + 1:end].replace('\\', '\\\\')
+                if body[0] in '!^':
+                    body = '^/' + body[1:]
+                regex.append(f'(?!/)[{body}]')
+                i = end
+        elif char == '\\' and i + 1 < n:
+            i += 1
+            regex.append(re.escape(pattern[i]))
+        else:
+            regex.append(re.escape(char))
+        i += 1
+    return ''.join(regex)
+
+
+def parse_pattern(line):
+    """
+    Parse a line of a .gitignore file.
+
+    Args:
+        line (str): The line.
+
+    Returns:
+        tuple: The pattern's regex, whether it is negated, whether it only
+            matches directories, whether it is matched against the whole
+            relative path rather than the name, and its (kind, text) if it is a
+            plain name, path, suffix or prefix, or an anchored path whose first
+            directory is plain. None for blank lines and comments.
+    """
+
+    line = line.rstrip('\r\n')
+    # Trailing spaces are ignored unless escaped with a backslash
+    while line.endswith(' ') and not line.endswith('\\ '):
+        line = line[:-1]
+    if not line or line.startswith('#'):
+        return None
+
+    negated = line.startswith('!')
+    if negated:
+        line = line[1:]
+    elif line.startswith(('\\!', '\\#')):
+        line = line[1:]
+
+    directory_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+
+    # A slash at the start or in the middle anchors the pattern to the .gitignore's directory
+    anchored = '/' in line
+    line = line.lstrip('/')
+
+    # Most patterns are a plain name, path, "*suffix" or "prefix*", which are
+    # looked up in dicts instead of running their regex
+    literal = None
+    first_directory = line.partition('/')[0]
+    if not any(char in line for char in WILDCARDS):
+        literal = ('path' if anchored else 'name', line)
+    elif not anchored and line.startswith('*') and not any(char in line[1:] for char in WILDCARDS):
+        literal = ('suffix', line[1:])
+    elif not anchored and line.endswith('*') and not any(char in line[:-1] for char in WILDCARDS):
+        literal = ('prefix', line[:-1])
+    elif anchored and not any(char in first_directory for char in WILDCARDS):
+        literal = ('directory', first_directory)
+
+    return translate_pattern(line), negated, directory_only, anchored, literal
+
+
+class IgnoreRules:
+    """
+    The patterns of one .gitignore file (or of --ignore and the defaults),
+    compiled once.
+
+    As in git, the last pattern that matches a path decides whether it is
+    ignored. Plain names and paths are looked up in dicts, "*suffix" and
+    "prefix*" patterns by slicing the name, and the remaining patterns are
+    combined into one regex for names and, per first directory, regexes for
+    anchored paths. The later patterns come first in each regex, so the
+    alternative that matches is the last one.
+    Each lookup reports the index of its last matching pattern, so a path
+    costs the same few lookups however many patterns and negations there are.
+    """
+
+    def __init__(self, patterns):
+        """
+        Args:
+            patterns (list): The gitignore patterns, in order.
+        """
+
+        self.patterns = [pattern for pattern in patterns if parse_pattern(pattern) is not None]
+        self.negated = []
+
+        # Plain patterns by kind, for any path and for directories only,
+        # mapping the literal to the index of its last pattern
+        literals = {kind: ({}, {}) for kind in ('name', 'path', 'suffix', 'prefix')}
+        name_regexes = []
+        # Anchored path regexes by their first directory, '' when it has wildcards
+        path_regexes = {}
+        for index, pattern in enumerate(self.patterns):
+            regex, negated, directory_only, anchored, literal = parse_pattern(pattern)
+            self.negated.append(negated)
+            # Directories are matched with a trailing slash, which only
+            # directory patterns require
+            regex += '/' if directory_only else '/?'
+            if literal is None:
+                (path_regexes.setdefault('', []) if anchored else name_regexes).append((index, regex))
+            elif literal[0] == 'directory':
+                path_regexes.setdefault(literal[1], []).append((index, regex))
+            else:
+                literals[literal[0]][directory_only][literal[1]] = index
+
+        self.names, self.directory_names = literals['name']
+        self.paths, self.directory_paths = literals['path']
+        self.suffixes, self.directory_suffixes = literals['suffix']
+        self.prefixes, self.directory_prefixes = literals['prefix']
+        self.suffix_lengths = sorted({len(suffix) for suffix in self.suffixes})
+        self.directory_suffix_lengths = sorted({len(suffix) for suffix in self.directory_suffixes})
+        self.prefix_lengths = sorted({len(prefix) for prefix in self.prefixes})
+        self.directory_prefix_lengths = sorted({len(prefix) for prefix in self.directory_prefixes})
+        self.name_regex = self._combine(name_regexes)
+        self.path_regexes = {directory: self._combine(regexes) for directory, regexes in path_regexes.items()}
+
+    @staticmethod
+    def _combine(regexes):
+        if not regexes:
+            return None
+        # Capture each pattern in a group, last pattern first
+        regexes = regexes[::-1]
+        combined = re.compile('|'.join(f'({regex})' for _, regex in regexes), re.DOTALL)
+        return combined, [None] + [index for index, _ in regexes]
+
+    @staticmethod
+    def _last_regex(string, regex):
+        if regex is None:
+            return -1
+        combined, indexes = regex
+        match = combined.fullmatch(string)
+        return -1 if match is None else indexes[match.lastindex]
+
+    @staticmethod
+    def _last_affix(name, affixes, lengths, suffix):
+        last = -1
+        for length in lengths:
+            if length > len(name):
+                break
+            # A bare '*' is the empty suffix, which name[-0:] would miss
+            index = affixes.get(name[len(name) - length:] if suffix else name[:length], -1)
+            if index > last:
+                last = index
+        return last
+
+    def match(self, path, is_dir=False):
+        """
+        Match a path against the rules.
+
+        Args:
+            path (str): The '/' separated path relative to the .gitignore's directory.
+            is_dir (bool, optional): Whether the path is a directory. Defaults to False.
+
+        Returns:
+            bool: True if the path is ignored, False if a negated pattern
+                re-includes it, None if no pattern matches it.
+        """
+
+        name = path.rpartition('/')[2]
+        last = max(
+            self.names.get(name, -1),
+            self.paths.get(path, -1),
+            self._last_affix(name, self.suffixes, self.suffix_lengths, True),
+            self._last_affix(name, self.prefixes, self.prefix_lengths, False),
+        )
+        if is_dir:
+            last = max(
+                last,
+                self.directory_names.get(name, -1),
+                self.directory_paths.get(path, -1),
+                self._last_affix(name, self.directory_suffixes, self.directory_suffix_lengths, True),
+                self._last_affix(name, self.directory_prefixes, self.directory_prefix_lengths, False),
+            )
+            name, path = name + '/', path + '/'
+
+        if self.name_regex is not None:
+            last = max(last, self._last_regex(name, self.name_regex))
+        if self.path_regexes:
+            last = max(
+                last,
+                self._last_regex(path, self.path_regexes.get(path.partition('/')[0])),
+                self._last_regex(path, self.path_regexes.get('')),
+            )
+
+        if last == -1:
+            return None
+        return not self.negated[last]
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+
+@functools.lru_cache(maxsize=64)
+def compile_patterns(patterns):
+    """
+    Compile a tuple of gitignore patterns, reusing earlier compilations.
+
+    Args:
+        patterns (tuple): The gitignore patterns, in order.
+
+    Returns:
+        IgnoreRules: The compiled rules.
+    """
+
+    return IgnoreRules(patterns)
+
+
+def read_gitignore(dir_path):
+    """
+    Read and compile the .gitignore file in a directory.
+
+    Args:
+        dir_path (str): The path to the directory.
+
+    Returns:
+        IgnoreRules: The compiled rules, or None if there is no .gitignore file.
+    """
+
+    try:
+        with open(os.path.join(dir_path, '.gitignore'), 'r', errors='replace') as f:
+            rules = IgnoreRules(f.read().splitlines())
+    except OSError:
+        return None
+    return rules or None
+
+
+def match_path(path, rules, is_dir=False):
+    """
+    Match a path against the rules of the .gitignore files above it. Rules of
+    deeper directories take precedence.
+
+    Args:
+        path (str): The '/' separated relative path.
+        rules (list): (base, IgnoreRules) pairs from the outermost to the
+            innermost directory, where base is the rules' directory relative to
+            the same root with a trailing slash, or '' for the root.
+        is_dir (bool, optional): Whether the path is a directory. Defaults to False.
+
+    Returns:
+        bool: True if the path itself is ignored, its parents are not checked.
+    """
+
+    for base, base_rules in reversed(rules):
+        if not path.startswith(base) or len(path) < len(base) + 1:
+            continue
+        ignored = base_rules.match(path[len(base):], is_dir)
+        if ignored is not None:
+            return ignored
+    return False
+
+
+def is_ignored(path, rules, is_dir=False):
+    """
+    Check whether a path or any of its parent directories is ignored.
+
+    Args:
+        path (str): The '/' separated relative path.
+        rules (list): (base, IgnoreRules) pairs, as for match_path().
+        is_dir (bool, optional): Whether the path is a directory. Defaults to False.
+
+    Returns:
+        bool: True if the path is ignored.
+    """
+
+    parts = path.split('/')
+    for depth in range(1, len(parts) + 1):
+        if match_path('/'.join(parts[:depth]), rules, is_dir or depth < len(parts)):
+            return True
+    return False
@@ -1,27 +1,47 @@
-import pyperclip
+import contextlib
+import sys
+from cache import run_cache_command
+from output import SummaryWriter
 from summary import run_summary
-from utils import parse_arguments
+from utils import parse_arguments, parse_cache_arguments, CACHE_COMMANDS
 
 
 def main():
 
-    args = parse_arguments()
-
-    print(args)
+    if len(sys.argv) > 2 and sys.argv[1] == 'cache' and sys.argv[2] in CACHE_COMMANDS:
+        run_cache_command(parse_cache_arguments(sys.argv[2:]))
+        return
 
-    formatted_summary, num_tokens = run_summary(args)
-
-    print(formatted_summary)
+    args = parse_arguments()
 
-    print(f"Summary length: {len(formatted_summary)} characters, {num_tokens} tokens")
+    # With --all the code is written as it is read, up to --max-tokens-out
+    output = open(args.output, 'w') if args.output else sys.stdout
+    writer = SummaryWriter(output, args.max_tokens_out if args.all else None, keep=args.copy)
+    # Progress goes to stderr while the code is streamed to stdout
+    log = contextlib.redirect_stdout(sys.stderr) if args.all and not args.output else contextlib.nullcontext()
+    with log:
+        print(args)
 
-    if args.copy:
         try:
-            pyperclip.copy(formatted_summary)
-            print(f"Copied {num_tokens} tokens to the clipboard.")
-        except ImportError:
-            print("pyperclip package not found."
-                  "Please install it to use the clipboard feature.")
+            formatted_summary, num_tokens = run_summary(args, writer)
+            if formatted_summary is not None:
+                writer.write(formatted_summary)
+        finally:
+            if args.output:
+                output.close()
+
+        print(f"Summary length: {writer.characters} characters, {num_tokens} tokens")
+        if args.output:
+            print(f"Wrote the summary to {args.output}")
+
+        if args.copy:
+            try:
+                import pyperclip
+                pyperclip.copy(writer.getvalue())
+                print(f"Copied {num_tokens} tokens to the clipboard.")
+            except ImportError:
+                print("pyperclip package not found."
+                      "Please install it to use the clipboard feature.")
 
 
 if __name__ == '__main__':
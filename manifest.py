@@ -0,0 +1,333 @@
+# src/manifest.py
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+from collections import namedtuple
+from cache import DIGEST_MIN_AGE, cache_dir, file_digest
+from file_processing import FileIndex
+from openai_api import approximate_tokens
+
+# Each directory's last run is kept in cache/manifests/<hash of the path>.json
+manifests_dir = os.path.normpath(os.path.join(cache_dir, 'manifests'))
+
+# Manifests written with another version are not read
+MANIFEST_VERSION = 1
+
+
+class ManifestEntry(namedtuple('ManifestEntry', ['digest', 'size', 'mtime_ns', 'summary', 'tokens'])):
+    """
+    A file's summary from a run.
+
+    Attributes:
+        digest (str): The file's content digest, 'git:<blob SHA>' for files
+            read from git, or None if the run did not compute it, such as for
+            skipped binary files.
+        size (int): The file's size in bytes.
+        mtime_ns (int): The file's modification time in nanoseconds, 0 if it
+            was too recent to be trusted.
+        summary (str): The file's formatted summary, or None if it was skipped.
+        tokens (int): The approximate number of tokens in the summary.
+    """
+
+    __slots__ = ()
+
+
+def manifest_key(input_path):
+    """
+    Get the file name of a directory's manifest.
+
+    Args:
+        input_path (str): The path to the directory.
+
+    Returns:
+        str: The first 16 hex digits of the SHA-256 of the absolute path.
+    """
+
+    return hashlib.sha256(os.path.abspath(input_path).encode()).hexdigest()[:16]
+
+
+def content_digest(record, cache=None):
+    """
+    Get the digest of a file's content.
+
+    Args:
+        record (FileRecord): The file's entry in a FileIndex.
+        cache (ResponseCache, optional): The cache, which remembers the digests
+            of unchanged files. Defaults to None.
+
+    Returns:
+        str: The blob SHA of files read from git, or the SHA-256 of the file.
+    """
+
+    if record.blob is not None:
+        return f"git:{record.blob.hexsha}"
+    if cache is not None:
+        return cache.file_digest(record.path, record.size, record.mtime_ns)
+    return file_digest(record.path)
+
+
+def git_changes(path, rev):
+    """
+    List the files under a directory that differ from a git revision.
+
+    Args:
+        path (str): The path to a directory in a git worktree.
+        rev (str): The revision to compare the worktree with.
+
+    Returns:
+        str: The SHA of HEAD.
+        set: The '/' separated paths, relative to the directory, of the files
+            that were added, changed or deleted since the revision, and of the
+            untracked files.
+
+    Raises:
+        git.InvalidGitRepositoryError: If the path is not in a git worktree.
+        git.GitCommandError: If the revision does not exist.
+        ValueError: If the repository has no commits.
+    """
+
+    from git import Repo
+
+    repo = Repo(path, search_parent_directories=True)
+    try:
+        prefix = os.path.relpath(os.path.abspath(path), repo.working_tree_dir).replace(os.sep, '/')
+        prefix = '' if prefix == '.' else f"{prefix}/"
+        pathspec = [prefix] if prefix else []
+
+        head = repo.head.commit.hexsha
+        # Renames are listed as a deletion and an addition
+        output = repo.git.diff('--name-only', '--no-renames', '-z', rev, '--', *pathspec)
+        output += '\0' + repo.git.ls_files('--others', '--exclude-standard', '-z', '--', *pathspec)
+    finally:
+        repo.close()
+
+    changed = {git_path[len(prefix):] for git_path in output.split('\0') if git_path}
+    return head, changed
+
+
+class RunManifest:
+    """
+    The files and summaries of a directory's last run, for --incremental.
+
+    Each --incremental directory summary records every file's digest, size, mtime, formatted
+    summary and token count. A later run reuses the summary of every file that
+    did not change instead of reading, parsing or summarizing it again. When
+    the directory is in a git worktree, the manifest also records HEAD and the
+    files that differed from it, so the next run only looks at the files git
+    reports as changed since then, without walking the directory.
+    """
+
+    def __init__(self, input_path, settings, files=None, commit=None, dirty=()):
+        """
+        Args:
+            input_path (str): The summarized directory.
+            settings (dict): The options the summaries depend on. A manifest
+                written with other settings is not reused.
+            files (dict, optional): The ManifestEntries by '/' separated path
+                relative to the directory. Defaults to None.
+            commit (str, optional): The SHA of HEAD when the manifest was
+                written, if the directory is in a git worktree. Defaults to None.
+            dirty (iterable, optional): The files that differed from that
+                commit. Defaults to ().
+        """
+
+        self.input_path = input_path
+        # Normalized as it is read back from JSON
+        self.settings = json.loads(json.dumps(settings))
+        self.files = files or {}
+        self.commit = commit
+        self.dirty = set(dirty)
+        # The entries of the previous run, and the files changed since then if
+        # git could tell
+        self.previous = {}
+        self.changed = None
+
+    @property
+    def path(self):
+        return os.path.join(manifests_dir, f"{manifest_key(self.input_path)}.json")
+
+    @classmethod
+    def load(cls, input_path, settings):
+        """
+        Read the manifest of a directory's last run.
+
+        Args:
+            input_path (str): The summarized directory.
+            settings (dict): The options of this run.
+
+        Returns:
+            RunManifest: The manifest, or None if there is none, it cannot be
+                read, or it was written with other settings.
+        """
+
+        manifest = cls(input_path, settings)
+        try:
+            with open(manifest.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (data.get('version') != MANIFEST_VERSION or data.get('input_path') != os.path.abspath(input_path)
+                or data.get('settings') != manifest.settings):
+            return None
+
+        manifest.files = {
+            relative_path: ManifestEntry(**entry) for relative_path, entry in data['files'].items()
+        }
+        manifest.commit = data.get('commit')
+        manifest.dirty = set(data.get('dirty', []))
+        return manifest
+
+    def resume(self, previous, rev=None):
+        """
+        Reuse the summaries of a previous run.
+
+        In a git worktree, the files changed since rev, or since the previous
+        run's commit, are listed with git, and the others are trusted to be
+        unchanged. Otherwise every file's size and mtime are compared with
+        the previous run's.
+
+        Args:
+            previous (RunManifest): The manifest of the previous run.
+            rev (str, optional): Trust the files unchanged since this git
+                revision instead of since the previous run. Defaults to None.
+        """
+
+        from git import GitCommandError, InvalidGitRepositoryError
+
+        self.previous = previous.files
+        base = rev or previous.commit
+        if base is None:
+            return
+        try:
+            _, changed = git_changes(self.input_path, base)
+        except (InvalidGitRepositoryError, GitCommandError, ValueError):
+            print(f"Could not list the files changed since {base} with git, comparing every file instead.")
+            return
+        # Files that differed from the previous run's commit may have changed back
+        self.changed = changed | previous.dirty
+
+    def file_index(self, ignore_patterns):
+        """
+        Index the directory from the previous run's files and the changed files,
+        stat'ing only the changed ones.
+
+        Args:
+            ignore_patterns (list): A list of patterns to ignore.
+
+        Returns:
+            FileIndex: The index, or None if git could not list the changed files.
+        """
+
+        if self.changed is None:
+            return None
+
+        def file_details(relative_path, file_path):
+            if relative_path not in self.changed:
+                entry = self.previous[relative_path]
+                return entry.size, entry.mtime_ns, None
+            try:
+                stat_result = os.stat(file_path)
+            except OSError:
+                return None
+            # Submodules are left out
+            if not stat.S_ISREG(stat_result.st_mode):
+                return None
+            return stat_result.st_size, stat_result.st_mtime_ns, None
+
+        return FileIndex.from_paths(self.input_path, set(self.previous) | self.changed, ignore_patterns, file_details)
+
+    def reuse(self, record, cache=None):
+        """
+        Reuse a file's entry from the previous run if the file did not change.
+
+        Files with the same size and mtime are unchanged. Files with the same
+        size and a new mtime, such as after a checkout, are compared by digest.
+
+        Args:
+            record (FileRecord): The file's entry in a FileIndex.
+            cache (ResponseCache, optional): The cache, which remembers the
+                digests of unchanged files. Defaults to None.
+
+        Returns:
+            ManifestEntry: The entry, or None if the file is new or changed.
+        """
+
+        entry = self.previous.get(record.relative_path)
+        if entry is None or entry.size != record.size:
+            return None
+        if record.blob is not None or (entry.mtime_ns != record.mtime_ns and entry.digest is not None):
+            if entry.digest != content_digest(record, cache):
+                return None
+        elif entry.mtime_ns != record.mtime_ns:
+            return None
+
+        entry = entry._replace(mtime_ns=self._trusted_mtime(record))
+        self.files[record.relative_path] = entry
+        return entry
+
+    def add(self, record, summary, digest=None):
+        """
+        Record a file's new summary. The file is not read again: without a
+        digest, it is only recognized as unchanged by its size and mtime.
+
+        Args:
+            record (FileRecord): The file's entry in a FileIndex.
+            summary (str): The file's formatted summary, or None if it was skipped.
+            digest (str, optional): The file's content digest, if the run
+                computed it. Defaults to None.
+        """
+
+        if record.blob is not None:
+            digest = f"git:{record.blob.hexsha}"
+        if summary is None:
+            entry = ManifestEntry(digest, record.size, record.mtime_ns, None, 0)
+        else:
+            tokens = approximate_tokens(summary) if isinstance(summary, str) else 0
+            entry = ManifestEntry(digest, record.size, self._trusted_mtime(record), summary, tokens)
+        self.files[record.relative_path] = entry
+
+    def _trusted_mtime(self, record):
+        # A file written in the same moment as it was read may change without
+        # a new mtime, so its digest is checked next time
+        if record.blob is None and record.mtime_ns >= (time.time() - DIGEST_MIN_AGE) * 1e9:
+            return 0
+        return record.mtime_ns
+
+    def save(self, track_git=False):
+        """
+        Write the manifest.
+
+        Args:
+            track_git (bool, optional): Record the git commit and changed files
+                of the directory when it is in a git worktree, so the next
+                --incremental run can list the changed files with git instead
+                of walking the directory. Defaults to False, which does not
+                run git.
+        """
+
+        self.commit, self.dirty = None, set()
+        if track_git:
+            from git import GitCommandError, InvalidGitRepositoryError
+
+            try:
+                self.commit, self.dirty = git_changes(self.input_path, 'HEAD')
+            except (InvalidGitRepositoryError, GitCommandError, ValueError):
+                pass
+
+        data = {
+            'version': MANIFEST_VERSION,
+            'input_path': os.path.abspath(self.input_path),
+            'settings': self.settings,
+            'commit': self.commit,
+            'dirty': sorted(self.dirty),
+            'files': {relative_path: entry._asdict() for relative_path, entry in self.files.items()},
+        }
+        os.makedirs(manifests_dir, exist_ok=True)
+        # Written to a temporary file first, so a crash never leaves half a manifest
+        fd, temp_path = tempfile.mkstemp(dir=manifests_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
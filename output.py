@@ -0,0 +1,82 @@
+# src/output.py
+from openai_api import estimate_tokens
+
+STOP_MARKER = "\n... [output stopped at {max_tokens} tokens, --max-tokens-out]\n"
+
+
+class SummaryWriter:
+    """
+    Write a summary block by block to stdout or a file as it is produced,
+    counting its tokens as it goes.
+
+    The tokens are counted for each block, so the output is never counted as a
+    whole. With a token limit, the first block that does not fit is left out
+    with a marker, and later blocks are ignored. The marker is only written if
+    it fits in the limit too.
+    """
+
+    def __init__(self, stream, max_tokens=None, keep=False):
+        """
+        Args:
+            stream (file): The stream to write to, such as sys.stdout.
+            max_tokens (int, optional): The most tokens to write, None for no
+                limit. Defaults to None.
+            keep (bool, optional): Keep a copy of what was written, for
+                getvalue(). Defaults to False.
+        """
+
+        self.stream = stream
+        self.max_tokens = max_tokens
+        self.tokens = 0
+        self.characters = 0
+        self.blocks = 0
+        self.stopped = False
+        self._kept = [] if keep else None
+
+    def write(self, text):
+        """
+        Write a block, unless it would go over the token limit.
+
+        Args:
+            text (str): The block.
+
+        Returns:
+            bool: True if the block was written, False if the output has stopped.
+        """
+
+        if self.stopped:
+            return False
+
+        tokens = estimate_tokens(text)
+        if self.max_tokens is not None:
+            marker = STOP_MARKER.format(max_tokens=self.max_tokens)
+            marker_tokens = estimate_tokens(marker)
+            # Leave room for the marker
+            if self.tokens + tokens + marker_tokens > self.max_tokens:
+                self.stopped = True
+                # Left out too if the limit is already too close
+                if self.tokens + marker_tokens <= self.max_tokens:
+                    self._write(marker, marker_tokens)
+                return False
+
+        self._write(text, tokens)
+        self.blocks += 1
+        return True
+
+    def _write(self, text, tokens):
+        self.stream.write(text)
+        self.stream.flush()
+        self.tokens += tokens
+        self.characters += len(text)
+        if self._kept is not None:
+            self._kept.append(text)
+
+    def getvalue(self):
+        """
+        Get what was written, if the writer keeps a copy.
+
+        Returns:
+            str: The text written so far.
+        """
+
+        return ''.join(self._kept or [])
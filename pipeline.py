@@ -0,0 +1,247 @@
+# src/pipeline.py
+import queue
+import threading
+import time
+
+# Each queue between two stages holds at most this many items, so a fast stage
+# waits for a slow one instead of buffering the whole repository
+QUEUE_SIZE = 64
+
+# How often blocked threads check whether the pipeline was closed, in seconds
+POLL_SECONDS = 0.1
+
+# Ends a stage's input
+_DONE = object()
+# Stands in for an item that a stage dropped, so later items keep their order
+_DROPPED = object()
+
+
+class _Failure:
+    """
+    An exception raised by a stage, passed on to be raised in order.
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+
+class Stage:
+    """
+    A step of a Pipeline, run by one or more threads.
+
+    A stage with one worker sees the items in order, so it can keep running
+    state such as a byte budget. Stages with more workers overlap slow calls,
+    such as reads or OpenAI requests.
+    """
+
+    def __init__(self, name, function, workers=1):
+        """
+        Args:
+            name (str): The name shown in the throughput report.
+            function (callable): Called with each item. Returns the item for the
+                next stage, or None to drop it.
+            workers (int, optional): The number of threads. Defaults to 1.
+        """
+
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.count = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds, count=1):
+        """
+        Count items handled by the stage.
+
+        Args:
+            seconds (float): The time spent on them.
+            count (int, optional): The number of items. Defaults to 1.
+        """
+
+        with self._lock:
+            self.count += count
+            self.busy_seconds += seconds
+
+    def process(self, item):
+        start = time.perf_counter()
+        try:
+            return self.function(item)
+        finally:
+            self.record(time.perf_counter() - start)
+
+    def throughput(self):
+        """
+        Get the number of items the stage handles per second of work, per worker.
+
+        Returns:
+            float: The throughput, or 0 if the stage did no measurable work.
+        """
+
+        return self.count / self.busy_seconds if self.busy_seconds else 0.0
+
+
+class Pipeline:
+    """
+    Run items through stages connected by bounded queues.
+
+    The items are fed from their source in a thread ('feed'), each stage runs
+    in its own threads, and the caller consumes the results ('sink'), so
+    reading files, parsing them and waiting for OpenAI overlap. A full queue
+    blocks the stage before it, which keeps memory bounded by the queue sizes
+    rather than by the size of the repository. Results come out in the order
+    of the items, whichever worker finishes first; the feed stays at most
+    queue_size items, plus one per worker, ahead of the oldest result not yet
+    consumed, so results that finish early are not buffered without limit.
+    """
+
+    def __init__(self, stages, queue_size=QUEUE_SIZE):
+        """
+        Args:
+            stages (list): The Stages, in order.
+            queue_size (int, optional): The most items waiting between two
+                stages. Defaults to QUEUE_SIZE.
+        """
+
+        self.stages = stages
+        self.queue_size = queue_size
+        self.source = Stage('feed', None)
+        self.sink = Stage('sink', None)
+        self.seconds = 0.0
+
+    def run(self, items):
+        """
+        Run items through the stages.
+
+        Args:
+            items (iterable): The items.
+
+        Yields:
+            The results of the last stage, in the order of the items. Dropped
+            items are left out. An exception raised by a stage is raised here,
+            in the place of its item.
+        """
+
+        start = time.perf_counter()
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        closed = threading.Event()
+        # The index of the next result to consume, which holds the feed back
+        next_index = 0
+        window = self.queue_size + sum(stage.workers for stage in self.stages)
+        consumed = threading.Condition()
+
+        def put(output, value):
+            while not closed.is_set():
+                try:
+                    output.put(value, timeout=POLL_SECONDS)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(source):
+            while not closed.is_set():
+                try:
+                    return source.get(timeout=POLL_SECONDS)
+                except queue.Empty:
+                    pass
+            return _DONE
+
+        def feed():
+            iterator = iter(items)
+            index = 0
+            while True:
+                item_start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                except BaseException as error:
+                    put(queues[0], (index, _Failure(error)))
+                    break
+                self.source.record(time.perf_counter() - item_start)
+                with consumed:
+                    while index >= next_index + window and not closed.is_set():
+                        consumed.wait(POLL_SECONDS)
+                if not put(queues[0], (index, item)):
+                    return
+                index += 1
+            for _ in range(self.stages[0].workers if self.stages else 1):
+                put(queues[0], _DONE)
+
+        def work(position, stage, remaining):
+            while True:
+                value = get(queues[position])
+                if value is _DONE:
+                    break
+                index, item = value
+                if item is not _DROPPED and not isinstance(item, _Failure):
+                    try:
+                        item = stage.process(item)
+                    except BaseException as error:
+                        item = _Failure(error)
+                    if item is None:
+                        item = _DROPPED
+                if not put(queues[position + 1], (index, item)):
+                    return
+            # The last worker of a stage ends the next stage's input
+            with remaining['lock']:
+                remaining['workers'] -= 1
+                last = remaining['workers'] == 0
+            if last:
+                next_workers = self.stages[position + 1].workers if position + 1 < len(self.stages) else 1
+                for _ in range(next_workers):
+                    put(queues[position + 1], _DONE)
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        for position, stage in enumerate(self.stages):
+            remaining = {'lock': threading.Lock(), 'workers': stage.workers}
+            threads += [
+                threading.Thread(target=work, args=(position, stage, remaining), daemon=True)
+                for _ in range(stage.workers)
+            ]
+        for thread in threads:
+            thread.start()
+
+        # Results that finished before an earlier item, by index
+        pending = {}
+        try:
+            while True:
+                value = get(queues[-1])
+                if value is _DONE:
+                    break
+                index, item = value
+                pending[index] = item
+                while next_index in pending:
+                    item = pending.pop(next_index)
+                    with consumed:
+                        next_index += 1
+                        consumed.notify()
+                    if isinstance(item, _Failure):
+                        raise item.error
+                    if item is _DROPPED:
+                        continue
+                    sink_start = time.perf_counter()
+                    yield item
+                    self.sink.record(time.perf_counter() - sink_start)
+        finally:
+            # Stop the threads if the caller stopped early or a stage failed
+            closed.set()
+            self.seconds = time.perf_counter() - start
+
+    def report(self):
+        """
+        Describe the throughput of each stage.
+
+        Returns:
+            str: One line per stage, with its items, busy time and items per second.
+        """
+
+        lines = [f"Pipeline finished in {self.seconds:.2f}s:"]
+        for stage in [self.source] + self.stages + [self.sink]:
+            workers = f" x{stage.workers}" if stage.workers > 1 else ""
+            lines.append(
+                f"  {stage.name}{workers}: {stage.count} files, {stage.busy_seconds:.2f}s busy, "
+                f"{stage.throughput():.0f} files/s"
+            )
+        return '\n'.join(lines)
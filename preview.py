@@ -0,0 +1,135 @@
+# src/preview.py
+import os
+
+# Data files that are previewed by their first and last lines instead of read whole
+PREVIEW_EXTENSIONS = ('.csv', '.tsv', '.jsonl', '.ndjson', '.log')
+# JSON files are only previewed when they are larger than this many bytes
+LARGE_JSON_BYTES = 64 * 1024
+
+# The number of lines kept from the start and the end of a previewed file
+PREVIEW_LINES = 3
+# The most bytes read for the start, and for the end, of a previewed file
+PREVIEW_BYTES = 8192
+
+# Read backwards from the end of a file in blocks of this many bytes
+TAIL_BLOCK_BYTES = 4096
+
+PREVIEW_SEPARATOR = '...\n'
+
+_preview_lines = PREVIEW_LINES
+_preview_bytes = PREVIEW_BYTES
+
+
+def configure_preview(lines=None, max_bytes=None):
+    """
+    Set the default size of file previews.
+
+    Args:
+        lines (int, optional): The number of lines kept from the start and the
+            end of a file. Defaults to None, which keeps the current setting.
+        max_bytes (int, optional): The most bytes read for the start, and for
+            the end, of a file. Defaults to None, which keeps the current setting.
+    """
+
+    global _preview_lines, _preview_bytes
+
+    if lines is not None:
+        _preview_lines = lines
+    if max_bytes is not None:
+        _preview_bytes = max_bytes
+
+
+def is_preview_file(file_path, size):
+    """
+    Check whether a file is previewed instead of read whole.
+
+    Args:
+        file_path (str): The path to the file.
+        size (int): The file's size in bytes.
+
+    Returns:
+        bool: True for csv, tsv, jsonl and log files, and for large JSON files.
+    """
+
+    file_path = file_path.lower()
+    return file_path.endswith(PREVIEW_EXTENSIONS) or (file_path.endswith('.json') and size > LARGE_JSON_BYTES)
+
+
+def read_head(f, lines, max_bytes):
+    """
+    Read the first lines of a binary file.
+
+    Args:
+        f (file): The file, open for reading in binary mode at its start.
+        lines (int): The number of lines to read.
+        max_bytes (int): The most bytes to read. A longer line is cut.
+
+    Returns:
+        bytes: The lines.
+    """
+
+    data = f.read(max_bytes)
+    return b''.join(data.splitlines(keepends=True)[:lines])
+
+
+def read_tail(f, lines, max_bytes, start=0):
+    """
+    Read the last lines of a binary file, seeking backwards from its end in
+    blocks, so only the end of the file is read however large it is.
+
+    Args:
+        f (file): The file, open for reading in binary mode. It must be seekable.
+        lines (int): The number of lines to read.
+        max_bytes (int): The most bytes to read. A longer line is cut at its start.
+        start (int, optional): Stop reading backwards at this offset, such as the
+            end of the head already read. Defaults to 0.
+
+    Returns:
+        bytes: The lines.
+    """
+
+    if lines <= 0:
+        return b''
+    position = f.seek(0, os.SEEK_END)
+    limit = max(start, position - max_bytes)
+    data = b''
+    # One newline more than the number of lines marks the start of the first
+    # one, not counting the newline that ends the file
+    while position > limit and data.count(b'\n', 0, max(len(data) - 1, 0)) < lines:
+        block_start = max(limit, position - TAIL_BLOCK_BYTES)
+        f.seek(block_start)
+        data = f.read(position - block_start) + data
+        position = block_start
+    return b''.join(data.splitlines(keepends=True)[-lines:])
+
+
+def preview(f, lines=None, max_bytes=None):
+    """
+    Preview a binary file by its first and last lines, with a separator where
+    lines are left out.
+
+    Args:
+        f (file): The file, open for reading in binary mode. It must be seekable.
+        lines (int, optional): The number of lines kept from the start and the
+            end. Defaults to None, which uses the configured number.
+        max_bytes (int, optional): The most bytes read for the start, and for
+            the end. Defaults to None, which uses the configured number.
+
+    Returns:
+        str: The preview, decoded as UTF-8 with undecodable bytes replaced.
+    """
+
+    lines = _preview_lines if lines is None else lines
+    max_bytes = _preview_bytes if max_bytes is None else max_bytes
+
+    head = read_head(f, lines, max_bytes)
+    tail = read_tail(f, lines, max_bytes, len(head))
+    # The tail starts right after the head when nothing is left out
+    omitted = f.seek(0, os.SEEK_END) > len(head) + len(tail)
+
+    text = head.decode('utf-8', errors='replace')
+    if omitted:
+        if not text.endswith('\n'):
+            text += '\n'
+        text += PREVIEW_SEPARATOR
+    return text + tail.decode('utf-8', errors='replace')
@@ -0,0 +1,170 @@
+# src/repository.py
+import hashlib
+import os
+import shutil
+import tempfile
+from cache import cache_dir
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Cached clones are kept in cache/repos/<hash of the URL>
+repos_dir = os.path.normpath(os.path.join(cache_dir, 'repos'))
+
+
+def clone_key(url):
+    """
+    Get the directory name of a URL's cached clone.
+
+    Args:
+        url (str): The repository URL.
+
+    Returns:
+        str: The first 16 hex digits of the SHA-256 of the normalized URL.
+    """
+
+    normalized = url.strip().rstrip('/')
+    if normalized.endswith('.git'):
+        normalized = normalized[:-len('.git')]
+    return hashlib.sha256(normalized.encode()).hexdigest()[:16]
+
+
+def clone_options(depth=1, blobless=False):
+    """
+    Get the git options for a shallow or blobless clone or fetch.
+
+    Args:
+        depth (int, optional): The number of commits to fetch, 0 for the whole
+            history. Defaults to 1.
+        blobless (bool, optional): Fetch file contents only when they are
+            checked out. Defaults to False.
+
+    Returns:
+        dict: GitPython keyword arguments.
+    """
+
+    options = {}
+    if depth:
+        options['depth'] = depth
+    if blobless:
+        options['filter'] = 'blob:none'
+    return options
+
+
+def clone_repository(url, depth=1, blobless=False, use_cache=True):
+    """
+    Clone a repository, or refresh its cached clone.
+
+    Cached clones are kept in cache/repos, one per URL. An existing clone is
+    updated with a fetch of the remote HEAD and a hard reset instead of being
+    cloned again, and when the remote HEAD is the commit already checked out,
+    nothing is fetched. When the remote cannot be reached, for instance
+    offline, the clone is used as it is.
+
+    The clone is locked until the returned lock is closed, so a concurrent run
+    of the same URL waits instead of resetting the clone to another commit
+    while it is being read. The caller holds the lock for the whole run.
+
+    Args:
+        url (str): The repository URL, such as https://github.com/... or file://...
+        depth (int, optional): The number of commits to fetch, 0 for the whole
+            history. Defaults to 1.
+        blobless (bool, optional): Fetch file contents only when they are
+            checked out. Defaults to False.
+        use_cache (bool, optional): Keep the clone in the cache. Otherwise it is
+            cloned into a temporary directory, which the caller removes.
+            Defaults to True.
+
+    Returns:
+        str: The path to the clone's worktree.
+        str: The SHA of the checked out commit.
+        file: The open lock file of a cached clone, which releases the lock
+            when closed, or None for a temporary clone.
+    """
+
+    from git import GitCommandError, Repo
+
+    options = clone_options(depth, blobless)
+
+    if not use_cache:
+        path = tempfile.mkdtemp()
+        print(f"Cloning {url}...")
+        repo = Repo.clone_from(url, path, **options)
+        sha = repo.head.commit.hexsha
+        repo.close()
+        print(f"Cloned {sha[:12]} to {path}")
+        return path, sha, None
+
+    os.makedirs(repos_dir, exist_ok=True)
+    path = os.path.join(repos_dir, clone_key(url))
+
+    lock = open(f"{path}.lock", 'w')
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                print(f"Waiting for another run to finish with the cached clone of {url}...")
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if os.path.isdir(os.path.join(path, '.git')):
+            repo = Repo(path)
+            previous_sha = repo.head.commit.hexsha
+            try:
+                # Only the remote HEAD is listed when it did not move
+                remote_sha = repo.git.ls_remote('origin', 'HEAD').partition('\t')[0]
+                if remote_sha != previous_sha:
+                    repo.git.fetch('origin', 'HEAD', **options)
+                    repo.git.reset('--hard', 'FETCH_HEAD')
+            except GitCommandError as error:
+                print(f"Could not fetch {url}, using the cached clone: {error.stderr.strip()}")
+            sha = repo.head.commit.hexsha
+            status = 'unchanged' if sha == previous_sha else f"updated from {previous_sha[:12]}"
+            print(f"Using the cached clone of {url} at {sha[:12]} ({status})")
+        else:
+            # Remove what is left of an interrupted clone
+            shutil.rmtree(path, ignore_errors=True)
+            print(f"Cloning {url}...")
+            repo = Repo.clone_from(url, path, **options)
+            sha = repo.head.commit.hexsha
+            print(f"Cloned {sha[:12]} to {path}")
+        repo.close()
+    except BaseException:
+        lock.close()
+        raise
+
+    return path, sha, lock
+
+
+def fetch_revision(path, rev, depth=1, blobless=False):
+    """
+    Fetch a branch, tag or commit into a clone, for reading it without a checkout.
+
+    Shallow clones only have the remote HEAD, so the revision is fetched from
+    origin. When the fetch fails, for instance for a relative revision such as
+    HEAD~1, the revision is resolved in the clone as it is.
+
+    Args:
+        path (str): The path to the clone.
+        rev (str): The revision to fetch.
+        depth (int, optional): The number of commits to fetch, 0 for the whole
+            history. Defaults to 1.
+        blobless (bool, optional): Fetch file contents only when they are
+            read. Defaults to False.
+
+    Returns:
+        str: The SHA of the fetched commit, or rev if it could not be fetched.
+    """
+
+    from git import GitCommandError, Repo
+
+    repo = Repo(path)
+    try:
+        repo.git.fetch('origin', rev, **clone_options(depth, blobless))
+        rev = repo.commit('FETCH_HEAD').hexsha
+    except GitCommandError as error:
+        print(f"Could not fetch {rev}, looking for it in the clone: {error.stderr.strip()}")
+    repo.close()
+    return rev
@@ -16,7 +16,7 @@ function prompt_args() {
   fi
 
   printf "\nAre there any files patterns you want to ignore?\n"
-  read -p "Ignore Patterns (Default: .git, .env, .pkl, pycache): " ignore_patterns
+  read -p "Ignore Patterns, .gitignore syntax (Default: .git, .env, *.pkl, __pycache__): " ignore_patterns
   if [ -n "$ignore_patterns" ]; then
     ignore_arg="--ignore $ignore_patterns"
   fi
@@ -42,13 +42,16 @@ function prompt_args() {
   fi
 
   printf "\nHow long can the summary be (in BPE tokens)?\n"
-  read -p "Max Tokens Out (Default: 4096): " max_tokens_out
-  max_tokens_out=${max_tokens_out:-4096}
-  max_tokens_out_arg="--max-tokens-out $max_tokens_out"
+  read -p "Max Tokens Out (Default: 4096, no limit with --all): " max_tokens_out
+  if [ -n "$max_tokens_out" ]; then
+    max_tokens_out_arg="--max-tokens-out $max_tokens_out"
+  fi
 }
 
 input_path="."
 all_arg=""
+cache_command=false
+extra_args=""
 copy_arg=""
 ignore_arg=""
 manual_mode=false
@@ -80,6 +83,14 @@ do
         shift
       done
       ;;
+    --jobs|-j|--workers|-w|--rpm|--tpm|--max-retries|--batch-tokens|--clone-depth|--rev|--preview-lines|--preview-bytes|--max-file-bytes|--max-total-bytes|--output)
+      extra_args="$extra_args $1 $2"
+      shift 2
+      ;;
+    --no-cache|--git-index|--blobless|--no-clone-cache|--incremental|--incremental=*)
+      extra_args="$extra_args $1"
+      shift
+      ;;
     --manual|-m)
       manual_mode=true
       shift
@@ -120,6 +131,15 @@ do
         traceback_arg="--traceback"
       fi
       ;;
+    cache)
+      if [[ "$2" == "stats" || "$2" == "prune" || "$2" == "clear" ]]; then
+        cache_command=true
+        shift
+        break
+      fi
+      input_path="$1"
+      shift
+      ;;
     *)
       input_path="$1"
       shift
@@ -145,7 +165,12 @@ elif ! command -v python >/dev/null 2>&1; then
   exit 1
 fi
 
+if [ "$cache_command" = true ]; then
+  "$PYTHON_CMD" "$script_dir/../main.py" cache "$@"
+  exit $?
+fi
+
 # Call the Python script with the proper arguments
 printf "\033[1;36mCodeSumma\033[0m\n"
-echo "$PYTHON_CMD $script_dir/../main.py $input_path $all_arg $copy_arg $ignore_arg $print_full_arg $print_only_arg $traceback_arg $max_tokens_out_arg ${@/--manual/}"
-eval "$PYTHON_CMD $script_dir/../main.py \"$input_path\" $all_arg $copy_arg $ignore_arg $print_full_arg $print_only_arg $traceback_arg $max_tokens_out_arg ${@/--manual/}"
\ No newline at end of file
+echo "$PYTHON_CMD $script_dir/../main.py $input_path $all_arg $copy_arg $ignore_arg $print_full_arg $print_only_arg $traceback_arg $max_tokens_out_arg$extra_args ${@/--manual/}"
+eval "$PYTHON_CMD $script_dir/../main.py \"$input_path\" $all_arg $copy_arg $ignore_arg $print_full_arg $print_only_arg $traceback_arg $max_tokens_out_arg$extra_args ${@/--manual/}"
\ No newline at end of file
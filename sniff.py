@@ -0,0 +1,95 @@
+# src/sniff.py
+import codecs
+import os
+
+# Files with these extensions are binary, and are skipped without being opened
+BINARY_EXTENSIONS = frozenset([
+    # Images, audio and video
+    '.bmp', '.gif', '.ico', '.icns', '.jpeg', '.jpg', '.png', '.psd', '.tif', '.tiff', '.webp',
+    '.avi', '.flac', '.m4a', '.mkv', '.mov', '.mp3', '.mp4', '.ogg', '.wav', '.webm',
+    # Documents and fonts
+    '.doc', '.docx', '.pdf', '.ppt', '.pptx', '.xls', '.xlsx', '.eot', '.otf', '.ttf', '.woff', '.woff2',
+    # Archives
+    '.7z', '.bz2', '.gz', '.jar', '.rar', '.tar', '.tgz', '.whl', '.xz', '.zip', '.zst',
+    # Compiled code
+    '.a', '.class', '.dll', '.dylib', '.exe', '.o', '.obj', '.pyc', '.pyd', '.pyo', '.so', '.wasm',
+    # Data and model weights
+    '.arrow', '.avro', '.bin', '.ckpt', '.db', '.feather', '.gguf', '.h5', '.hdf5', '.joblib', '.mat',
+    '.npy', '.npz', '.onnx', '.orc', '.parquet', '.pb', '.pickle', '.pkl', '.pt', '.pth',
+    '.safetensors', '.sqlite', '.sqlite3', '.tflite',
+])
+
+# Files with these extensions are text, and are read without sniffing them first
+TEXT_EXTENSIONS = frozenset([
+    '.c', '.cc', '.cfg', '.cpp', '.cs', '.css', '.csv', '.go', '.h', '.hpp', '.html', '.ini', '.ipynb',
+    '.java', '.js', '.json', '.jsonl', '.jsx', '.kt', '.log', '.md', '.php', '.py', '.pyi', '.rb',
+    '.rs', '.rst', '.scss', '.sh', '.sql', '.swift', '.toml', '.ts', '.tsv', '.tsx', '.txt', '.xml',
+    '.yaml', '.yml',
+])
+
+# Leading bytes of binary formats that can hide behind any extension
+MAGIC_NUMBERS = (
+    b'\x89PNG', b'\xff\xd8\xff', b'GIF8', b'%PDF', b'PK\x03\x04', b'\x1f\x8b', b'BZh', b'\xfd7zXZ',
+    b'7z\xbc\xaf', b'Rar!', b'\x28\xb5\x2f\xfd', b'\x7fELF', b'MZ', b'\xca\xfe\xba\xbe',
+    b'\xcf\xfa\xed\xfe', b'\xce\xfa\xed\xfe', b'\x00asm', b'SQLite format 3\x00', b'\x93NUMPY',
+    b'PAR1', b'\x89HDF', b'ARROW1',
+)
+
+# Byte order marks, checked longest first since UTF-32 LE starts like UTF-16 LE
+BYTE_ORDER_MARKS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# The number of leading bytes sniffed
+SNIFF_BYTES = 8192
+
+# Control characters that do not appear in text, other than NUL
+_CONTROL_BYTES = bytes(set(range(32)) - {0, 8, 9, 10, 12, 13, 27})
+
+
+def file_extension(file_path):
+    """
+    Get a file's extension in lower case.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        str: The extension, with its dot, or '' if there is none.
+    """
+
+    return os.path.splitext(file_path)[1].lower()
+
+
+def detect_encoding(data):
+    """
+    Detect the encoding of a file from its leading bytes.
+
+    Byte order marks are trusted, known binary formats are recognized by
+    their magic numbers, and any other data with a NUL byte or many control
+    characters is binary. Text that is not UTF-8 is read as Latin-1.
+
+    Args:
+        data (bytes): The first bytes of the file.
+
+    Returns:
+        str: The name of the encoding to read the file with, or None if it is binary.
+    """
+
+    for byte_order_mark, encoding in BYTE_ORDER_MARKS:
+        if data.startswith(byte_order_mark):
+            return encoding
+    if data.startswith(MAGIC_NUMBERS) or b'\x00' in data:
+        return None
+
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError as error:
+        # A character may be cut at the end of the sniffed bytes
+        if error.reason != 'unexpected end of data':
+            return 'latin-1' if len(data.translate(None, _CONTROL_BYTES)) > len(data) * 0.95 else None
+    return 'utf-8'
@@ -1,57 +1,127 @@
 # summary.py
 import ast
+import contextlib
 import os
 import sys
 import shutil
 import fnmatch
-from git import Repo
-import tempfile
+import io
+import json
+import math
+import threading
+from concurrent.futures import Future
 from file_processing import (
-    check_ignore_patterns,
-    remove_matching_patterns_from_list,
-    get_all_code,
+    iter_all_code,
     get_code_for_matching_patterns,
     format_file_hierarchy,
     get_ignore_patterns,
+    open_binary,
+    open_file,
+    read_code,
+    report_skipped_files,
+    sniff_file,
+    ByteBudget,
+    FileIndex,
+    MAX_FILE_BYTES,
+)
+from cache import (
+    file_digest,
+    get_cache,
+    get_default_cache,
+    set_cache,
 )
 from openai_api import (
+    APPROXIMATE_TOKENS_MARGIN,
+    approximate_tokens,
     call_openai_api,
-    OPENAI_API_KEY,
+    configure_scheduler,
+    in_flight,
+    scheduler,
+    SingleFlight,
     estimate_tokens,
+    get_api_key,
     trim_string_to_token_limit,
 )
+from manifest import RunManifest
+from output import SummaryWriter
+from pipeline import Pipeline, Stage
+from preview import configure_preview, is_preview_file, preview
+from repository import clone_repository, fetch_revision
 from traceback_parser import (
     parse_traceback,
     format_parsed_traceback,
 )
 from utils import (
-    is_github_url,
+    is_repository_url,
     get_function_info,
     process_class,
 )
 
+# Bump when the per-file summaries change, so cached summaries are not reused
+EXTRACTOR_VERSION = 1
+
+# The summary's token limit when --max-tokens-out is not given. The output of
+# --all has no limit by default.
+DEFAULT_MAX_TOKENS_OUT = 4096
+
+# Python files are parsed by --workers processes in chunks of up to this many files
+EXTRACT_CHUNK_SIZE = 64
+
+# The most bytes of a file read for its OpenAI summary, well over the 2000
+# tokens that are sent
+SUMMARY_INPUT_BYTES = 64 * 1024
 
-def run_summary(args):
+
+def run_summary(args, writer=None):
     """
     Run the summary.
 
     Args:
         args (argparse.Namespace): The arguments.
+        writer (SummaryWriter, optional): With --all, the code is streamed to
+            this writer as it is read instead of being returned. Defaults to None.
 
     Returns:
-        str: The formatted summary.
+        str: The formatted summary, or None if it was written to the writer.
+        int: The number of tokens in the summary.
+    """
+
+    # A cached clone stays locked until the run is done with it
+    with contextlib.ExitStack() as resources:
+        return _run_summary(args, writer, resources)
+
+
+def _run_summary(args, writer, resources):
+    """
+    Run the summary, for run_summary().
+
+    Args:
+        args (argparse.Namespace): The arguments.
+        writer (SummaryWriter): The writer for --all, or None.
+        resources (contextlib.ExitStack): Holds the locks taken during the run.
+
+    Returns:
+        str: The formatted summary, or None if it was written to the writer.
         int: The number of tokens in the summary.
     """
 
     input_path = args.input_path
     ignore_patterns = get_ignore_patterns(input_path, args.ignore)
 
-    if is_github_url(input_path):
-        print(f"Cloning {input_path}...")
-        tmpdir = tempfile.mkdtemp()
-        Repo.clone_from(input_path, tmpdir)
-        print(f"Cloned to {tmpdir}")
-        input_path = tmpdir
+    is_clone = is_repository_url(input_path)
+    rev = args.rev
+    if is_clone:
+        input_path, _, lock = clone_repository(
+            input_path, args.clone_depth, args.blobless, use_cache=not args.no_clone_cache
+        )
+        if lock is not None:
+            resources.enter_context(lock)
+        if rev is not None:
+            rev = fetch_revision(input_path, rev, args.clone_depth, args.blobless)
+
+    cache = None if args.no_cache else get_default_cache()
+    configure_scheduler(args.rpm, args.tpm, args.max_retries)
+    configure_preview(args.preview_lines, args.preview_bytes)
 
     print_full_patterns = args.print_full or []
 
@@ -62,48 +132,103 @@ def run_summary(args):
     if isinstance(print_only_patterns, list) and len(print_only_patterns) == 1:
         print_only_patterns = print_only_patterns[0].split(',')
 
+    # --incremental directory summaries are recorded in a manifest, which the next one resumes
+    manifest = None
+    if (args.incremental and os.path.isdir(input_path) and not args.all and not args.print_only
+            and not (is_clone and args.no_clone_cache)):
+        manifest = start_manifest(args, input_path, rev, ignore_patterns, print_full_patterns)
+
+    # Index the input once for the file hierarchy and the summaries. Clones
+    # are listed from the git index, since they only contain tracked files.
+    file_index = None
+    if rev is not None:
+        if not os.path.isdir(input_path):
+            print("--rev needs a directory in a git repository.")
+            sys.exit(1)
+        from git import BadName, InvalidGitRepositoryError
+
+        try:
+            file_index = FileIndex.from_git_tree(input_path, rev, ignore_patterns)
+        except (InvalidGitRepositoryError, BadName, ValueError) as error:
+            print(f"Could not read {rev} in {input_path}: {error}")
+            sys.exit(1)
+        print(f"Listed {len(file_index.files())} files at {rev}.")
+    elif manifest is not None and manifest.changed is not None:
+        file_index = manifest.file_index(ignore_patterns)
+        print(f"Listed {len(file_index.files())} files from the last run and git, "
+              f"{len(manifest.changed)} changed since then.")
+    elif (args.git_index or is_clone) and os.path.isdir(input_path):
+        from git import InvalidGitRepositoryError
+
+        try:
+            file_index = FileIndex.from_git_index(input_path, ignore_patterns)
+            print(f"Listed {len(file_index.files())} files tracked by git.")
+        except InvalidGitRepositoryError:
+            print(f"{input_path} is not in a git repository, scanning it instead.")
+    if file_index is None:
+        file_index = FileIndex.scan(input_path, ignore_patterns)
+
     if args.all:
         print(f"Summarizing all code in: {input_path}")
-        summary = get_all_code(input_path, ignore_patterns)
-    elif args.print_only:
+        buffer = None
+        if writer is None:
+            buffer = io.StringIO()
+            writer = SummaryWriter(buffer, args.max_tokens_out)
+        num_tokens = write_all_code(writer, input_path, ignore_patterns, file_index, args, is_clone)
+        if is_clone and args.no_clone_cache:
+            # Delete the temporary directory
+            shutil.rmtree(input_path)
+        return (buffer.getvalue() if buffer is not None else None), num_tokens
+
+    # The directory summaries are formatted as they are produced, so the raw
+    # summaries are not kept
+    formatted = False
+    if args.print_only:
         print(f"Printing full file content for files matching: {print_only_patterns}")
-        summary = get_code_for_matching_patterns(input_path, print_only_patterns, ignore_patterns)
+        summary = get_code_for_matching_patterns(input_path, print_only_patterns, ignore_patterns, file_index)
     elif os.path.isfile(input_path) and input_path.endswith('.py'):
         print(f"Summarizing file: {input_path}")
         if any(fnmatch.fnmatch(input_path, pattern) for pattern in print_full_patterns):
-            with open(input_path, 'r') as f:
-                summary = {input_path: f.read()}
+            summary = {input_path: read_code(input_path, max_bytes=args.max_file_bytes)}
         elif any(fnmatch.fnmatch(input_path, pattern) for pattern in print_only_patterns):
             with open(input_path, 'r') as f:
                 summary = {input_path: f.read()}
         else:
-            functions = generate_summary_from_python_file(input_path)
-            if functions:
-                summary = {input_path: functions}
-            else:
-                with open(input_path, 'r') as f:
-                    code = f.read()
-                code = trim_string_to_token_limit(code, 2000)
-                prompt = f"Summarize the following:\n````\n{code}\n````"
-                summary = {input_path: call_openai_api(prompt, 200)}
+            summary = {input_path: summarize_file(input_path, cache)}
     elif os.path.isdir(input_path):
         print(f"Summarizing directory: {input_path}")
-        summary = summarize_directory(input_path, ignore_patterns, print_full_patterns)
+        summary = summarize_directory(
+            input_path, ignore_patterns, print_full_patterns, cache, args.jobs, args.batch_tokens, file_index,
+            args.max_file_bytes, args.max_total_bytes, args.workers, format_summary, manifest
+        )
+        formatted = True
+        if manifest is not None:
+            try:
+                manifest.save(track_git=True)
+            except OSError as error:
+                print(f"Could not save the run manifest: {error}")
     else:
         print("Invalid input. Please provide a path to a Python file or a directory.")
         sys.exit(1)
 
     summary_blocks = {
-        "file_hierarchy": format_file_hierarchy(input_path, ignore_patterns),
-        "file_summaries": format_summaries(summary),
+        "file_hierarchy": format_file_hierarchy(
+            input_path, ignore_patterns, file_index, './' if is_clone else None
+        ),
+        "file_summaries": summary if formatted else format_summaries(summary),
         "traceback": args.traceback,
         "traceback_context": None,
     }
 
-    if is_github_url(args.input_path):
-        summary_blocks["file_summaries"] = summary_blocks["file_summaries"].replace(tmpdir, "")
-        # Delete the temporary directory
-        shutil.rmtree(tmpdir)
+    if is_clone:
+        # Show the files relative to the clone
+        summary_blocks["file_summaries"] = {
+            file_path.replace(input_path, ""): file_summary.replace(input_path, "")
+            for file_path, file_summary in summary_blocks["file_summaries"].items()
+        }
+        if args.no_clone_cache:
+            # Delete the temporary directory
+            shutil.rmtree(input_path)
 
     # if the length of the file_summaries is 0 or the content of the file_summaries is empty, then exit
     if len(summary_blocks["file_summaries"]) == 0 or summary_blocks["file_summaries"] == "":
@@ -116,33 +241,22 @@ def run_summary(args):
         sys.exit(1)
 
     if args.traceback is not None:
+        summary_blocks["traceback"], summary_blocks["traceback_context"] = read_traceback(args.traceback)
 
-        if args.traceback is True:
-            print("Paste Traceback:")
-            traceback_lines = []
-            while True:
-                try:
-                    line = input()
-                    traceback_lines.append(line)
-                except EOFError:
-                    break
-            traceback_str = "\n".join(traceback_lines)
-        else:
-            traceback_str = args.traceback
-
-        summary_blocks["traceback"] = traceback_str
+    print(f"Summarizing {len(summary_blocks['file_summaries'])} files...")
+    max_tokens_out = args.max_tokens_out if args.max_tokens_out is not None else DEFAULT_MAX_TOKENS_OUT
+    summary_blocks = summarize_blocks(summary_blocks, max_tokens_out, print_full_patterns)
 
-        parsed_traceback = parse_traceback(traceback_str)
-        formatted_traceback = format_parsed_traceback(parsed_traceback)
-        summary_blocks["traceback_context"] = formatted_traceback
+    if scheduler.requests:
+        print(f"Sent {scheduler.requests} OpenAI requests with {scheduler.retries} retries, "
+              f"throttled for {scheduler.throttled_seconds:.1f}s")
+    if in_flight.saved:
+        print(f"Shared {in_flight.saved} identical OpenAI requests that were already in flight.")
 
-    if not args.all:
-        print(f"Summarizing {len(summary_blocks['file_summaries'])} files...")
-        summary_blocks = summarize_blocks(summary_blocks, args.max_tokens_out, print_full_patterns)
-
-    # Join the file summaries into a single string
+    # Join the file summaries into a single string unless they were already reduced
     # The file_summaries are a dictionary of file paths and their summaries
-    summary_blocks["file_summary"] = "\n".join(summary_blocks["file_summaries"].values())
+    if "file_summary" not in summary_blocks:
+        summary_blocks["file_summary"] = "\n".join(summary_blocks["file_summaries"].values())
 
     formatted_summary = f"""Context:
 
@@ -156,32 +270,192 @@ File Summary:
 """
 
     if args.traceback is not None:
-        formatted_summary += f"""
+        formatted_summary += format_traceback(summary_blocks['traceback'], summary_blocks['traceback_context'])
+
+    # Get some stats about the summary, the only exact count of the run
+    num_tokens = estimate_tokens(formatted_summary)
+
+    return formatted_summary, num_tokens
+
+
+def start_manifest(args, input_path, rev, ignore_patterns, print_full_patterns):
+    """
+    Start the manifest of an --incremental directory summary, resuming the
+    previous run's.
+
+    Args:
+        args (argparse.Namespace): The arguments.
+        input_path (str): The path to the directory.
+        rev (str): The git revision read with --rev, or None for the worktree.
+        ignore_patterns (list): A list of patterns to ignore.
+        print_full_patterns (list): The --print-full patterns.
+
+    Returns:
+        RunManifest: The manifest.
+    """
+
+    # The options the recorded summaries depend on
+    settings = {
+        'extractor': EXTRACTOR_VERSION,
+        'mode': 'openai' if get_api_key() is not None else 'offline',
+        'rev': rev,
+        'ignore': ignore_patterns,
+        'print_full': print_full_patterns,
+        'max_file_bytes': args.max_file_bytes,
+        'max_total_bytes': args.max_total_bytes,
+        'preview': [args.preview_lines, args.preview_bytes],
+    }
+    manifest = RunManifest(input_path, settings)
+    if args.no_cache:
+        print("--no-cache summarizes every file again, ignoring --incremental.")
+        return manifest
+
+    previous = RunManifest.load(input_path, settings)
+    if previous is None:
+        print("No previous run with the same options, summarizing every file.")
+    elif rev is not None:
+        # The tree is listed from git anyway, and files are compared by blob SHA
+        manifest.previous = previous.files
+    else:
+        manifest.resume(previous, args.incremental if isinstance(args.incremental, str) else None)
+    return manifest
+
+
+def read_traceback(traceback):
+    """
+    Read a traceback and find the code it refers to.
+
+    Args:
+        traceback (str or bool): The traceback, or True to read it from stdin.
+
+    Returns:
+        str: The traceback.
+        str: The formatted context of the traceback.
+    """
+
+    if traceback is True:
+        print("Paste Traceback:")
+        traceback_lines = []
+        while True:
+            try:
+                line = input()
+                traceback_lines.append(line)
+            except EOFError:
+                break
+        traceback = "\n".join(traceback_lines)
+
+    parsed_traceback = parse_traceback(traceback)
+    return traceback, format_parsed_traceback(parsed_traceback)
+
+
+def format_traceback(traceback, traceback_context):
+    """
+    Format the traceback section that ends a summary.
+
+    Args:
+        traceback (str): The traceback.
+        traceback_context (str): The formatted context of the traceback.
+
+    Returns:
+        str: The section.
+    """
+
+    return f"""
 Traceback:
 ```
-{summary_blocks['traceback']}
+{traceback}
 ```
 
 Traceback Context:
 ```
-{summary_blocks['traceback_context']}
+{traceback_context}
 ```
 
 Resolve this error.
 """
 
-    # Get some stats about the summary
-    num_tokens = estimate_tokens(formatted_summary)
 
-    return formatted_summary, num_tokens
+def write_all_code(writer, input_path, ignore_patterns, file_index, args, is_clone=False):
+    """
+    Write all code in a directory to a writer, each file as soon as it is read.
 
+    The output is the same as the summary of --all: the directory structure,
+    the files and the traceback, if any. It stops at the writer's token limit,
+    and the remaining files are not read.
 
-def generate_summary_from_python_file(file_path):
+    Args:
+        writer (SummaryWriter): The writer.
+        input_path (str): The path to the directory.
+        ignore_patterns (list): A list of patterns to ignore.
+        file_index (FileIndex): The index of the directory.
+        args (argparse.Namespace): The arguments.
+        is_clone (bool, optional): Whether the directory is a clone, whose
+            path is left out of the output. Defaults to False.
+
+    Returns:
+        int: The number of tokens written.
+    """
+
+    # Progress goes to stderr while the code is streamed to stdout, so that
+    # it does not end up in the output
+    log = contextlib.redirect_stdout(sys.stderr) if writer.stream is sys.stdout else contextlib.nullcontext()
+    with log:
+        # Read a pasted traceback before the output starts
+        if args.traceback is not None:
+            traceback, traceback_context = read_traceback(args.traceback)
+
+        file_hierarchy = format_file_hierarchy(input_path, ignore_patterns, file_index, './' if is_clone else None)
+        if not writer.write(f"""Context:
+
+Directory Structure:
+```
+{file_hierarchy}
+```
+
+File Summary:
+"""):
+            print(f"Stopped before the first file: the directory structure is over {args.max_tokens_out} tokens "
+                  f"(--max-tokens-out).")
+            return writer.tokens
+
+        def formatter(file_path, code):
+            formatted_code = format_summary(file_path, code)
+            # Show the files relative to the clone
+            return formatted_code.replace(input_path, "") if is_clone else formatted_code
+
+        num_files = 0
+        files = iter_all_code(
+            input_path, ignore_patterns, file_index, args.max_file_bytes, args.max_total_bytes, formatter
+        )
+        for _, formatted_code in files:
+            if not writer.write(formatted_code if num_files == 0 else f"\n{formatted_code}"):
+                print(f"Stopped after {num_files} files at {args.max_tokens_out} tokens (--max-tokens-out).")
+                # Stop reading the other files
+                files.close()
+                break
+            num_files += 1
+
+        if num_files == 0 and not writer.stopped:
+            print("No summary generated.")
+            print("Please check the input path and ignore patterns.")
+            print(f"Input path: {args.input_path}")
+            print(f"Ignore patterns: {ignore_patterns}")
+            sys.exit(1)
+
+        writer.write("\n")
+        if args.traceback is not None:
+            writer.write(format_traceback(traceback, traceback_context))
+        return writer.tokens
+
+
+def generate_summary_from_python_file(file_path, file_record=None):
     """
     Generate a summary of a Python file.
 
     Args:
         file_path (str): The path to the Python file.
+        file_record (FileRecord, optional): The file's entry in a FileIndex,
+            to read it from git when it was indexed at a revision. Defaults to None.
 
     Returns:
         list: A list of the file's functions and classes.
@@ -190,7 +464,7 @@ def generate_summary_from_python_file(file_path):
     if not file_path.endswith('.py'):
         return []
 
-    with open(file_path, 'r') as f:
+    with open_file(file_path, file_record) as f:
         file_contents = f.read()
 
     try:
@@ -210,19 +484,401 @@ def generate_summary_from_python_file(file_path):
     return summary_items
 
 
-def summarize_directory(dir_path, ignore_patterns=None, print_full_patterns=None):
+class SummaryBatcher:
+    """
+    Pack small files into shared OpenAI requests.
+
+    Files are queued until the next one would push the batch past `max_tokens`
+    or `max_files`. The batch is then sent as one prompt that asks for a JSON
+    object of per-file summaries. Files missing from the response are
+    summarized on their own.
+    """
+
+    def __init__(self, max_tokens=2000, max_files=10, max_file_tokens=500):
+        self.max_tokens = max_tokens
+        self.max_files = max_files
+        self.max_file_tokens = max_file_tokens
+        self.requests = 0
+        self.batched_files = 0
+        self._pending = []
+        self._pending_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, file_path, code, tokens):
+        """
+        Queue a file for summarizing.
+
+        Args:
+            file_path (str): The path to the file.
+            code (str): The file's content.
+            tokens (int): The number of tokens in the content.
+
+        Returns:
+            Future: The file's summary, set once its batch has been sent.
+        """
+
+        future = Future()
+        with self._lock:
+            if self._pending and (self._pending_tokens + tokens > self.max_tokens
+                                  or len(self._pending) >= self.max_files):
+                batch = self._take_pending()
+            else:
+                batch = None
+            self._pending.append((file_path, code, future))
+            self._pending_tokens += tokens
+
+        if batch:
+            self._send(batch)
+        return future
+
+    def flush(self):
+        """
+        Send the files that are still queued.
+        """
+
+        with self._lock:
+            batch = self._take_pending()
+        if batch:
+            self._send(batch)
+
+    def _take_pending(self):
+        batch = self._pending
+        self._pending = []
+        self._pending_tokens = 0
+        return batch
+
+    def _send(self, batch):
+        try:
+            if len(batch) == 1:
+                summaries = {}
+            else:
+                files = "\n\n".join(
+                    f"File {number}: {file_path}\n````\n{code}\n````"
+                    for number, (file_path, code, _) in enumerate(batch, 1)
+                )
+                prompt = f"""Summarize each of the following files.
+Respond with only a JSON object that maps each file number to its summary, for example {{"1": "..."}}.
+
+{files}
+"""
+                summaries = parse_batch_response(call_openai_api(prompt, 200 * len(batch)))
+                with self._lock:
+                    self.requests += 1
+
+            for number, (file_path, code, future) in enumerate(batch, 1):
+                file_summary = summaries.get(str(number))
+                if isinstance(file_summary, str) and file_summary.strip():
+                    with self._lock:
+                        self.batched_files += 1
+                else:
+                    prompt = f"Summarize the following:\n````\n{code}\n````"
+                    file_summary = call_openai_api(prompt, 200)
+                future.set_result(file_summary)
+        except Exception as error:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+
+def parse_batch_response(response):
+    """
+    Get the per-file summaries from the response to a batched prompt.
+
+    Args:
+        response (str): The response text.
+
+    Returns:
+        dict: The summaries keyed by file number, empty if the response is not
+            a JSON object.
+    """
+
+    start = response.find('{')
+    end = response.rfind('}')
+    if start == -1 or end < start:
+        return {}
+    try:
+        summaries = json.loads(response[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+    return summaries if isinstance(summaries, dict) else {}
+
+
+def summarize_with_openai(file_path, batcher=None, file_record=None, encoding=None):
+    """
+    Summarize a file's content with the OpenAI API.
+
+    Args:
+        file_path (str): The path to the file.
+        batcher (SummaryBatcher, optional): Packs small files into shared
+            requests. Defaults to None.
+        file_record (FileRecord, optional): The file's entry in a FileIndex,
+            to read it from git when it was indexed at a revision. Defaults to None.
+        encoding (str, optional): The file's encoding, as found by sniff_file().
+            Defaults to None, which uses UTF-8.
+
+    Returns:
+        str or Future: The summary of the file, or a future summary if the file
+            was queued in a batch.
+    """
+
+    file_size = os.path.getsize(file_path) if file_record is None else file_record.size
+    if is_preview_file(file_path, file_size):
+        # Only the first and last lines of data files are sent
+        with open_binary(file_path, file_record) as f:
+            code = preview(f)
+    else:
+        code = read_code(file_path, file_record, encoding, SUMMARY_INPUT_BYTES)
+    # If the code is too long, trim it to the token limit
+    code = trim_string_to_token_limit(code, 2000)
+
+    if batcher is not None:
+        tokens = estimate_tokens(code)
+        if tokens <= batcher.max_file_tokens:
+            return batcher.add(file_path, code, tokens)
+
+    prompt = f"Summarize the following:\n````\n{code}\n````"
+    return call_openai_api(prompt, 200)
+
+
+def summarize_file(file_path, cache=None, batcher=None, deduplicator=None, file_record=None, python_summary=None,
+                   digests=None, encoding=None):
+    """
+    Generate a summary of a single file.
+
+    Python files are summarized by their functions and classes, falling back to
+    the OpenAI API when they cannot be parsed. Other text files are summarized
+    with the OpenAI API.
+
+    Args:
+        file_path (str): The path to the file.
+        cache (ResponseCache, optional): A cache of file summaries keyed by the
+            file's content. Defaults to None.
+        batcher (SummaryBatcher, optional): Packs small files into shared
+            requests. Defaults to None.
+        deduplicator (SingleFlight, optional): Summarizes each distinct file
+            content only once, sharing the summary with identical files.
+            Defaults to None.
+        file_record (FileRecord, optional): The file's entry in a FileIndex,
+            to reuse its size and mtime instead of stat'ing it. Files indexed
+            at a git revision are keyed by their blob SHA. Defaults to None.
+        python_summary (list, optional): The functions and classes of a Python
+            file, or False if it does not parse, when they were already
+            extracted. Defaults to None.
+        digests (dict, optional): Filled with the file's content digest, by
+            path, when it is computed. Defaults to None.
+        encoding (str, optional): The file's encoding, as found by sniff_file().
+            Defaults to None, which uses UTF-8.
+
+    Returns:
+        list, str or Future: The file's functions and classes, or its summary.
+            The summary is a Future if the file was queued in a batch.
+    """
+
+    if file_record is None:
+        stat_result = os.stat(file_path)
+        file_size, mtime_ns = stat_result.st_size, stat_result.st_mtime_ns
+    else:
+        file_size, mtime_ns = file_record.size, file_record.mtime_ns
+    if not file_path.endswith('.py') and (file_size < 100 or file_path.endswith('.txt')):
+        return []
+
+    if cache is None and deduplicator is None:
+        return summarize_file_content(file_path, None, None, batcher, file_record, python_summary, encoding)
+
+    summary_key = file_summary_key(file_path, cache, file_record, file_size, mtime_ns)
+    if digests is not None:
+        digests[file_path] = summary_key[1]
+
+    if deduplicator is not None:
+        return deduplicator.do(
+            summary_key,
+            lambda: summarize_file_content(file_path, summary_key, cache, batcher, file_record, python_summary,
+                                           encoding)
+        )
+    return summarize_file_content(file_path, summary_key, cache, batcher, file_record, python_summary, encoding)
+
+
+def file_summary_key(file_path, cache=None, file_record=None, file_size=None, mtime_ns=None):
+    """
+    Get the key of a file's summary, from its content digest.
+
+    Args:
+        file_path (str): The path to the file.
+        cache (ResponseCache, optional): The cache, which remembers the digests
+            of unchanged files. Defaults to None.
+        file_record (FileRecord, optional): The file's entry in a FileIndex.
+            Files indexed at a git revision are keyed by their blob SHA.
+            Defaults to None.
+        file_size (int, optional): The file's size, if it is known. Defaults to None.
+        mtime_ns (int, optional): The file's mtime, if it is known. Defaults to None.
+
+    Returns:
+        tuple: The file's content digest, extractor version and mode.
+    """
+
+    if file_record is not None and file_record.blob is not None:
+        # The blob SHA already identifies the content
+        digest = f"git:{file_record.blob.hexsha}"
+    elif cache is not None:
+        digest = cache.file_digest(file_path, file_size, mtime_ns)
+    else:
+        digest = file_digest(file_path)
+    mode = 'openai' if get_api_key() is not None else 'offline'
+    # Python files are keyed apart, since they are summarized by their functions
+    return ('file_summary', digest, file_path.endswith('.py'), EXTRACTOR_VERSION, mode)
+
+
+def _extract_python_chunk(file_paths):
+    """
+    Read and parse a chunk of Python files in a worker process.
+
+    Args:
+        file_paths (list): The paths to the files.
+
+    Returns:
+        list: Each file's functions and classes, False if it does not parse,
+            or None if it could not be read.
+    """
+
+    results = []
+    for file_path in file_paths:
+        try:
+            results.append(generate_summary_from_python_file(file_path))
+        except (OSError, UnicodeDecodeError):
+            results.append(None)
+    return results
+
+
+def extract_python_summaries(file_paths, workers, chunk_size=EXTRACT_CHUNK_SIZE):
+    """
+    Read and parse Python files in a pool of processes.
+
+    The files are sent to the workers in chunks, and only their functions and
+    classes come back, not their ASTs.
+
+    Args:
+        file_paths (list): The paths to the files.
+        workers (int): The number of processes.
+        chunk_size (int, optional): The most files sent to a worker at once.
+            Defaults to EXTRACT_CHUNK_SIZE.
+
+    Returns:
+        dict: Each file's functions and classes, or False if it does not parse,
+            in the order of file_paths. Files that could not be read are left out.
+    """
+
+    # Smaller chunks for few files, so every worker gets some
+    chunk_size = max(1, min(chunk_size, math.ceil(len(file_paths) / (workers * 4))))
+    chunks = [file_paths[i:i + chunk_size] for i in range(0, len(file_paths), chunk_size)]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    extracted = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map() returns the chunks in order, whichever worker finishes first
+        for chunk, results in zip(chunks, executor.map(_extract_python_chunk, chunks)):
+            for file_path, result in zip(chunk, results):
+                if result is not None:
+                    extracted[file_path] = result
+    return extracted
+
+
+def summarize_file_content(file_path, summary_key=None, cache=None, batcher=None, file_record=None,
+                           python_summary=None, encoding=None):
+    """
+    Summarize a file, reusing the cached summary of the same content.
+
+    Args:
+        file_path (str): The path to the file.
+        summary_key (tuple, optional): The file's content digest, extractor
+            version and mode. Defaults to None.
+        cache (ResponseCache, optional): A cache of file summaries. Defaults to None.
+        batcher (SummaryBatcher, optional): Packs small files into shared
+            requests. Defaults to None.
+        file_record (FileRecord, optional): The file's entry in a FileIndex.
+            Defaults to None.
+        python_summary (list, optional): The functions and classes of a Python
+            file, or False if it does not parse, when they were already
+            extracted. Defaults to None.
+        encoding (str, optional): The file's encoding, as found by sniff_file().
+            Defaults to None, which uses UTF-8.
+
+    Returns:
+        list, str or Future: The file's functions and classes, or its summary.
+    """
+
+    if cache is not None:
+        file_summary = get_cache(summary_key, cache)
+        if file_summary is not None:
+            return file_summary
+
+    if file_path.endswith('.py'):
+        if python_summary is not None:
+            file_summary = python_summary
+        else:
+            file_summary = generate_summary_from_python_file(file_path, file_record)
+        if not file_summary:
+            file_summary = summarize_with_openai(file_path, batcher, file_record, encoding)
+    else:
+        try:
+            file_summary = summarize_with_openai(file_path, batcher, file_record, encoding)
+        except UnicodeDecodeError:
+            file_summary = []
+
+    # Without an API key the "summary" is the prompt itself, which is not worth keeping
+    if cache is not None and (isinstance(file_summary, list) or get_api_key() is not None):
+        if isinstance(file_summary, Future):
+            file_summary.add_done_callback(
+                lambda future: future.exception() or set_cache(summary_key, future.result(), cache)
+            )
+        else:
+            set_cache(summary_key, file_summary, cache)
+
+    return file_summary
+
+
+def summarize_directory(dir_path, ignore_patterns=None, print_full_patterns=None, cache=None, jobs=1,
+                        batch_tokens=0, file_index=None, max_file_bytes=MAX_FILE_BYTES, max_total_bytes=0,
+                        workers=1, formatter=None, manifest=None):
     """
     Generate a summary of a directory.
 
+    The files are classified, read, summarized and formatted in a Pipeline,
+    so the stages overlap, and the throughput of each stage is reported.
+
     Args:
         dir_path (str): The path to the directory.
         ignore_patterns (list, optional): A list of patterns to ignore.
             Defaults to None.
         print_full_patterns (list, optional): A list of patterns to print the full
             file instead of summarizing. Defaults to None.
+        cache (ResponseCache, optional): A cache of file summaries keyed by the
+            file's content. Unchanged files are not read or parsed again.
+            Defaults to None.
+        jobs (int, optional): The number of files to summarize at once.
+            Defaults to 1.
+        batch_tokens (int, optional): Pack small files into shared OpenAI
+            requests of up to this many prompt tokens. Defaults to 0, which
+            sends one request per file.
+        file_index (FileIndex, optional): An index of the directory to reuse
+            instead of scanning it again. Defaults to None.
+        max_file_bytes (int, optional): Cut each --print-full file after this
+            many bytes, 0 for no limit. Defaults to MAX_FILE_BYTES.
+        max_total_bytes (int, optional): Summarize the --print-full files after
+            this many bytes of them instead, 0 for no limit. Defaults to 0.
+        workers (int, optional): The number of processes that read and parse
+            the Python files, before they are summarized. Defaults to 1, which
+            parses them as they are summarized.
+        formatter (callable, optional): Called with each file's path and
+            summary as soon as it is ready, so only its result is kept.
+            Defaults to None.
+        manifest (RunManifest, optional): Records each file's summary. The
+            files that did not change since the previous run it resumes are
+            not read or summarized again. Defaults to None.
 
     Returns:
-        dict: A dictionary of the directory's files and their summaries.
+        dict: A dictionary of the directory's files and their summaries, or
+            of their formatted summaries.
     """
 
     if ignore_patterns is None:
@@ -230,82 +886,131 @@ def summarize_directory(dir_path, ignore_patterns=None, print_full_patterns=None
     if print_full_patterns is None:
         print_full_patterns = []
 
-    summary = {}
-
-    total_file_count = 0
-    for root, dirs, files in os.walk(dir_path):
-
-        # Skip the root if it matches any of the ignore patterns
-        if check_ignore_patterns(root, ignore_patterns):
-            continue
-
-        # If any directories are ignored, print them and remove them from the list
-        dirs = remove_matching_patterns_from_list(dirs, ignore_patterns)
-        total_file_count += len(files)
-        files = remove_matching_patterns_from_list(files, ignore_patterns)
-
-        for file in files:
-
-            file_path = os.path.join(root, file)
-            if check_ignore_patterns(file_path, ignore_patterns):
-                print(f"Skipping {file_path} because it matches an ignore pattern")
+    deduplicator = SingleFlight(keep_results=True)
+    # Without an API key every file's "summary" is its own prompt, so there is nothing to batch
+    batcher = SummaryBatcher(batch_tokens) if batch_tokens and get_api_key() is not None else None
+
+    if file_index is None:
+        file_index = FileIndex.scan(dir_path, ignore_patterns)
+
+    def is_print_full(record):
+        # print_full_patterns is a list of strings. ex: ['init']
+        # If any of the patterns are found in the file name string,
+        # then print the full file instead of summarizing
+        return any(
+                [fnmatch.fnmatch(record.name, f"*{pattern}*")
+                    for pattern in print_full_patterns]
+                ) or any(
+                [fnmatch.fnmatch(record.path, f"*{pattern}*")
+                    for pattern in print_full_patterns]
+                )
+
+    skipped_files = []
+    records = file_index.files()
+    # The entries of the files unchanged since the previous run
+    reused = {}
+    if manifest is not None and manifest.previous:
+        for record in records:
+            # With --max-total-bytes, whether a --print-full file is cut or
+            # summarized depends on the files before it, so it is read again
+            # and charged to the budget in order, as in a full run
+            if max_total_bytes and is_print_full(record):
                 continue
-
-            # print_full_patterns is a list of strings. ex: ['init']
-            # If any of the patterns are found in the file name string,
-            # then print the full file instead of summarizing
-            if any(
-                    [fnmatch.fnmatch(file, f"*{pattern}*")
-                        for pattern in print_full_patterns]
-                    ) or any(
-                    [fnmatch.fnmatch(file_path, f"*{pattern}*")
-                        for pattern in print_full_patterns]
-                    ):
-                print(f"--print-full {file_path}")
-                with open(file_path, 'r') as f:
-                    file_content = f.read()
-                summary[file_path] = file_content
-            else:
-                if file_path.endswith('.py'):
-                    functions = generate_summary_from_python_file(file_path)
-                    if functions:
-                        summary[file_path] = functions
-                    else:
-                        with open(file_path, 'r') as f:
-                            code = f.read()
-                        code = trim_string_to_token_limit(code, 2000)
-                        prompt = f"Summarize the following:\n````\n{code}\n````"
-                        summary[file_path] = call_openai_api(prompt, 200)
-                elif os.stat(file_path).st_size < 100:
-                    summary[file_path] = []
-                elif file_path.endswith('.md'):
-                    with open(file_path, 'r') as f:
-                        code = f.read()
-                    # If the code is too long, trim it to the token limit
-                    code = trim_string_to_token_limit(code, 2000)
-                    prompt = f"Summarize the following:\n````\n{code}\n````"
-                    summary[file_path] = call_openai_api(prompt, 200)
-                elif file_path.endswith('.sh'):
-                    with open(file_path, 'r') as f:
-                        code = f.read()
-                    # If the code is too long, trim it to the token limit
-                    code = trim_string_to_token_limit(code, 2000)
-                    prompt = f"Summarize the following:\n````\n{code}\n````"
-                    summary[file_path] = call_openai_api(prompt, 200)
-                elif file_path.endswith('.txt'):
-                    summary[file_path] = []
-                else:
-                    try:
-                        with open(file_path, 'r') as f:
-                            code = f.read()
-                        code = trim_string_to_token_limit(code, 2000)
-                        prompt = f"Summarize the following:\n````\n{code}\n````"
-                        summary[file_path] = call_openai_api(prompt, 200)
-
-                    except UnicodeDecodeError:
-                        summary[file_path] = []
-
-    print(f"Fetched summaries for {len(summary)} out of {total_file_count} files.")
+            entry = manifest.reuse(record, cache)
+            if entry is not None:
+                reused[record.path] = entry
+                if entry.summary is None:
+                    skipped_files.append(record)
+        records = [record for record in records if record.path not in reused]
+        print(f"Reused {len(reused)} unchanged files from the last run, summarizing {len(records)} files.")
+
+    python_summaries = {}
+    if workers > 1:
+        # Parse the Python files that are not cached in other processes first
+        python_paths = [
+            record.path for record in records
+            if record.path.endswith('.py') and record.blob is None and not is_print_full(record)
+            and (cache is None or get_cache(file_summary_key(record.path, cache, record, record.size,
+                                                             record.mtime_ns), cache) is None)
+        ]
+        python_summaries = extract_python_summaries(python_paths, workers)
+        print(f"Parsed {len(python_summaries)} Python files in {workers} processes.")
+
+    budget = ByteBudget(max_file_bytes, max_total_bytes)
+    # The content digests computed for the summary cache, kept for the manifest
+    digests = {}
+
+    def classify(record):
+        encoding = sniff_file(record.path, record)
+        if encoding is None:
+            skipped_files.append(record)
+            return None
+        return record, encoding, is_print_full(record)
+
+    def read(item):
+        # Only the --print-full files are read here. The others are read when
+        # they are summarized, and not at all when their summary is cached.
+        record, encoding, print_full = item
+        if not print_full or budget.exhausted:
+            return record, encoding, None
+        print(f"--print-full {record.path}")
+        content = read_code(record.path, record, encoding, budget.file_limit())
+        budget.spend(record.size)
+        if budget.exhausted:
+            print("Reached --max-total-bytes, summarizing the other --print-full files instead.")
+        return record, encoding, content
+
+    def summarize(item):
+        record, encoding, content = item
+        if content is None:
+            content = summarize_file(
+                record.path, cache, batcher, deduplicator, record, python_summaries.get(record.path), digests,
+                encoding
+            )
+        return record.path, content
+
+    def format_item(item):
+        file_path, content = item
+        # Batched summaries are formatted once their batch is sent
+        return item if isinstance(content, Future) else (file_path, formatter(file_path, content))
+
+    stages = [Stage('classify', classify), Stage('read', read), Stage('summarize', summarize, jobs)]
+    if formatter is not None:
+        stages.append(Stage('format', format_item))
+    pipeline = Pipeline(stages)
+    summary = dict(pipeline.run(records))
+
+    if batcher is not None:
+        batcher.flush()
+        for file_path, file_summary in summary.items():
+            if isinstance(file_summary, Future):
+                file_summary = file_summary.result()
+                summary[file_path] = file_summary if formatter is None else formatter(file_path, file_summary)
+        print(f"Summarized {batcher.batched_files} small files in {batcher.requests} batched requests.")
+
+    if manifest is not None:
+        for record in records:
+            if record.path in summary:
+                manifest.add(record, summary[record.path], digests.get(record.path))
+        for record in skipped_files:
+            if record.path not in reused:
+                manifest.add(record, None)
+    if reused:
+        # Stitch the reused summaries back in, in the order of the index
+        fresh = summary
+        summary = {}
+        for record in file_index.files():
+            if record.path in fresh:
+                summary[record.path] = fresh[record.path]
+            elif record.path in reused and reused[record.path].summary is not None:
+                summary[record.path] = reused[record.path].summary
+
+    print(pipeline.report())
+    if deduplicator.saved:
+        print(f"Reused summaries for {deduplicator.saved} files with duplicate content.")
+    report_skipped_files(skipped_files)
+    num_files = len(summary) + len(skipped_files) + file_index.ignored_file_count
+    print(f"Fetched summaries for {len(summary)} out of {num_files} files.")
     return summary
 
 
@@ -313,6 +1018,10 @@ def summarize_blocks(summary_blocks, max_tokens_out=4096, print_full_patterns=No
     """
     Summarize a list of blocks.
 
+    Budgets are planned with approximate_tokens(), only the final summary is
+    tokenized exactly. A block is considered to fit when its approximate count
+    times APPROXIMATE_TOKENS_MARGIN does.
+
     Args:
         summary_blocks (list): A list of blocks to summarize.
             summary_blocks = {
@@ -335,7 +1044,7 @@ def summarize_blocks(summary_blocks, max_tokens_out=4096, print_full_patterns=No
                          if summary_blocks["traceback_context"] is not None
                          else "")
 
-    remaining_tokens = max_tokens_out - estimate_tokens(traceback + traceback_context)
+    remaining_tokens = max_tokens_out - planned_tokens(traceback + traceback_context)
 
     if remaining_tokens <= 0:
         reduced_summary_blocks = {
@@ -344,7 +1053,7 @@ def summarize_blocks(summary_blocks, max_tokens_out=4096, print_full_patterns=No
             "traceback": summary_blocks['traceback'],
             "traceback_context": trim_string_to_token_limit(
                 summary_blocks['traceback_context'],
-                (max_tokens_out - estimate_tokens(summary_blocks['traceback']))
+                (max_tokens_out - planned_tokens(traceback))
             ),
         }
         return reduced_summary_blocks
@@ -352,7 +1061,7 @@ def summarize_blocks(summary_blocks, max_tokens_out=4096, print_full_patterns=No
     file_hierarchy = summary_blocks["file_hierarchy"]
     file_summaries = summary_blocks["file_summaries"]
 
-    total_file_tokens = estimate_tokens(file_hierarchy) + estimate_tokens("".join(file_summaries))
+    total_file_tokens = planned_tokens(file_hierarchy) + planned_tokens(list(file_summaries.values()))
     if total_file_tokens <= remaining_tokens:
         reduced_summary_blocks = {
             "file_hierarchy": file_hierarchy,
@@ -363,13 +1072,13 @@ def summarize_blocks(summary_blocks, max_tokens_out=4096, print_full_patterns=No
         return reduced_summary_blocks
 
     reduced_file_summary = summarize_file_summaries(
-        file_summaries,
-        (remaining_tokens - estimate_tokens(file_hierarchy)),
+        list(file_summaries.values()),
+        (remaining_tokens - planned_tokens(file_hierarchy)),
         print_full_patterns
         )
 
     token_estimate = (
-        estimate_tokens(file_hierarchy) + estimate_tokens(reduced_file_summary)
+        planned_tokens(file_hierarchy) + planned_tokens(reduced_file_summary)
     )
     if (token_estimate <= remaining_tokens):
         reduced_summary_blocks = {
@@ -380,7 +1089,7 @@ def summarize_blocks(summary_blocks, max_tokens_out=4096, print_full_patterns=No
         }
         return reduced_summary_blocks
 
-    token_estimate = estimate_tokens(reduced_file_summary)
+    token_estimate = planned_tokens(reduced_file_summary)
     reduced_file_hierarchy = summarize_file_hierarchy(
         file_hierarchy,
         (remaining_tokens - token_estimate)
@@ -392,13 +1101,27 @@ def summarize_blocks(summary_blocks, max_tokens_out=4096, print_full_patterns=No
         "traceback_context": summary_blocks['traceback_context'],
     }
 
-    if estimate_tokens(reduced_summary_blocks) > max_tokens_out:
+    if approximate_tokens([block for block in reduced_summary_blocks.values() if block]) > max_tokens_out:
         raise ValueError("The total length of the summary blocks is greater"
                          "than the max_tokens_out")
 
     return reduced_summary_blocks
 
 
+def planned_tokens(string):
+    """
+    Upper bound of the number of tokens in a string for budget decisions.
+
+    Args:
+        string (str | list): The string or list of strings to count.
+
+    Returns:
+        int: The approximate number of tokens plus the estimator's error margin.
+    """
+
+    return math.ceil(approximate_tokens(string) * APPROXIMATE_TOKENS_MARGIN)
+
+
 def format_summaries(summary, print_full_patterns=None):
     """
     Format a summary dictionary into a string.
@@ -411,23 +1134,32 @@ def format_summaries(summary, print_full_patterns=None):
             formatted summaries.
     """
 
-    formatted_summaries = {}
-    for file_path, content in summary.items():
-        file_info = f"File: {file_path}"
-        if isinstance(content, list):
-            functions_str = ' '.join([f"{str(func)}" for func in content])
-            if len(functions_str) == 0:
-                formatted_summaries[file_path] = f"{file_info}\n"
-            else:
-                formatted_summaries[file_path] = f"{file_info}\n```\n{functions_str}\n```\n"
-        else:
-            # Assuming it's the full file content
-            if "\n" in content:
-                formatted_summaries[file_path] = f"{file_info}\n```\n{content}\n```\n"
-            else:
-                formatted_summaries[file_path] = f"{file_info}\n{content}\n"
+    return {file_path: format_summary(file_path, content) for file_path, content in summary.items()}
 
-    return formatted_summaries
+
+def format_summary(file_path, content):
+    """
+    Format a file's summary.
+
+    Args:
+        file_path (str): The path to the file.
+        content (list or str): The file's functions and classes, or its summary
+            or content.
+
+    Returns:
+        str: The formatted summary.
+    """
+
+    file_info = f"File: {file_path}"
+    if isinstance(content, list):
+        functions_str = ' '.join([f"{str(func)}" for func in content])
+        if len(functions_str) == 0:
+            return f"{file_info}\n"
+        return f"{file_info}\n```\n{functions_str}\n```\n"
+    # Assuming it's the full file content
+    if "\n" in content:
+        return f"{file_info}\n```\n{content}\n```\n"
+    return f"{file_info}\n{content}\n"
 
 
 def split_file_summaries(file_summaries, max_chunk_tokens=2000):
@@ -435,7 +1167,7 @@ def split_file_summaries(file_summaries, max_chunk_tokens=2000):
     Split a file summary into chunks of a certain number of tokens.
 
     Args:
-        file_summaries (str): The file summary to split.
+        file_summaries (list): The file summaries to split.
         max_chunk_tokens (int, optional): The maximum number of tokens per chunk.
             Defaults to 2000.
 
@@ -446,9 +1178,12 @@ def split_file_summaries(file_summaries, max_chunk_tokens=2000):
     current_chunk = ""
     current_chunk_tokens = 0
 
+    if isinstance(file_summaries, str):
+        file_summaries = [file_summaries]
+
     for file_summary in file_summaries:
         for line in file_summary.split("\n"):
-            line_tokens = estimate_tokens(line)
+            line_tokens = approximate_tokens(line)
 
             if current_chunk_tokens + line_tokens > max_chunk_tokens:
                 summary_chunks.append(current_chunk.strip())
@@ -469,7 +1204,7 @@ def summarize_file_summaries(file_summaries, max_tokens_out=4000, print_full_pat
     Summarize a file summary.
 
     Args:
-        file_summaries (str): The file summary to summarize.
+        file_summaries (list): The file summaries to summarize.
         max_tokens_out (int, optional): The maximum number of tokens to output.
             Defaults to 4000.
         print_full_patterns (list, optional): A list of patterns to print the full code
@@ -478,8 +1213,8 @@ def summarize_file_summaries(file_summaries, max_tokens_out=4000, print_full_pat
         str: The summarized file summary.
     """
 
-    if OPENAI_API_KEY is None:
-        return file_summaries
+    if get_api_key() is None:
+        return file_summaries if isinstance(file_summaries, str) else "\n".join(file_summaries)
 
     summary_chunks = split_file_summaries(file_summaries)
     summarized_chunks = []
@@ -499,10 +1234,9 @@ Summary:
     combined_summary = "\n".join(summarized_chunks)
 
     # Check if combined summary fits within the token limit
-    while estimate_tokens(combined_summary) > max_tokens_out:
+    while approximate_tokens(combined_summary) > max_tokens_out:
         max_tokens_out -= 50
-        summarized_chunks = summarize_file_summaries(combined_summary, max_tokens_out, print_full_patterns)
-        combined_summary = "\n".join(summarized_chunks)
+        combined_summary = summarize_file_summaries(combined_summary, max_tokens_out, print_full_patterns)
 
     return combined_summary
 
@@ -520,7 +1254,7 @@ def summarize_file_hierarchy(file_hierarchy, max_tokens=4096):
         str: The summarized file hierarchy.
     """
 
-    if OPENAI_API_KEY is None:
+    if get_api_key() is None:
         return file_hierarchy
 
     prompt = f"""Please provide a concise file hierarchy.
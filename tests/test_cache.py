@@ -0,0 +1,130 @@
+# tests/test_cache.py
+import multiprocessing
+import os
+import pickle
+from src.cache import (
+    ResponseCache,
+    get_cache,
+    set_cache,
+    hash_key,
+)
+
+
+def test_set_and_get_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.db'))
+    prompt_object = ('gpt-3.5-turbo', 'Summarize this', 200, 1, None, 0.5)
+
+    assert get_cache(prompt_object, cache) is None
+    set_cache(prompt_object, 'A summary', cache)
+    assert get_cache(prompt_object, cache) == 'A summary'
+    assert len(cache) == 1
+
+
+def test_cache_persists_between_instances(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    prompt_object = ('gpt-3.5-turbo', 'Summarize this', 200, 1, None, 0.5)
+
+    cache = ResponseCache(path)
+    set_cache(prompt_object, {'text': 'A summary'}, cache)
+    cache.close()
+
+    assert get_cache(prompt_object, ResponseCache(path)) == {'text': 'A summary'}
+
+
+def test_cache_imports_legacy_pickle(tmp_path):
+    legacy_path = tmp_path / 'cache.pkl'
+    with open(legacy_path, 'wb') as f:
+        pickle.dump({hash_key('old prompt'): 'old response'}, f)
+
+    cache = ResponseCache(str(tmp_path / 'cache.db'))
+    assert get_cache('old prompt', cache) == 'old response'
+    assert not os.path.exists(legacy_path)
+
+
+def test_get_cache_from_dict():
+    cache = {}
+    set_cache('prompt', 'response', cache)
+    assert get_cache('prompt', cache) == 'response'
+
+
+def test_prune_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.db'), max_bytes=0, max_entries=2, ttl=0)
+    set_cache('first', 'response 1', cache)
+    set_cache('second', 'response 2', cache)
+    set_cache('third', 'response 3', cache)
+    # Reading the first entry makes the second one the least recently used
+    assert get_cache('first', cache) == 'response 1'
+
+    assert cache.prune() == 1
+    assert get_cache('first', cache) == 'response 1'
+    assert get_cache('second', cache) is None
+    assert get_cache('third', cache) == 'response 3'
+
+
+def test_prune_drops_expired_entries(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.db'), max_bytes=0, max_entries=0, ttl=0)
+    set_cache('prompt', 'response', cache)
+
+    assert cache.prune(ttl=60) == 0
+    cache.ttl = -1
+    assert get_cache('prompt', cache) is None
+    assert cache.prune() == 1
+    assert len(cache) == 0
+
+
+def test_cache_stats(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = ResponseCache(path)
+    set_cache('prompt', {'text': 'response', 'usage': None}, cache)
+    get_cache('prompt', cache)
+    get_cache('other prompt', cache)
+    cache.close()
+
+    stats = ResponseCache(path).stats()
+    assert stats['entries'] == 1
+    assert stats['entry_bytes'] > 0
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
+
+
+def test_clear_cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.db'))
+    set_cache('prompt', 'response', cache)
+    cache.clear()
+    assert len(cache) == 0
+
+
+def hammer_cache(path, worker, iterations):
+    cache = ResponseCache(path)
+    for i in range(iterations):
+        set_cache(('worker', worker, i), f'response {worker} {i}', cache)
+        set_cache('shared prompt', f'response {worker} {i}', cache)
+        assert get_cache(('worker', worker, i), cache) == f'response {worker} {i}'
+        assert get_cache('shared prompt', cache).startswith('response ')
+    cache.close()
+
+
+def test_cache_concurrent_processes(tmp_path):
+    # Several processes writing to and reading from the same cache at once
+    path = str(tmp_path / 'cache.db')
+    workers = 8
+    iterations = 50
+
+    processes = [
+        multiprocessing.Process(target=hammer_cache, args=(path, worker, iterations))
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+        assert process.exitcode == 0
+
+    cache = ResponseCache(path)
+    assert len(cache) == workers * iterations + 1
+    for worker in range(workers):
+        for i in range(iterations):
+            assert get_cache(('worker', worker, i), cache) == f'response {worker} {i}'
+    stats = cache.stats()
+    assert stats['hits'] == workers * iterations * 2 + workers * iterations
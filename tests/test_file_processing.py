@@ -1,9 +1,18 @@
 # tests/test_file_processing.py
+import os
+
+from git import Repo
+
 from src.file_processing import (
     get_file_hierarchy,
     format_file_hierarchy,
     get_ignore_patterns,
     check_ignore_patterns,
+    get_all_code,
+    open_file,
+    read_code,
+    walk_tree,
+    FileIndex,
 )
 
 
@@ -29,16 +38,19 @@ def test_get_ignore_patterns():
     expected = [
         '__pycache__',
         '.DS_Store',
-        'egg-info',
+        '*.egg-info',
         '.env',
+        '.env.*',
         '.git',
+        '.gitignore',
         '.ipynb_checkpoints',
-        '.pkl',
-        '.pyc',
+        '*.pkl',
+        '*.pyc',
         '.pytest_cache',
+        '.venv',
         '.vscode',
         'dist',
-        'LICENSE',
+        'LICENSE*',
         'venv',
     ]
     actual = get_ignore_patterns(path)
@@ -52,3 +64,163 @@ def test_check_ignore_patterns():
 
     path = 'tests/test_files/test_file.py'
     assert not check_ignore_patterns(path, ignore_patterns)
+
+    assert check_ignore_patterns('dist/app.py', ['dist'])
+    assert not check_ignore_patterns('distance.py', ['dist'])
+
+
+def test_walk_tree_prunes_ignored_directories(tmp_path):
+    for path in ['b.py', 'a/z.py', 'a/b/c.py', 'venv/lib/site.py', 'a/venv/x.py', 'a/skip.pyc']:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text('pass\n')
+
+    ignored = []
+    entries = walk_tree(str(tmp_path), ['venv', '*.pyc'], ignored.append)
+
+    assert [(relative_path, depth) for _, relative_path, depth in entries] == [
+        ('a', 1), ('a/b', 2), ('a/b/c.py', 3), ('a/z.py', 2), ('b.py', 1)
+    ]
+    # Ignored directories are reported once and never entered
+    assert sorted(entry.name for entry in ignored) == ['skip.pyc', 'venv', 'venv']
+
+
+def test_file_index_is_shared_by_hierarchy_and_code(tmp_path):
+    for path in ['b.py', 'a/z.py', 'a/skip.pyc']:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text('pass\n')
+    ignore_patterns = ['*.pyc']
+
+    file_index = FileIndex.scan(str(tmp_path), ignore_patterns)
+    assert [record.relative_path for record in file_index.files()] == ['a/z.py', 'b.py']
+    assert file_index.files()[0].size == 5
+    assert file_index.ignored_file_count == 1
+
+    hierarchy = get_file_hierarchy(str(tmp_path), ignore_patterns=ignore_patterns, file_index=file_index)
+    assert hierarchy[1:] == ['    a/', '        z.py', '    b.py']
+    assert list(get_all_code(str(tmp_path), ignore_patterns, file_index)) == [
+        str(tmp_path / 'a' / 'z.py'), str(tmp_path / 'b.py')
+    ]
+
+
+def test_walk_tree_reads_nested_gitignore_files(tmp_path):
+    (tmp_path / '.gitignore').write_text('*.log\nbuild/\n')
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / '.gitignore').write_text('!keep.log\n/local.txt\n')
+    for path in ['a.log', 'build/out.py', 'sub/keep.log', 'sub/drop.log', 'sub/local.txt', 'sub/deep/local.txt']:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text('pass\n')
+
+    entries = walk_tree(str(tmp_path), ['.gitignore'])
+
+    assert [relative_path for _, relative_path, _ in entries] == [
+        'sub', 'sub/deep', 'sub/deep/local.txt', 'sub/keep.log'
+    ]
+
+
+def test_file_index_from_git_index(tmp_path):
+    repo = Repo.init(tmp_path)
+    for path in ['b.py', 'a/z.py', 'a/dist/out.py', 'docs/index.md', 'deleted.py']:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text('pass\n')
+    repo.index.add(['b.py', 'a/z.py', 'a/dist/out.py', 'docs/index.md', 'deleted.py'])
+    (tmp_path / 'untracked.py').write_text('pass\n')
+    (tmp_path / 'b.py').write_text('changed in the worktree\n')
+    os.remove(tmp_path / 'deleted.py')
+
+    file_index = FileIndex.from_git_index(str(tmp_path / ''), ['dist'])
+
+    assert [(record.relative_path, record.kind) for record in file_index.records[1:]] == [
+        ('a', 'directory'), ('a/z.py', 'file'), ('b.py', 'file'), ('docs', 'directory'), ('docs/index.md', 'file')
+    ]
+    assert file_index.files()[1].size == len('changed in the worktree\n')
+    assert file_index.ignored_file_count == 1
+
+    # The index of a subdirectory only lists the files below it
+    file_index = FileIndex.from_git_index(str(tmp_path / 'docs'), [])
+    assert [record.relative_path for record in file_index.files()] == ['index.md']
+
+
+def test_file_index_from_git_tree(tmp_path):
+    repo = Repo.init(tmp_path)
+    repo.config_writer().set_value('user', 'name', 'test').set_value('user', 'email', 'test@example.com').release()
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'src' / 'old.py').write_text('def old():\n    pass\n')
+    (tmp_path / 'README.md').write_text('first\n')
+    repo.index.add(['src/old.py', 'README.md'])
+    first = repo.index.commit('first')
+    os.remove(tmp_path / 'src' / 'old.py')
+    (tmp_path / 'src' / 'new.py').write_text('pass\n')
+    (tmp_path / 'README.md').write_text('second\n')
+    repo.index.remove(['src/old.py'])
+    repo.index.add(['src/new.py', 'README.md'])
+    repo.index.commit('second')
+
+    file_index = FileIndex.from_git_tree(str(tmp_path), first.hexsha, [])
+
+    assert [record.relative_path for record in file_index.files()] == ['README.md', 'src/old.py']
+    old = file_index.files()[1]
+    assert not os.path.exists(old.path)
+    with open_file(old.path, old) as f:
+        assert f.read() == 'def old():\n    pass\n'
+    assert get_all_code(str(tmp_path), [], file_index) == {
+        os.path.join(str(tmp_path), 'README.md'): ['first\n'],
+        old.path: ['def old():\n    pass\n'],
+    }
+
+    file_index = FileIndex.from_git_tree(str(tmp_path / 'src'), 'HEAD', [])
+    assert [record.relative_path for record in file_index.files()] == ['new.py']
+
+
+def test_get_all_code_previews_data_files(tmp_path):
+    (tmp_path / 'short.csv').write_text('a,b\n1,2\n')
+    (tmp_path / 'long.csv').write_text(''.join(f"{i}\n" for i in range(100)))
+
+    actual = get_all_code(str(tmp_path), [])
+
+    assert actual[str(tmp_path / 'short.csv')] == ['a,b\n1,2\n']
+    assert actual[str(tmp_path / 'long.csv')] == ['0\n1\n2\n...\n97\n98\n99\n']
+
+
+def test_get_all_code_skips_binary_files(tmp_path, capsys):
+    (tmp_path / 'main.py').write_text('pass\n')
+    (tmp_path / 'weights.pt').write_bytes(b'\x80\x02' * 1024)
+    (tmp_path / 'data').write_bytes(b'\x89PNG\r\n\x1a\n' + b'\x00' * 100)
+    (tmp_path / 'notes').write_bytes('café\n'.encode('latin-1'))
+
+    actual = get_all_code(str(tmp_path), [])
+
+    assert actual == {str(tmp_path / 'main.py'): ['pass\n'], str(tmp_path / 'notes'): ['café\n']}
+    output = capsys.readouterr().out
+    assert 'Skipped 2 binary files (2.1 KiB)' in output
+    assert f"{tmp_path / 'weights.pt'} (2.0 KiB)" in output
+
+
+def test_read_code_truncates(tmp_path, monkeypatch):
+    file_path = tmp_path / 'big.txt'
+    file_path.write_bytes('é'.encode('utf-8') * 3000 + b'\r\nend\r\n')
+
+    assert read_code(str(file_path)) == 'é' * 3000 + '\nend\n'
+    # A cut character is left out
+    assert read_code(str(file_path), max_bytes=5) == 'éé\n... [truncated 5.9 KiB]\n'
+
+    # Large files are memory-mapped
+    monkeypatch.setattr('src.file_processing.MMAP_MIN_BYTES', 1)
+    assert read_code(str(file_path), max_bytes=4) == 'éé\n... [truncated 5.9 KiB]\n'
+
+
+def test_get_all_code_byte_limits(tmp_path, capsys):
+    for name in ['a.py', 'b.py', 'c.py']:
+        (tmp_path / name).write_text('x' * 100)
+
+    actual = get_all_code(str(tmp_path), [], max_file_bytes=60, max_total_bytes=150)
+
+    assert actual == {
+        str(tmp_path / 'a.py'): ['x' * 60 + '\n... [truncated 40 B]\n'],
+        str(tmp_path / 'b.py'): ['x' * 60 + '\n... [truncated 40 B]\n'],
+        str(tmp_path / 'c.py'): ['x' * 30 + '\n... [truncated 70 B]\n'],
+    }
+    assert get_all_code(str(tmp_path), [], max_file_bytes=0, max_total_bytes=200) == {
+        str(tmp_path / 'a.py'): ['x' * 100],
+        str(tmp_path / 'b.py'): ['x' * 100],
+    }
+    assert 'leaving out 1 files' in capsys.readouterr().out
@@ -0,0 +1,81 @@
+# tests/test_gitignore.py
+import subprocess
+
+import pytest
+
+from src.file_processing import FileIndex
+from src.gitignore import IgnoreRules, is_ignored
+
+
+@pytest.mark.parametrize('pattern, path, is_dir, expected', [
+    ('dist', 'dist', True, True),
+    ('dist', 'src/dist', False, True),
+    ('dist', 'distance.py', False, None),
+    ('*.pyc', 'src/module.pyc', False, True),
+    ('/build', 'build', True, True),
+    ('/build', 'src/build', True, None),
+    ('docs/*.md', 'docs/index.md', False, True),
+    ('docs/*.md', 'docs/api/index.md', False, None),
+    ('docs/**/*.md', 'docs/api/v1/index.md', False, True),
+    ('**/fixtures', 'tests/unit/fixtures', True, True),
+    ('logs/', 'logs', True, True),
+    ('logs/', 'logs', False, None),
+    ('vendor/**', 'vendor/lib/a.py', False, True),
+    ('vendor/**', 'vendor', True, None),
+    ('file?.txt', 'file1.txt', False, True),
+    ('file[0-9].txt', 'filea.txt', False, None),
+    ('file[!0-9].txt', 'filea.txt', False, True),
+    ('\\#notes', '#notes', False, True),
+    ('# comment', '# comment', False, None),
+    ('*', 'a.txt', False, True),
+    ('*', 'src/a.txt', False, True),
+    ('*/', 'build', True, True),
+    ('*/', 'a.txt', False, None),
+    ('build/*', 'build', True, None),
+    ('build/*', 'build/out', True, True),
+    ('build/*/', 'build', True, None),
+    ('a/*/c', 'a/b/c', False, True),
+])
+def test_ignore_rules_match(pattern, path, is_dir, expected):
+    assert IgnoreRules([pattern]).match(path, is_dir) is expected
+
+
+def test_later_patterns_take_precedence():
+    rules = IgnoreRules(['*.log', '!keep.log', 'keep.log.*', 'old/keep.log'])
+
+    assert rules.match('app.log') is True
+    assert rules.match('keep.log') is False
+    assert rules.match('keep.log.1') is True
+    assert rules.match('old/keep.log') is True
+
+
+def test_ignore_everything_but_python_files():
+    rules = IgnoreRules(['*', '!*.py'])
+
+    assert rules.match('a.txt') is True
+    assert rules.match('a.py') is False
+
+
+def test_is_ignored_checks_parent_directories():
+    rules = [('', IgnoreRules(['build/', '!build/keep.py'])), ('sub/', IgnoreRules(['*.tmp']))]
+
+    # A file cannot be re-included if its parent directory is ignored
+    assert is_ignored('build/keep.py', rules)
+    assert is_ignored('sub/a.tmp', rules)
+    assert not is_ignored('a.tmp', rules)
+
+
+def test_directory_contents_with_an_exception_match_git(tmp_path):
+    (tmp_path / '.gitignore').write_text('build/*\n!build/keep\n')
+    for path in ['build/keep', 'build/drop', 'build/sub/drop', 'a.py']:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text('pass\n')
+    subprocess.run(['git', 'init', '-q', str(tmp_path)], check=True)
+    untracked = subprocess.run(
+        ['git', 'ls-files', '--others', '--exclude-standard'], cwd=tmp_path, capture_output=True, text=True, check=True,
+    ).stdout.split()
+
+    file_index = FileIndex.scan(str(tmp_path), ['.git/'])
+
+    assert sorted(untracked) == ['.gitignore', 'a.py', 'build/keep']
+    assert sorted(record.relative_path for record in file_index.files()) == sorted(untracked)
@@ -0,0 +1,168 @@
+# tests/test_manifest.py
+import os
+import sys
+
+import pytest
+from git import Actor, Repo
+
+import src.manifest
+import src.summary
+from src.manifest import RunManifest
+from src.summary import format_summary, generate_summary_from_python_file, run_summary, summarize_directory
+from src.utils import parse_arguments
+
+AUTHOR = Actor('Test', 'test@example.com')
+SETTINGS = {'mode': 'offline', 'print_full': []}
+IGNORE_PATTERNS = ['.git/']
+
+
+@pytest.fixture(autouse=True)
+def manifests_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(src.manifest, 'manifests_dir', str(tmp_path / 'manifests'))
+
+
+@pytest.fixture
+def project(tmp_path):
+    path = tmp_path / 'project'
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    calls = []
+
+    def counting_generate_summary(file_path, file_record=None):
+        calls.append(os.path.basename(file_path))
+        return generate_summary_from_python_file(file_path, file_record)
+
+    monkeypatch.setattr(src.summary, 'generate_summary_from_python_file', counting_generate_summary)
+    return calls
+
+
+def write_files(directory, files):
+    for name, content in files.items():
+        (directory / name).write_text(content)
+
+
+def summarize(directory, rev=None, **options):
+    manifest = RunManifest(str(directory), SETTINGS)
+    previous = RunManifest.load(str(directory), SETTINGS)
+    if previous is not None:
+        manifest.resume(previous, rev)
+    file_index = manifest.file_index(IGNORE_PATTERNS)
+    summary = summarize_directory(str(directory), IGNORE_PATTERNS, file_index=file_index,
+                                  formatter=format_summary, manifest=manifest, **options)
+    manifest.save(track_git=True)
+    return manifest, summary
+
+
+def test_unchanged_files_are_reused(project, parsed):
+    write_files(project, {'a.py': 'def a():\n    pass\n', 'b.py': 'def b():\n    pass\n'})
+    manifest, first = summarize(project)
+    assert sorted(parsed) == ['a.py', 'b.py']
+    assert manifest.files['a.py'].summary == first[str(project / 'a.py')]
+
+    parsed.clear()
+    write_files(project, {'b.py': 'def b(x):\n    pass\n', 'c.py': 'def c():\n    pass\n'})
+    os.remove(project / 'a.py')
+    manifest, second = summarize(project)
+
+    assert sorted(parsed) == ['b.py', 'c.py']
+    assert list(second) == [str(project / 'b.py'), str(project / 'c.py')]
+    assert 'b(x)' in second[str(project / 'b.py')]
+    assert sorted(manifest.files) == ['b.py', 'c.py']
+
+
+def test_touched_files_are_compared_by_digest(project, parsed):
+    write_files(project, {'a.py': 'def a():\n    pass\n'})
+    summarize(project)
+    parsed.clear()
+
+    os.utime(project / 'a.py', ns=(0, 0))
+    summarize(project)
+
+    assert parsed == []
+
+
+def test_git_lists_the_changed_files(project, parsed):
+    repo = Repo.init(project)
+    write_files(project, {'a.py': 'def a():\n    pass\n', 'b.py': 'def b():\n    pass\n'})
+    repo.index.add(['a.py', 'b.py'])
+    repo.index.commit('Add a and b', author=AUTHOR, committer=AUTHOR)
+    manifest, _ = summarize(project)
+    assert manifest.commit == repo.head.commit.hexsha
+    parsed.clear()
+
+    write_files(project, {'a.py': 'def a(x):\n    pass\n', 'new.py': 'def new():\n    pass\n'})
+    manifest, summary = summarize(project)
+
+    assert manifest.changed == {'a.py', 'new.py'}
+    assert sorted(parsed) == ['a.py', 'new.py']
+    assert list(summary) == [str(project / name) for name in ('a.py', 'b.py', 'new.py')]
+    # The untracked file is checked again on the next run, and reused if it did not change
+    parsed.clear()
+    summarize(project)
+    assert parsed == []
+
+
+def test_manifest_with_other_settings_is_not_loaded(project):
+    write_files(project, {'a.py': 'def a():\n    pass\n'})
+    summarize(project)
+
+    assert RunManifest.load(str(project), SETTINGS) is not None
+    assert RunManifest.load(str(project), dict(SETTINGS, mode='openai')) is None
+
+
+def test_temporary_clone_is_summarized_without_a_manifest(tmp_path, monkeypatch):
+    work = Repo.init(tmp_path / 'work')
+    write_files(tmp_path / 'work', {'a.py': 'def a():\n    pass\n'})
+    work.index.add(['a.py'])
+    work.index.commit('Add a', author=AUTHOR, committer=AUTHOR)
+    work.clone(tmp_path / 'remote.git', bare=True)
+    monkeypatch.setattr(sys, 'argv', ['main.py', f"file://{tmp_path / 'remote.git'}", '--no-clone-cache'])
+
+    summary, _ = run_summary(parse_arguments())
+
+    assert 'a()' in summary
+    assert not os.path.exists(src.manifest.manifests_dir)
+
+
+def test_summary_digests_are_recorded_without_reading_again(project, monkeypatch):
+    write_files(project, {'a.py': 'def a():\n    pass\n'})
+    digest = src.manifest.file_digest(str(project / 'a.py'))
+
+    def fail(file_path):
+        raise AssertionError(f"{file_path} was read again")
+
+    monkeypatch.setattr(src.manifest, 'file_digest', fail)
+    manifest = RunManifest(str(project), SETTINGS)
+    summarize_directory(str(project), IGNORE_PATTERNS, formatter=format_summary, manifest=manifest)
+
+    assert manifest.files['a.py'].digest == digest
+    assert manifest.files['a.py'].tokens > 0
+
+
+def test_print_full_files_are_charged_to_the_total_budget(project):
+    options = {'print_full_patterns': ['full'], 'max_file_bytes': 0, 'max_total_bytes': 40}
+    write_files(project, {'a_full.py': 'def a():\n    return 1\n' * 2, 'b_full.py': 'def b():\n    pass\n'})
+    _, first = summarize(project, **options)
+    assert 'pass' not in first[str(project / 'b_full.py')]
+
+    # b_full.py did not change, but now fits in the budget
+    write_files(project, {'a_full.py': 'def a():\n    return 1\n'})
+    _, second = summarize(project, **options)
+    full_run = summarize_directory(str(project), IGNORE_PATTERNS, formatter=format_summary, **options)
+
+    assert 'pass' in second[str(project / 'b_full.py')]
+    assert second == full_run
+
+
+def test_runs_without_incremental_write_no_manifest(project, monkeypatch):
+    write_files(project, {'a.py': 'def a():\n    pass\n'})
+    monkeypatch.setattr(sys, 'argv', ['main.py', str(project)])
+
+    summary, _ = run_summary(parse_arguments())
+
+    assert 'a()' in summary
+    assert not os.path.exists(src.manifest.manifests_dir)
@@ -0,0 +1,221 @@
+# tests/test_openai_api.py
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from openai import OpenAI, RateLimitError
+
+import src.openai_api
+from src.openai_api import (
+    APPROXIMATE_TOKENS_MARGIN,
+    RequestScheduler,
+    SingleFlight,
+    approximate_tokens,
+    call_openai_api,
+    count_tokens_many,
+    estimate_tokens,
+    get_encoding,
+    trim_string_to_token_limit,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """
+    A local chat completions endpoint that answers the first `rate_limited`
+    requests with 429 Too Many Requests.
+    """
+
+    def __init__(self, rate_limited):
+        super().__init__(('127.0.0.1', 0), FakeOpenAIHandler)
+        self.rate_limited = rate_limited
+        self.requests = 0
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests += 1
+
+        if self.server.requests <= self.server.rate_limited:
+            body = {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}}
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+        else:
+            body = {
+                'id': 'chatcmpl-test',
+                'object': 'chat.completion',
+                'created': 0,
+                'model': 'gpt-3.5-turbo',
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': 'A summary'},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {'prompt_tokens': 10, 'completion_tokens': 2, 'total_tokens': 12},
+            }
+            self.send_response(200)
+
+        data = json.dumps(body).encode()
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    def start(rate_limited, max_retries):
+        server = FakeOpenAIServer(rate_limited)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = OpenAI(api_key='sk-test', base_url=f'http://127.0.0.1:{server.server_port}/v1', max_retries=0)
+        monkeypatch.setattr(src.openai_api, 'OPENAI_API_KEY', 'sk-test')
+        monkeypatch.setattr(src.openai_api, 'client', client)
+        monkeypatch.setattr(src.openai_api, 'cache', {})
+        # Keep the test offline, the encodings are downloaded on first use
+        monkeypatch.setattr(src.openai_api, 'estimate_tokens', lambda string, encoding_name='gpt2': len(string))
+        monkeypatch.setattr(src.openai_api, 'scheduler',
+                            RequestScheduler(max_retries=max_retries, base_delay=0.01, max_delay=0.05))
+        servers.append(server)
+        return server
+
+    servers = []
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_call_openai_api_retries_rate_limits(fake_openai):
+    server = fake_openai(rate_limited=2, max_retries=3)
+
+    assert call_openai_api('Summarize this', 200) == 'A summary'
+    assert server.requests == 3
+    assert src.openai_api.scheduler.retries == 2
+    assert src.openai_api.scheduler.throttled_seconds > 0
+
+
+def test_call_openai_api_gives_up_after_max_retries(fake_openai):
+    server = fake_openai(rate_limited=5, max_retries=1)
+
+    with pytest.raises(RateLimitError):
+        call_openai_api('Summarize this', 200)
+    assert server.requests == 2
+
+
+def test_scheduler_requests_per_minute():
+    clock = FakeClock()
+    scheduler = RequestScheduler(requests_per_minute=2, clock=clock, sleep=clock.sleep)
+
+    for _ in range(5):
+        scheduler.submit(lambda: None)
+
+    # Two requests per 60 second window: 0, 0, 60, 60, 120
+    assert clock.now == 120
+    assert scheduler.requests == 5
+    assert scheduler.throttled_seconds == 120
+
+
+def test_scheduler_tokens_per_minute():
+    clock = FakeClock()
+    scheduler = RequestScheduler(tokens_per_minute=1000, clock=clock, sleep=clock.sleep)
+
+    scheduler.submit(lambda: None, 600)
+    scheduler.submit(lambda: None, 300)
+    assert clock.now == 0
+    scheduler.submit(lambda: None, 300)
+    assert clock.now == 60
+
+
+def test_single_flight_shares_concurrent_calls():
+    single_flight = SingleFlight()
+    calls = []
+
+    def slow_call():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'result'
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: single_flight.do('key', slow_call), range(4)))
+
+    assert results == ['result'] * 4
+    assert len(calls) == 1
+    assert single_flight.saved == 3
+
+    # Once finished, the next call runs again unless results are kept
+    assert single_flight.do('key', slow_call) == 'result'
+    assert len(calls) == 2
+
+
+def test_single_flight_keeps_results():
+    single_flight = SingleFlight(keep_results=True)
+    assert single_flight.do('key', lambda: 'first') == 'first'
+    assert single_flight.do('key', lambda: 'second') == 'first'
+    assert single_flight.saved == 1
+
+
+def trim_one_piece_at_a_time(string, max_tokens):
+    # The original quadratic trimming, kept as a reference
+    if estimate_tokens(string) <= max_tokens:
+        return string
+    split_string = string.split('\n')
+    if len(split_string) == 1:
+        split_string = string.split(' ')
+    while sum(estimate_tokens(s) for s in split_string) > max_tokens:
+        split_string.pop()
+    return ' '.join(split_string)
+
+
+@pytest.mark.parametrize('max_tokens', [0, 1, 5, 20, 60, 1000])
+def test_trim_string_to_token_limit(max_tokens):
+    with open('tests/test_files/traceback.txt') as f:
+        multi_line = f.read()
+    single_line = ' '.join(['word'] * 50)
+
+    for string in (multi_line, single_line, ''):
+        assert trim_string_to_token_limit(string, max_tokens) == trim_one_piece_at_a_time(string, max_tokens)
+
+
+def test_count_tokens_many():
+    strings = ['def add(a, b):', '    return a + b', '', 'def add(a, b):', '<|endoftext|>']
+    encoding = get_encoding('gpt2')
+
+    expected = [len(encoding.encode_ordinary(string)) for string in strings]
+    assert count_tokens_many(strings) == expected
+    # The second pass is answered from the memo
+    assert count_tokens_many(strings) == expected
+    assert estimate_tokens(strings) == sum(expected)
+    assert get_encoding('gpt2') is encoding
+
+
+@pytest.mark.parametrize('path', [
+    'tests/test_files/test_file2.py',
+    'tests/test_files/traceback.txt',
+    'tests/test_files/test_file.py',
+])
+def test_approximate_tokens_within_error_bound(path):
+    with open(path) as f:
+        text = f.read()
+
+    exact = estimate_tokens(text)
+    approximate = approximate_tokens(text)
+    assert approximate * 0.8 <= exact <= approximate * APPROXIMATE_TOKENS_MARGIN
+    assert approximate_tokens([text, text]) == 2 * approximate
+    assert approximate_tokens('') == 0
@@ -0,0 +1,42 @@
+# tests/test_output.py
+import io
+
+from src.openai_api import estimate_tokens
+from src.output import SummaryWriter
+
+
+def test_summary_writer_counts_tokens():
+    stream = io.StringIO()
+    writer = SummaryWriter(stream, keep=True)
+
+    blocks = ['Context:\n', 'File: a.py\n```\nprint("a")\n```\n', '\nFile: b.py\n']
+    for block in blocks:
+        assert writer.write(block)
+
+    assert stream.getvalue() == writer.getvalue() == ''.join(blocks)
+    assert writer.tokens == sum(estimate_tokens(block) for block in blocks)
+    assert writer.characters == len(stream.getvalue())
+
+
+def test_summary_writer_stops_at_max_tokens():
+    stream = io.StringIO()
+    writer = SummaryWriter(stream, max_tokens=40)
+
+    assert writer.write('one two three\n')
+    assert not writer.write('word ' * 100)
+    assert not writer.write('four\n')
+
+    assert writer.stopped
+    assert stream.getvalue().startswith('one two three\n\n... [output stopped at 40 tokens')
+    assert writer.tokens <= 40
+
+
+def test_summary_writer_leaves_out_a_marker_over_max_tokens():
+    stream = io.StringIO()
+    writer = SummaryWriter(stream, max_tokens=3)
+
+    assert not writer.write('word ' * 100)
+
+    assert writer.stopped
+    assert stream.getvalue() == ''
+    assert writer.tokens == 0
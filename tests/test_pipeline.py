@@ -0,0 +1,94 @@
+# tests/test_pipeline.py
+import random
+import threading
+import time
+
+import pytest
+
+from src.pipeline import Pipeline, Stage
+
+
+def test_pipeline_keeps_order():
+    # Test that results come out in input order whichever worker finishes first
+    rng = random.Random(0)
+    delays = [rng.random() / 1000 for _ in range(200)]
+
+    def slow_square(i):
+        time.sleep(delays[i])
+        return i * i
+
+    pipeline = Pipeline([
+        Stage('drop odd', lambda i: i if i % 2 == 0 else None),
+        Stage('square', slow_square, workers=8),
+    ])
+
+    assert list(pipeline.run(range(200))) == [i * i for i in range(0, 200, 2)]
+    assert [stage.count for stage in [pipeline.source] + pipeline.stages + [pipeline.sink]] == [200, 200, 100, 100]
+    assert 'square x8: 100 files' in pipeline.report()
+
+
+def test_pipeline_raises_stage_errors_in_order():
+    def fail_on_three(i):
+        if i == 3:
+            raise ValueError(i)
+        return i
+
+    results = []
+    with pytest.raises(ValueError):
+        for result in Pipeline([Stage('check', fail_on_three, workers=2)]).run(range(10)):
+            results.append(result)
+    assert results == [0, 1, 2]
+
+
+def test_pipeline_applies_backpressure():
+    # Test that a slow consumer holds the source back to the queue sizes
+    read = []
+    lock = threading.Lock()
+
+    def source():
+        for i in range(1000):
+            with lock:
+                read.append(i)
+            yield i
+
+    pipeline = Pipeline([Stage('identity', lambda i: i)], queue_size=4)
+    results = pipeline.run(source())
+    next(results)
+    time.sleep(0.2)
+    # Two queues of 4, one item in each thread and one yielded
+    assert len(read) <= 12
+    results.close()
+
+
+def test_pipeline_bounds_results_waiting_for_an_earlier_item():
+    # Test that a slow first item holds the source back instead of buffering every later result
+    read = []
+    lock = threading.Lock()
+    release = threading.Event()
+
+    def source():
+        for i in range(1000):
+            with lock:
+                read.append(i)
+            yield i
+
+    def wait_for_first(i):
+        if i == 0:
+            release.wait()
+        return i
+
+    pipeline = Pipeline([Stage('wait', wait_for_first, workers=4)], queue_size=4)
+    results = pipeline.run(source())
+    read_while_waiting = []
+
+    def release_later():
+        time.sleep(0.2)
+        read_while_waiting.append(len(read))
+        release.set()
+
+    thread = threading.Thread(target=release_later)
+    thread.start()
+    assert list(results) == list(range(1000))
+    thread.join()
+    # The queue size and one item per worker, and one waiting to be fed
+    assert read_while_waiting[0] <= 4 + 4 + 1
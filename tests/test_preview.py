@@ -0,0 +1,56 @@
+# tests/test_preview.py
+import io
+
+import pytest
+
+from src.preview import (
+    is_preview_file,
+    preview,
+    read_tail,
+)
+
+
+@pytest.mark.parametrize('content, expected', [
+    (b'', ''),
+    (b'a,b\n', 'a,b\n'),
+    (b'a,b\n1,2\n', 'a,b\n1,2\n'),
+    (b'h\n1\n2\n3\n4\n5\n', 'h\n1\n2\n3\n4\n5\n'),
+    (b'h\n1\n2\n3\n4\n5\n6\n', 'h\n1\n2\n...\n4\n5\n6\n'),
+    (b'h\n1\n2\n3\n4\n5\n6', 'h\n1\n2\n...\n4\n5\n6'),
+])
+def test_preview(content, expected):
+    assert preview(io.BytesIO(content), 3, 1024) == expected
+
+
+def test_preview_reads_only_the_ends():
+    rows = b''.join(b'%d,row\n' % i for i in range(100000))
+    f = io.BytesIO(b'id,name\n' + rows)
+
+    assert preview(f, 2, 64) == 'id,name\n0,row\n...\n99998,row\n99999,row\n'
+
+
+def test_preview_cuts_long_lines():
+    content = b'x' * 1000 + b'\n' + b'y' * 1000 + b'\n'
+
+    assert preview(io.BytesIO(content), 3, 10) == 'x' * 10 + '\n...\n' + 'y' * 9 + '\n'
+
+
+@pytest.mark.parametrize('block_bytes', [1, 3, 4096])
+def test_read_tail_across_blocks(monkeypatch, block_bytes):
+    monkeypatch.setattr('src.preview.TAIL_BLOCK_BYTES', block_bytes)
+    f = io.BytesIO(b'a\nbb\nccc\ndddd\n')
+
+    assert read_tail(f, 2, 1024) == b'ccc\ndddd\n'
+
+
+@pytest.mark.parametrize('file_path, size, expected', [
+    ('data.csv', 10, True),
+    ('DATA.TSV', 10, True),
+    ('events.jsonl', 10, True),
+    ('server.log', 10, True),
+    ('package.json', 100, False),
+    ('dump.json', 10 ** 9, True),
+    ('main.py', 10 ** 9, False),
+])
+def test_is_preview_file(file_path, size, expected):
+    assert is_preview_file(file_path, size) == expected
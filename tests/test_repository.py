@@ -0,0 +1,90 @@
+# tests/test_repository.py
+import fcntl
+import os
+import shutil
+
+import pytest
+from git import Actor, Repo
+
+import src.repository
+from src.repository import clone_key, clone_repository
+
+AUTHOR = Actor('Test', 'test@example.com')
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    monkeypatch.setattr(src.repository, 'repos_dir', str(tmp_path / 'repos'))
+
+    work = Repo.init(tmp_path / 'work')
+    for i in range(3):
+        (tmp_path / 'work' / f'file{i}.py').write_text(f'print({i})\n')
+        work.index.add([f'file{i}.py'])
+        work.index.commit(f'Commit {i}', author=AUTHOR, committer=AUTHOR)
+
+    bare = work.clone(tmp_path / 'remote.git', bare=True)
+    bare.git.config('uploadpack.allowFilter', 'true')
+    work.create_remote('origin', str(tmp_path / 'remote.git'))
+    return work, f"file://{tmp_path / 'remote.git'}"
+
+
+def test_clone_is_shallow_and_cached(remote):
+    work, url = remote
+
+    path, sha, lock = clone_repository(url, depth=1, blobless=True)
+    lock.close()
+    assert path == os.path.join(src.repository.repos_dir, clone_key(url))
+    assert sha == work.head.commit.hexsha
+    assert sorted(os.listdir(path)) == ['.git', 'file0.py', 'file1.py', 'file2.py']
+    clone = Repo(path)
+    assert clone.git.rev_parse('--is-shallow-repository') == 'true'
+    assert len(list(clone.iter_commits())) == 1
+
+    # A new commit on the remote is fetched into the same clone
+    with open(os.path.join(work.working_tree_dir, 'new.py'), 'w') as f:
+        f.write('pass\n')
+    work.index.add(['new.py'])
+    work.index.commit('Add new.py', author=AUTHOR, committer=AUTHOR)
+    work.remotes.origin.push(f'HEAD:refs/heads/{work.active_branch.name}')
+
+    path_again, sha_again, lock = clone_repository(url, depth=1, blobless=True)
+    lock.close()
+    assert path_again == path
+    assert sha_again == work.head.commit.hexsha
+    assert os.path.isfile(os.path.join(path, 'new.py'))
+
+
+def test_clone_without_cache(remote):
+    _, url = remote
+
+    path, _, lock = clone_repository(url, use_cache=False)
+    assert lock is None
+    assert not path.startswith(src.repository.repos_dir)
+    assert os.path.isfile(os.path.join(path, 'file2.py'))
+    shutil.rmtree(path)
+
+
+def test_unchanged_clone_is_not_fetched(remote):
+    _, url = remote
+    path, _, lock = clone_repository(url)
+    lock.close()
+
+    _, _, lock = clone_repository(url)
+    lock.close()
+
+    assert not os.path.exists(os.path.join(path, '.git', 'FETCH_HEAD'))
+
+
+def test_clone_stays_locked_until_the_lock_is_closed(remote):
+    _, url = remote
+    path, _, lock = clone_repository(url)
+
+    with open(f"{path}.lock", 'w') as other:
+        with pytest.raises(BlockingIOError):
+            fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        lock.close()
+        fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def test_clone_key_ignores_git_suffix():
+    assert clone_key('https://github.com/ryanmac/CodeSumma') == clone_key('https://github.com/ryanmac/CodeSumma.git/')
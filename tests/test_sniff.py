@@ -0,0 +1,25 @@
+# tests/test_sniff.py
+import codecs
+
+import pytest
+
+from src.sniff import detect_encoding
+
+
+@pytest.mark.parametrize('data, expected', [
+    (b'', 'utf-8'),
+    (b'print("hello")\n', 'utf-8'),
+    ('café ☃\n'.encode('utf-8'), 'utf-8'),
+    # A character cut at the end of the sniffed bytes
+    ('café ☃'.encode('utf-8')[:-1], 'utf-8'),
+    (codecs.BOM_UTF8 + b'a,b\n', 'utf-8-sig'),
+    ('a,b\n'.encode('utf-16'), 'utf-16'),
+    ('café au lait\n'.encode('latin-1'), 'latin-1'),
+    (b'\x89PNG\r\n\x1a\n' + bytes(range(1, 200)), None),
+    (b'PK\x03\x04\x14\x00', None),
+    (b'\x7fELF\x02\x01\x01', None),
+    (b'text with a \x00 byte', None),
+    (bytes(range(128, 256)) + bytes(range(1, 32)) * 4, None),
+])
+def test_detect_encoding(data, expected):
+    assert detect_encoding(data) == expected
@@ -0,0 +1,64 @@
+# tests/test_startup.py
+import os
+import subprocess
+import sys
+
+import src.main
+
+# Importing the CLI must stay well below the cost of any one heavy dependency:
+# openai alone takes several hundred milliseconds
+IMPORT_BUDGET_MS = 250
+
+# Loaded only by the code paths that need them
+LAZY_MODULES = ['dotenv', 'git', 'openai', 'pandas', 'pyperclip', 'tiktoken']
+
+
+def run_python(code, *options, python_path=()):
+    package_dir = os.path.dirname(src.main.__file__)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([package_dir, *python_path]))
+    return subprocess.run(
+        [sys.executable, *options, '-c', code],
+        cwd=package_dir, env=env, capture_output=True, text=True, check=True,
+    )
+
+
+def import_main(*options):
+    return run_python(f"import sys, main; print([m for m in {LAZY_MODULES!r} if m in sys.modules])", *options)
+
+
+def import_time_ms(stderr, module):
+    # Lines look like 'import time:  self [us] | cumulative | name', with
+    # nested imports indented under the module that imported them
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and line.rsplit('|', 1)[-1] == f" {module}":
+            return int(line.split('|')[1]) / 1000
+    raise AssertionError(f"{module} not found in the -X importtime output")
+
+
+def test_heavy_modules_are_not_imported_at_startup():
+    result = import_main()
+
+    assert result.stdout.strip() == '[]'
+
+
+def test_import_time_budget():
+    # The best of a few runs, to ignore a slow start on a busy machine
+    times = [import_time_ms(import_main('-X', 'importtime').stderr, 'main') for _ in range(3)]
+
+    assert min(times) < IMPORT_BUDGET_MS, f"Importing main took {min(times):.0f}ms"
+
+
+def test_all_does_not_load_git(tmp_path):
+    (tmp_path / 'a.py').write_text('def a():\n    pass\n')
+    output = tmp_path / 'out.md'
+    code = (
+        "import sys, main\n"
+        f"sys.argv = ['main.py', {str(tmp_path)!r}, '--all', '--no-cache', '--output', {str(output)!r}]\n"
+        "main.main()\n"
+        "print('git' in sys.modules)"
+    )
+    # Keep the caller's path, for the packages the run needs
+    result = run_python(code, python_path=os.environ.get('PYTHONPATH', '').split(os.pathsep))
+
+    assert result.stdout.splitlines()[-1] == 'False'
+    assert 'def a():' in output.read_text()
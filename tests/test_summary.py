@@ -1,11 +1,25 @@
 # tests/test_summary.py
 import ast
+import shutil
+import sys
+
+import pytest
+
+import src.summary
+from src.cache import ResponseCache
+from src.openai_api import estimate_tokens
+from src.output import STOP_MARKER, SummaryWriter
 from src.summary import (
+    SummaryBatcher,
+    parse_batch_response,
     generate_summary_from_python_file,
     summarize_directory,
+    summarize_file,
+    extract_python_summaries,
     format_summaries,
+    run_summary,
 )
-from src.utils import FunctionInfo, get_function_info
+from src.utils import FunctionInfo, get_function_info, parse_arguments
 
 
 def test_generate_summary_from_python_file():
@@ -76,6 +90,123 @@ def test_summarize_directory():
         assert actual[key] == expected[key]
 
 
+def test_summarize_directory_with_jobs():
+    # Test that concurrent summaries come back in the same order as serial ones
+    dir_path = 'tests/test_files'
+    expected = summarize_directory(dir_path, ignore_patterns=['pycache'])
+    actual = summarize_directory(dir_path, ignore_patterns=['pycache'], jobs=4)
+    assert list(actual.items()) == list(expected.items())
+
+
+def test_summarize_directory_with_workers(tmp_path, monkeypatch):
+    # Test that Python files parsed in worker processes are summarized as in one process
+    (tmp_path / 'pkg').mkdir()
+    for i in range(10):
+        (tmp_path / 'pkg' / f'module{i}.py').write_text(f"def function{i}(a, b: int = {i}):\n    return a\n")
+    (tmp_path / 'broken.py').write_text('def broken(:\n' * 20)
+    (tmp_path / 'notes.md').write_text('Notes on the modules, long enough to be summarized on their own.\n' * 3)
+    monkeypatch.setattr(src.summary, 'call_openai_api', lambda prompt, max_tokens=4096: prompt)
+    extracted = []
+
+    def recording_extract(file_paths, workers):
+        python_summaries = extract_python_summaries(file_paths, workers)
+        extracted.append(python_summaries)
+        return python_summaries
+
+    expected = summarize_directory(str(tmp_path))
+    monkeypatch.setattr(src.summary, 'extract_python_summaries', recording_extract)
+    actual = summarize_directory(str(tmp_path), workers=2)
+
+    assert list(actual.items()) == list(expected.items())
+    # Every Python file was parsed in the pool, the broken one included
+    assert sorted(extracted[0]) == sorted(str(path) for path in tmp_path.rglob('*.py'))
+    assert extracted[0][str(tmp_path / 'broken.py')] is False
+
+
+def test_summarize_file_reuses_cached_summary(tmp_path, monkeypatch):
+    # Test that an unchanged file is not parsed again once its summary is cached
+    file_path = str(tmp_path / 'test_file2.py')
+    shutil.copy('tests/test_files/test_file2.py', file_path)
+    cache = ResponseCache(str(tmp_path / 'cache.db'))
+
+    expected = generate_summary_from_python_file(file_path)
+    assert summarize_file(file_path, cache) == expected
+
+    def fail(file_path):
+        raise AssertionError("The file should not be parsed again")
+
+    monkeypatch.setattr(src.summary, 'generate_summary_from_python_file', fail)
+    assert summarize_file(file_path, cache) == expected
+
+    with open(file_path, 'a') as f:
+        f.write("\n\ndef power(a, b):\n    return a ** b\n")
+    monkeypatch.undo()
+    assert summarize_file(file_path, cache)[-1] == FunctionInfo(
+        'power', [{'name': 'a', 'type': 'Any'}, {'name': 'b', 'type': 'Any'}])
+
+
+def test_summarize_directory_deduplicates_content(tmp_path, monkeypatch):
+    # Test that identical files are summarized once and share the summary
+    for name in ('a.py', 'b.py'):
+        shutil.copy('tests/test_files/test_file2.py', str(tmp_path / name))
+
+    calls = []
+
+    def counting_generate_summary(file_path, file_record=None):
+        calls.append(file_path)
+        return generate_summary_from_python_file(file_path, file_record)
+
+    monkeypatch.setattr(src.summary, 'generate_summary_from_python_file', counting_generate_summary)
+    actual = summarize_directory(str(tmp_path))
+
+    assert len(calls) == 1
+    assert actual[str(tmp_path / 'a.py')] == actual[str(tmp_path / 'b.py')]
+
+
+@pytest.mark.parametrize('encoding', ['latin-1', 'utf-16'])
+def test_summarize_directory_reads_files_in_their_encoding(tmp_path, monkeypatch, encoding):
+    # Test that files that are not UTF-8 are sent in the encoding sniffed for them
+    text = 'Notes for the caf\u00e9 menu, with cr\u00e8me br\u00fbl\u00e9e on the last line.\n' * 3
+    (tmp_path / 'NOTES').write_bytes(text.encode(encoding))
+    monkeypatch.setattr(src.summary, 'call_openai_api', lambda prompt, max_tokens=4096: prompt)
+
+    actual = summarize_directory(str(tmp_path))
+
+    assert 'caf\u00e9' in actual[str(tmp_path / 'NOTES')]
+
+
+def test_summary_batcher(monkeypatch):
+    # Test that small files share a request and missing answers fall back to single requests
+    prompts = []
+
+    def fake_call_openai_api(prompt, max_tokens=4096):
+        prompts.append(prompt)
+        if prompt.startswith("Summarize each"):
+            return 'Here you go: {"1": "Config for a.", "2": ""}'
+        return "Single summary."
+
+    monkeypatch.setattr(src.summary, 'call_openai_api', fake_call_openai_api)
+    batcher = SummaryBatcher(max_tokens=100, max_files=2)
+    first = batcher.add('a.yml', 'a: 1', 10)
+    second = batcher.add('b.yml', 'b: 2', 10)
+    third = batcher.add('c.yml', 'c: 3', 10)
+    assert first.done() and second.done() and not third.done()
+    batcher.flush()
+
+    assert first.result() == "Config for a."
+    assert second.result() == "Single summary."
+    assert third.result() == "Single summary."
+    assert len(prompts) == 3
+    assert batcher.requests == 1
+    assert batcher.batched_files == 1
+
+
+def test_parse_batch_response():
+    assert parse_batch_response('```json\n{"1": "A", "2": "B"}\n```') == {"1": "A", "2": "B"}
+    assert parse_batch_response('Not JSON') == {}
+    assert parse_batch_response('{"1": ') == {}
+
+
 def test_format_summaries():
     # Test that format_summary returns the correct string for a given summary
     summary = {
@@ -117,3 +248,34 @@ def test_format_summaries():
     print(actual)
     print(expected)
     assert actual == expected
+
+
+def run_all(tmp_path, monkeypatch, *options):
+    (tmp_path / 'a.py').write_text('def a():\n    pass\n')
+    (tmp_path / 'image.png').write_bytes(b'\x89PNG\r\n')
+    monkeypatch.setattr(sys, 'argv', ['main.py', str(tmp_path), '--all', '--no-cache', *options])
+    args = parse_arguments()
+    return run_summary(args, SummaryWriter(sys.stdout, args.max_tokens_out))
+
+
+def test_all_reports_progress_on_stderr(tmp_path, monkeypatch, capsys):
+    run_all(tmp_path, monkeypatch)
+    captured = capsys.readouterr()
+
+    document = captured.out[captured.out.index('Context:'):]
+    assert document.endswith('def a():\n    pass\n\n```\n\n')
+    assert 'Pipeline finished' in captured.err
+    assert 'image.png (6 B)' in captured.err
+
+
+@pytest.mark.parametrize('max_tokens_out', [5, 20])
+def test_all_stops_cleanly_in_the_directory_structure(tmp_path, monkeypatch, capsys, max_tokens_out):
+    _, num_tokens = run_all(tmp_path, monkeypatch, '-o', str(max_tokens_out))
+    captured = capsys.readouterr()
+    marker_tokens = estimate_tokens(STOP_MARKER.format(max_tokens=max_tokens_out))
+
+    assert num_tokens <= max_tokens_out
+    assert 'def a()' not in captured.out
+    # The marker is written only if it fits
+    assert ('[output stopped at' in captured.out) == (marker_tokens <= max_tokens_out)
+    assert f'the directory structure is over {max_tokens_out} tokens' in captured.err
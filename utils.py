@@ -1,6 +1,10 @@
 # src/utils.py
 import argparse
 import ast
+from file_processing import MAX_FILE_BYTES
+from preview import PREVIEW_BYTES, PREVIEW_LINES
+
+CACHE_COMMANDS = ('stats', 'prune', 'clear')
 
 
 def parse_arguments():
@@ -18,27 +22,115 @@ def parse_arguments():
         action='store_true',
         help='Write out all code'
     )
+    parser.add_argument(
+        '--batch-tokens',
+        type=int,
+        default=2000,
+        metavar='N',
+        help='Summarize small files together in requests of up to N prompt tokens (0 to disable)'
+    )
     parser.add_argument(
         '-cp', '--copy',
         action='store_true',
         help='Copy output to clipboard - requires pyperclip)'
     )
+    parser.add_argument(
+        '--blobless',
+        action='store_true',
+        help='Clone URLs without file contents, fetching them only as they are checked out'
+    )
+    parser.add_argument(
+        '--clone-depth',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Number of commits to clone from URLs, 0 for the whole history'
+    )
+    parser.add_argument(
+        '--git-index',
+        action='store_true',
+        help='List the files tracked by git instead of walking the directory (always on for cloned URLs)'
+    )
     parser.add_argument(
         '-i', '--ignore',
         metavar='pattern',
         nargs='+',
-        help='Ignore patterns (e.g. "*.pyc")'
+        help='Ignore patterns in .gitignore syntax (e.g. "*.pyc" "tests/")'
+    )
+    parser.add_argument(
+        '--incremental',
+        nargs='?',
+        const=True,
+        metavar='REV',
+        help='Only summarize the files changed since the last run, or since a git revision, '
+             'reusing the other summaries from the last run'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Number of files to summarize concurrently'
     )
     parser.add_argument(
         '-m', '--manual',
         action='store_true',
         help='Prompt user for all inputs. Helpful for pasting traceback.'
     )
+    parser.add_argument(
+        '--max-file-bytes',
+        type=int,
+        default=MAX_FILE_BYTES,
+        metavar='N',
+        help='Cut files printed in full after N bytes, 0 for no limit'
+    )
+    parser.add_argument(
+        '--max-retries',
+        type=int,
+        default=5,
+        help='Number of times to retry an OpenAI request after a rate limit or server error'
+    )
+    parser.add_argument(
+        '--max-total-bytes',
+        type=int,
+        default=0,
+        metavar='N',
+        help='Stop printing files in full after N bytes in all, 0 for no limit'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Summarize every file again instead of reusing summaries of unchanged files'
+    )
+    parser.add_argument(
+        '--no-clone-cache',
+        action='store_true',
+        help='Clone URLs into a temporary directory instead of reusing a cached clone'
+    )
     parser.add_argument(
         '-o', '--max-tokens-out',
         type=int,
-        default=4096,
-        help='Maximum tokens for output summary'
+        default=None,
+        help='Maximum tokens for output summary (default: 4096, no limit with --all)'
+    )
+    parser.add_argument(
+        '--output',
+        metavar='FILE',
+        help='Write the summary to a file instead of stdout'
+    )
+    parser.add_argument(
+        '--preview-bytes',
+        type=int,
+        default=PREVIEW_BYTES,
+        metavar='N',
+        help='Most bytes read from the start and from the end of a previewed data file'
+    )
+    parser.add_argument(
+        '--preview-lines',
+        type=int,
+        default=PREVIEW_LINES,
+        metavar='N',
+        help='Number of lines shown from the start and from the end of csv, tsv, jsonl, log and large json files'
     )
     parser.add_argument(
         '-pf', '--print-full',
@@ -52,6 +144,16 @@ def parse_arguments():
         nargs='+',
         help='Print full file content only for files matching the pattern (e.g. "test_")'
     )
+    parser.add_argument(
+        '--rev',
+        metavar='REV',
+        help='Summarize a branch, tag or commit from the git object database, without checking it out'
+    )
+    parser.add_argument(
+        '--rpm',
+        type=int,
+        help='Maximum OpenAI requests per minute'
+    )
     parser.add_argument(
         '-t', '--traceback',
         nargs='?',
@@ -59,10 +161,66 @@ def parse_arguments():
         metavar='traceback_text',
         help='Provide traceback text for context or leave it empty to read from stdin'
     )
+    parser.add_argument(
+        '--tpm',
+        type=int,
+        help='Maximum OpenAI tokens per minute, counting prompts and completions'
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        default=1,
+        metavar='N',
+        help='Number of processes that read and parse Python files'
+    )
 
     return parser.parse_args()
 
 
+def parse_cache_arguments(argv=None):
+    """
+    Parse the arguments of the `cache` subcommand.
+
+    Args:
+        argv (list, optional): The arguments after `cache`. Defaults to sys.argv.
+
+    Returns:
+        argparse.Namespace: The parsed arguments.
+    """
+
+    parser = argparse.ArgumentParser(
+        prog='codesumma cache',
+        description='Inspect or trim the OpenAI response cache.'
+    )
+    parser.add_argument(
+        'command',
+        choices=CACHE_COMMANDS,
+        help='stats: show size and hit rate, prune: apply the size limits, clear: remove every entry'
+    )
+    parser.add_argument(
+        '--path',
+        type=str,
+        help='Path to the cache database'
+    )
+    parser.add_argument(
+        '--max-bytes',
+        type=int,
+        help='Maximum total size of cached entries when pruning'
+    )
+    parser.add_argument(
+        '--max-entries',
+        type=int,
+        help='Maximum number of cached entries when pruning'
+    )
+    parser.add_argument(
+        '--ttl',
+        type=int,
+        help='Maximum age of cached entries in seconds when pruning'
+    )
+
+    return parser.parse_args(argv)
+
+
 def is_github_url(url):
     """
     Check if a URL is a GitHub URL.
@@ -77,6 +235,25 @@ def is_github_url(url):
     return url.startswith("https://github.com/") or url.startswith("git@github.com:")
 
 
+def is_repository_url(url):
+    """
+    Check if a path is a git repository URL to clone rather than a local path.
+
+    Args:
+        url (str): URL to check
+
+    Returns:
+        bool: True for GitHub URLs, file://, ssh:// and git:// URLs, and
+            http(s) URLs ending in .git, False otherwise.
+    """
+
+    return (
+        is_github_url(url)
+        or url.startswith(("file://", "ssh://", "git://"))
+        or (url.startswith(("https://", "http://")) and url.rstrip("/").endswith(".git"))
+    )
+
+
 class FunctionInfo:
     """
     A class to represent a function's name, arguments, and return type.